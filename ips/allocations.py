@@ -1,17 +1,124 @@
 import sqlite3
 import logging
 import json
-from datetime import datetime, timedelta
+import base64
+import csv
+import hashlib
+import os
+import ipaddress
+import threading
+import time
+import random
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
 
 logger = logging.getLogger("slices-backend")
 
+# SQLite tuning for the allocation store. Connections are long lived (one per
+# thread and database file) so the PRAGMAs below are only paid once.
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 128
+
+# Retries of a write transaction that could not get the write lock within the
+# busy timeout, with a randomized exponential backoff (in seconds).
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05
+
+# Format of allocation and expiration times (UTC)
+TIME_FORMAT = '%Y-%m-%d %H:%M:%SZ'
+
+# Number of expired allocations removed per transaction by the reaper
+REAP_BATCH_SIZE = 500
+
+# Length of the prefixes allocated to experiments unless asked otherwise
+DEFAULT_PREFIXLEN = 27
+
+# Number of allocations per page of `list_allocations` unless asked otherwise,
+# and number of rows fetched at a time by `iter_allocations`
+LIST_PAGE_SIZE = 100
+
+_local = threading.local()
+_registry_lock = threading.Lock()
+_registry = []
+
+def _connect(db_path):
+    """Open a new connection to `db_path` configured for concurrent use."""
+    conn = sqlite3.connect(db_path,
+                           timeout=BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None,
+                           check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA foreign_keys = ON")
+
+    with _registry_lock:
+        _registry.append(conn)
+    return conn
+
+def get_connection(db_path='network_data.db'):
+    """
+    Return the connection of the calling thread to `db_path`.
+
+    Connections are opened lazily, kept for the lifetime of the thread and
+    reused by every allocation function, so that statements stay prepared in
+    the connection cache. Connections inherited from a parent process (e.g.
+    uvicorn workers) are never reused.
+
+    Connections run in autocommit mode, use `transaction()` to group
+    statements.
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+
+    conn = _local.connections.get(db_path)
+    if conn is None:
+        conn = _connect(db_path)
+        _local.connections[db_path] = conn
+    return conn
+
+def close_connections():
+    """Close every connection opened by this process."""
+    with _registry_lock:
+        connections = list(_registry)
+        _registry.clear()
+
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.debug(f"Error closing connection: {e}")
+    _local.connections = {}
+
+@contextmanager
+def transaction(db_path='network_data.db', immediate=False):
+    """
+    Run a block of statements in a single transaction.
+
+    Yields a cursor on the thread connection. The transaction is committed
+    when the block exits normally and rolled back if it raises.
+
+    Args:
+        db_path (str): Path of the SQLite database.
+        immediate (bool): Take the write lock when the transaction starts
+            (`BEGIN IMMEDIATE`) instead of on the first write.
+    """
+    conn = get_connection(db_path)
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
 def create_allocations_table(conn):
     """Create the 'allocation' table in the SQLite database with automatic timestamp."""
     cursor = conn.cursor()
 
-    # Enable foreign key support
-    cursor.execute("PRAGMA foreign_keys = ON")
-
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS allocations (
         ip TEXT NOT NULL UNIQUE,
@@ -47,23 +154,492 @@ def create_ips_table(conn):
   )
   ''')
 
-def create_db(db_path='network_data.db'):
-    # Create/connect to SQLite database
-    conn = sqlite3.connect(db_path)
+def _migrate_free_lists(cursor):
+    """
+    Track free IPs and subnets with an `allocated` flag.
+
+    The flag is maintained by triggers on the allocations table and covered
+    by partial indexes that only contain free entries, so that picking the
+    next free IP or subnet is an index seek instead of a `NOT IN` scan.
+    """
+    for table, column, alloc_column in (("ips", "ip_address", "ip"),
+                                         ("subnets", "subnet", "prefix")):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN allocated INTEGER NOT NULL DEFAULT 0")
+        cursor.execute(f'''
+            UPDATE {table} SET allocated = 1
+            WHERE {column} IN (SELECT {alloc_column} FROM allocations)
+        ''')
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {table}_free
+            ON {table}({column}) WHERE allocated = 0
+        ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS allocations_insert AFTER INSERT ON allocations
+    BEGIN
+        UPDATE ips SET allocated = 1 WHERE ip_address = NEW.ip;
+        UPDATE subnets SET allocated = 1 WHERE subnet = NEW.prefix;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS allocations_delete AFTER DELETE ON allocations
+    BEGIN
+        UPDATE ips SET allocated = 0 WHERE ip_address = OLD.ip;
+        UPDATE subnets SET allocated = 0 WHERE subnet = OLD.prefix;
+    END
+    ''')
+
+def _migrate_expiration_index(cursor):
+    """Index allocations by expiration time for the expiry reaper."""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS allocations_expiration
+        ON allocations(expiration_time)
+    ''')
+
+def create_blocks_table(conn):
+  cursor = conn.cursor()
+
+  # Create table for the parent blocks prefixes are carved from
+  cursor.execute('''
+  CREATE TABLE IF NOT EXISTS blocks (
+      block TEXT PRIMARY KEY,
+      network INTEGER NOT NULL,
+      prefixlen INTEGER NOT NULL
+  )
+  ''')
+
+def _migrate_buddy_blocks(cursor):
+    """
+    Turn the subnets table into the free lists of a buddy allocator.
 
-    create_subnets_table(conn)
-    create_ips_table(conn)
-    create_allocations_table(conn)
+    Each row of `subnets` is an aligned block, free or allocated, described
+    by its integer network address and prefix length. Free blocks are
+    indexed by prefix length so that the smallest block large enough for a
+    request is found with an index seek, then split in halves down to the
+    requested length. Released blocks are merged back with their buddy.
+    """
+    cursor.execute("ALTER TABLE subnets ADD COLUMN network INTEGER")
+    cursor.execute("ALTER TABLE subnets ADD COLUMN prefixlen INTEGER")
 
-    # Commit and close connection
-    conn.commit()
-    conn.close()
+    rows = cursor.execute("SELECT subnet FROM subnets").fetchall()
+    for (subnet,) in rows:
+        network = ipaddress.IPv4Network(subnet)
+        cursor.execute('''
+            UPDATE subnets SET network = ?, prefixlen = ?
+            WHERE subnet = ?
+        ''', (int(network.network_address), network.prefixlen, subnet))
+
+    cursor.execute("DROP INDEX IF EXISTS subnets_free")
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS subnets_network
+        ON subnets(network, prefixlen)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS subnets_free
+        ON subnets(prefixlen, network) WHERE allocated = 0
+    ''')
+
+    create_blocks_table(cursor.connection)
+
+def _migrate_counters(cursor):
+    """
+    Maintain pool counters alongside the allocations.
+
+    Triggers keep, in the same transactions as the allocations:
+      - the number of IPs and of blocks of each prefix length, and how many
+        of them are free (`pool_counters`);
+      - the number of current leases per allocation hour (`lease_buckets`);
+      - the number of allocations and releases per hour over the last two
+        days (`pool_activity`).
+    Statistics are then read from a handful of rows instead of counting the
+    pool tables.
+    """
+    _create_counter_tables(cursor)
+
+    cursor.execute("DELETE FROM pool_counters")
+    cursor.execute('''
+        INSERT INTO pool_counters (pool, prefixlen, total, free)
+        SELECT 'ips', 32, COUNT(*), TOTAL(allocated = 0) FROM ips
+    ''')
+    cursor.execute('''
+        INSERT INTO pool_counters (pool, prefixlen, total, free)
+        SELECT 'subnets', prefixlen, COUNT(*), TOTAL(allocated = 0) FROM subnets
+        GROUP BY prefixlen
+    ''')
+    cursor.execute("DELETE FROM lease_buckets")
+    cursor.execute('''
+        INSERT INTO lease_buckets (hour, count)
+        SELECT CAST(strftime('%s', allocation_time) AS INTEGER) / 3600, COUNT(*)
+        FROM allocations
+        GROUP BY 1
+    ''')
+
+    _create_counter_triggers(cursor, "CAST(strftime('%s', {row}.allocation_time) AS INTEGER) / 3600")
+
+def _create_counter_tables(cursor):
+    """Create the tables of the counters of `_migrate_counters`."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS pool_counters (
+        pool TEXT NOT NULL,
+        prefixlen INTEGER NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        free INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (pool, prefixlen)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS lease_buckets (
+        hour INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS pool_activity (
+        hour INTEGER PRIMARY KEY,
+        allocated INTEGER NOT NULL DEFAULT 0,
+        released INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+
+def _create_counter_triggers(cursor, lease_hour):
+    """
+    Create the triggers maintaining the counters of `_migrate_counters`.
+
+    Args:
+        lease_hour (str): SQL expression of the hour a row of `allocations`
+            was allocated in, `{row}` standing for `NEW` or `OLD`, as the type
+            of `allocation_time` changed between schema versions.
+    """
+    for table, prefixlen in (("ips", "32"), ("subnets", "{row}.prefixlen")):
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_count_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO pool_counters (pool, prefixlen, total, free)
+            VALUES ('{table}', {prefixlen.format(row="NEW")}, 1, NEW.allocated = 0)
+            ON CONFLICT (pool, prefixlen) DO UPDATE
+            SET total = total + 1, free = free + excluded.free;
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_count_delete AFTER DELETE ON {table}
+        BEGIN
+            UPDATE pool_counters
+            SET total = total - 1, free = free - (OLD.allocated = 0)
+            WHERE pool = '{table}' AND prefixlen = {prefixlen.format(row="OLD")};
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_count_update AFTER UPDATE OF allocated ON {table}
+        WHEN OLD.allocated != NEW.allocated
+        BEGIN
+            UPDATE pool_counters
+            SET free = free + (NEW.allocated = 0) - (OLD.allocated = 0)
+            WHERE pool = '{table}' AND prefixlen = {prefixlen.format(row="NEW")};
+        END
+        ''')
+
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS allocations_stats_insert AFTER INSERT ON allocations
+    BEGIN
+        INSERT INTO lease_buckets (hour, count)
+        VALUES ({lease_hour.format(row="NEW")}, 1)
+        ON CONFLICT (hour) DO UPDATE SET count = count + 1;
+
+        INSERT INTO pool_activity (hour, allocated)
+        VALUES (CAST(strftime('%s', 'now') AS INTEGER) / 3600, 1)
+        ON CONFLICT (hour) DO UPDATE SET allocated = allocated + 1;
+
+        DELETE FROM pool_activity
+        WHERE hour < CAST(strftime('%s', 'now') AS INTEGER) / 3600 - 48;
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS allocations_stats_delete AFTER DELETE ON allocations
+    BEGIN
+        UPDATE lease_buckets SET count = count - 1
+        WHERE hour = {lease_hour.format(row="OLD")};
+        DELETE FROM lease_buckets WHERE count <= 0;
+
+        INSERT INTO pool_activity (hour, released)
+        VALUES (CAST(strftime('%s', 'now') AS INTEGER) / 3600, 1)
+        ON CONFLICT (hour) DO UPDATE SET released = released + 1;
+    END
+    ''')
+
+def _create_triggers(cursor):
+    """Create the triggers keeping the free lists and the counters up to date."""
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS allocations_insert AFTER INSERT ON allocations
+    BEGIN
+        UPDATE ips SET allocated = 1 WHERE ip_address = NEW.ip;
+        UPDATE subnets SET allocated = 1 WHERE network = NEW.network AND prefixlen = NEW.prefixlen;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS allocations_delete AFTER DELETE ON allocations
+    BEGIN
+        UPDATE ips SET allocated = 0 WHERE ip_address = OLD.ip;
+        UPDATE subnets SET allocated = 0 WHERE network = OLD.network AND prefixlen = OLD.prefixlen;
+    END
+    ''')
+
+    _create_counter_triggers(cursor, "{row}.allocation_time / 3600")
+
+def _create_tables(cursor):
+    """Create the pool and allocation tables, with integer addresses and epoch times."""
+    cursor.execute('''
+    CREATE TABLE ips (
+        ip_address INTEGER PRIMARY KEY,
+        allocated INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE subnets (
+        network INTEGER NOT NULL,
+        prefixlen INTEGER NOT NULL,
+        allocated INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (network, prefixlen)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE blocks (
+        network INTEGER NOT NULL,
+        prefixlen INTEGER NOT NULL,
+        PRIMARY KEY (network, prefixlen)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE allocations (
+        ip INTEGER NOT NULL UNIQUE,
+        network INTEGER NOT NULL,
+        prefixlen INTEGER NOT NULL,
+        owner TEXT NOT NULL,
+        allocation_time INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+        expiration_time INTEGER NOT NULL,
+        experiment_id TEXT NOT NULL UNIQUE,
+        UNIQUE (network, prefixlen),
+        FOREIGN KEY (ip) REFERENCES ips(ip_address),
+        FOREIGN KEY (network, prefixlen) REFERENCES subnets(network, prefixlen)
+    )
+    ''')
+
+def _create_indexes(cursor):
+    """Create the indexes of the free IPs and blocks and of the expiration times."""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS ips_free
+        ON ips(ip_address) WHERE allocated = 0
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS subnets_free
+        ON subnets(prefixlen, network) WHERE allocated = 0
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS allocations_expiration
+        ON allocations(expiration_time)
+    ''')
+
+def _migrate_integer_encoding(cursor):
+    """
+    Store addresses and prefixes as integers and times as epoch seconds.
+
+    The tables are rebuilt: IPs become the integer primary key of `ips`,
+    subnets and blocks are keyed by (network, prefixlen), and allocations
+    reference them by integers and record their allocation and expiration
+    times in seconds since the epoch (UTC).
+    """
+    cursor.connection.create_function("ip_to_int", 1, lambda ip: int(ipaddress.IPv4Address(ip)), deterministic=True)
+
+    for (trigger,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        cursor.execute(f"DROP TRIGGER {trigger}")
+
+    # Move the old tables out of the way, foreign keys follow the renames
+    for table in ("allocations", "blocks", "subnets", "ips"):
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_v4")
+
+    _create_tables(cursor)
+
+    cursor.execute('''
+        INSERT INTO ips (ip_address, allocated)
+        SELECT ip_to_int(ip_address), allocated FROM ips_v4
+    ''')
+    cursor.execute('''
+        INSERT INTO subnets (network, prefixlen, allocated)
+        SELECT network, prefixlen, allocated FROM subnets_v4
+    ''')
+    cursor.execute('''
+        INSERT INTO blocks (network, prefixlen)
+        SELECT network, prefixlen FROM blocks_v4
+    ''')
+    cursor.execute('''
+        INSERT INTO allocations (ip, network, prefixlen, owner, allocation_time, expiration_time, experiment_id)
+        SELECT ip_to_int(a.ip), s.network, s.prefixlen, a.owner,
+               CAST(strftime('%s', a.allocation_time) AS INTEGER),
+               CAST(strftime('%s', a.expiration_time) AS INTEGER),
+               a.experiment_id
+        FROM allocations_v4 a JOIN subnets_v4 s ON s.subnet = a.prefix
+    ''')
+
+    for table in ("allocations", "blocks", "subnets", "ips"):
+        cursor.execute(f"DROP TABLE {table}_v4")
+
+    _create_indexes(cursor)
+    _create_triggers(cursor)
+
+    # Blocks of databases created before the buddy allocator were never
+    # merged with their buddies
+    free = cursor.execute("SELECT network, prefixlen FROM subnets WHERE allocated = 0").fetchall()
+    for network, prefixlen in free:
+        _coalesce(cursor, network, prefixlen)
+
+def _migrate_pool_meta(cursor):
+    """Store metadata about the pool, such as the hash of the imported pool file."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS pool_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    ''')
+
+def _migrate_listing_indexes(cursor):
+    """Index allocations in listing order, overall and per owner."""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS allocations_listing
+        ON allocations(allocation_time, experiment_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS allocations_owner
+        ON allocations(owner, allocation_time, experiment_id)
+    ''')
+
+def _add_pool_block(cursor, network, prefixlen):
+    """Add a block to the `blocks` of the pool, merged with its buddies."""
+    while prefixlen > 0:
+        buddy = network ^ _block_size(prefixlen)
+        if not cursor.execute("DELETE FROM blocks WHERE network = ? AND prefixlen = ?",
+                              (buddy, prefixlen)).rowcount:
+            break
+        network, prefixlen = min(network, buddy), prefixlen - 1
+    cursor.execute("INSERT INTO blocks (network, prefixlen) VALUES (?, ?)", (network, prefixlen))
+
+def _create_block_triggers(cursor):
+    """Create the triggers counting the `blocks` of the pool per prefix length."""
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS blocks_count_insert AFTER INSERT ON blocks
+    BEGIN
+        INSERT INTO pool_counters (pool, prefixlen, total)
+        VALUES ('blocks', NEW.prefixlen, 1)
+        ON CONFLICT (pool, prefixlen) DO UPDATE SET total = total + 1;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS blocks_count_delete AFTER DELETE ON blocks
+    BEGIN
+        UPDATE pool_counters SET total = total - 1
+        WHERE pool = 'blocks' AND prefixlen = OLD.prefixlen;
+    END
+    ''')
+
+def _migrate_pool_blocks(cursor):
+    """
+    Keep the blocks of the pool, as imported, in `blocks`.
+
+    The table held the parent blocks added with `add_blocks`. It now holds
+    every block added to the pool, merged with its buddies but never split,
+    so that the capacity of the pool is counted the same whatever the
+    allocations split the free blocks into.
+    """
+    cursor.execute("DELETE FROM blocks")
+    _create_block_triggers(cursor)
+    cursor.execute("DELETE FROM pool_counters WHERE pool = 'blocks'")
+    for network, prefixlen in cursor.execute("SELECT network, prefixlen FROM subnets").fetchall():
+        _add_pool_block(cursor, network, prefixlen)
+
+# Schema migrations of existing databases, applied in order. The schema
+# version of a database is stored in `PRAGMA user_version` and is the number
+# of migrations applied. New databases are created directly in the schema they
+# lead to (see `_create_current_schema`), which a new migration must update.
+MIGRATIONS = [
+    _migrate_free_lists,
+    _migrate_expiration_index,
+    _migrate_buddy_blocks,
+    _migrate_counters,
+    _migrate_integer_encoding,
+    _migrate_pool_meta,
+    _migrate_listing_indexes,
+    _migrate_pool_blocks,
+]
+
+def migrate(cursor):
+    """Apply the migrations that have not been applied yet to the database."""
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    for migration in MIGRATIONS[version:]:
+        logger.debug(f"Applying schema migration {migration.__name__}.")
+        migration(cursor)
+
+    if version < len(MIGRATIONS):
+        cursor.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+def _create_current_schema(cursor):
+    """Create the tables of a new database in the schema `MIGRATIONS` lead to."""
+    _create_tables(cursor)
+    _create_indexes(cursor)
+    _create_counter_tables(cursor)
+    _migrate_pool_meta(cursor)
+    _migrate_listing_indexes(cursor)
+    _create_triggers(cursor)
+    _create_block_triggers(cursor)
+    cursor.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+def create_schema(db_path='network_data.db'):
+    """
+    Create the tables of the allocation store and bring them up to date.
+
+    A new database is created in the current schema, the tables of an existing
+    one are migrated (see `MIGRATIONS`).
+    """
+    with transaction(db_path, immediate=True) as cursor:
+        if cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0] == 0:
+            _create_current_schema(cursor)
+        else:
+            # Databases created before the migrations may lack tables
+            create_subnets_table(cursor.connection)
+            create_ips_table(cursor.connection)
+            create_allocations_table(cursor.connection)
+            migrate(cursor)
 
     logger.debug("Database and tables created successfully.")
 
-    data = load_json_file('pool.json')
-    add_ips(data["ips"])
-    add_subnets(data["subnets"])
+def _file_digest(file_path):
+    """Return the SHA-256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def create_db(db_path='network_data.db', pool_file='pool.json'):
+    """
+    Create the database and import the pool file into it.
+
+    The hash of the pool file is stored with the pool, so that the import is
+    skipped when the file didn't change since the last import.
+    """
+    # Create/connect to SQLite database
+    create_schema(db_path)
+
+    digest = _file_digest(pool_file)
+    with transaction(db_path, immediate=True) as cursor:
+        row = cursor.execute("SELECT value FROM pool_meta WHERE key = 'pool_hash'").fetchone()
+        if row and row[0] == digest:
+            logger.debug(f"Pool file '{pool_file}' unchanged, skipping import.")
+            return
+
+        _import_pool(cursor, pool_file)
+        cursor.execute('''
+            INSERT INTO pool_meta (key, value) VALUES ('pool_hash', ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        ''', (digest,))
     
     logger.debug("Tables populated successfully.")
 
@@ -81,6 +657,45 @@ class NoPrefixAvailable(AllocationError):
     def __init__(self, message="No available subnets (prefixes) for allocation."):
         super().__init__(message)
 
+class AllocationBusy(AllocationError):
+    """Raised when the database stayed locked by other writers for too long."""
+    def __init__(self, message="The allocation database is busy, try again later."):
+        super().__init__(message)
+
+@dataclass(frozen=True)
+class Allocation:
+    """An IP and prefix leased to an experiment."""
+    ip: str
+    prefix: str
+    owner: str
+    experiment_id: str
+    allocation_time: str
+    expiration_time: str
+
+def _is_busy(error):
+    return getattr(error, "sqlite_errorcode", None) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+def retry_on_busy(func, *args, **kwargs):
+    """
+    Call `func`, retrying it when the database is locked by another writer.
+
+    `func` must run its own transaction so that a retry starts from scratch.
+
+    Raises:
+        AllocationBusy: If the database is still locked after `BUSY_RETRIES`
+            retries.
+    """
+    for attempt in range(BUSY_RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            logger.debug(f"Database busy (attempt {attempt + 1}): {e}")
+            if attempt < BUSY_RETRIES:
+                time.sleep(BUSY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+    raise AllocationBusy()
+
 
 def load_json_file(file_path):
     """Load and return the contents of a JSON file."""
@@ -89,268 +704,837 @@ def load_json_file(file_path):
             data = json.load(f)
         return data
     except FileNotFoundError:
-        print(f"File not found: {file_path}")
+        logger.error(f"File not found: {file_path}")
     except json.JSONDecodeError as e:
-        print(f"Invalid JSON format: {e}")
+        logger.error(f"Invalid JSON format: {e}")
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
 
 
-def get_allocation(owner, experiment_id, duration=120, db_path='network_data.db'):
-    """Return the allocation details for a given experiment_id."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+_ALLOCATION_COLUMNS = "ip, network, prefixlen, owner, experiment_id, allocation_time, expiration_time"
 
-    try:
-        cursor.execute('''
-            SELECT ip, prefix, expiration_time 
-            FROM allocations
-            WHERE experiment_id = ?
-        ''', (experiment_id,))
+def _now():
+    return int(time.time())
 
-        allocation = cursor.fetchone()
+def _subnet(network, prefixlen):
+    return f"{ipaddress.IPv4Address(network)}/{prefixlen}"
 
-        if allocation:
-            ip, prefix, expiration_time = allocation
-        else:
-            ip, prefix, expiration_time = allocate_ip_to_subnet(owner=owner, experiment_id=experiment_id, duration=duration, db_path='network_data.db')
+def _format_time(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(TIME_FORMAT)
 
-        return {"ip": ip, "prefix": prefix, "expiration_time": expiration_time}
-    except sqlite3.Error as e:
-        logger.error(f"Error retrieving allocation for experiment_id '{experiment_id}': {e}")
-    finally:
-        conn.close()
+def _to_allocation(row):
+    """Build an `Allocation` from a row of `_ALLOCATION_COLUMNS`."""
+    ip, network, prefixlen, owner, experiment_id, allocation_time, expiration_time = row
+    return Allocation(ip=str(ipaddress.IPv4Address(ip)), prefix=_subnet(network, prefixlen),
+                      owner=owner, experiment_id=experiment_id,
+                      allocation_time=_format_time(allocation_time),
+                      expiration_time=_format_time(expiration_time))
 
-def allocate_ip_to_subnet(owner, experiment_id, duration=120, db_path='network_data.db'):
-    """Automatically allocate an IP from the 'ips' table and a subnet from the 'subnets' table."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA foreign_keys = ON")
+def _block_size(prefixlen):
+    return 1 << (32 - prefixlen)
+
+def _coalesce(cursor, network, prefixlen):
+    """
+    Merge a free block with its buddy, as long as the buddy is free too.
+
+    Returns:
+        tuple: The (network, prefixlen) of the largest free block the block
+        ended up in, or None if the block is not a free block of the pool
+        (e.g. it was already merged).
+    """
+    if not cursor.execute('''
+        SELECT 1 FROM subnets
+        WHERE network = ? AND prefixlen = ? AND allocated = 0
+    ''', (network, prefixlen)).fetchone():
+        return None
+
+    while prefixlen > 0:
+        buddy = network ^ _block_size(prefixlen)
+        merged = cursor.execute('''
+            DELETE FROM subnets
+            WHERE network = ? AND prefixlen = ? AND allocated = 0
+        ''', (buddy, prefixlen)).rowcount
+        if not merged:
+            break
+
+        cursor.execute("DELETE FROM subnets WHERE network = ? AND prefixlen = ?", (network, prefixlen))
+        network, prefixlen = min(network, buddy), prefixlen - 1
+        cursor.execute("INSERT INTO subnets (network, prefixlen) VALUES (?, ?)", (network, prefixlen))
+
+    return network, prefixlen
+
+def _split(cursor, network, prefixlen, target):
+    """
+    Split a free block down to a block of length `target`, giving the upper
+    halves back to the free lists.
+
+    Returns:
+        tuple: The (network, prefixlen) of the lowest block of length
+        `target` of the block.
+    """
+    if prefixlen == target:
+        return network, prefixlen
+
+    cursor.execute("DELETE FROM subnets WHERE network = ? AND prefixlen = ?", (network, prefixlen))
+    while prefixlen < target:
+        prefixlen += 1
+        upper = network + _block_size(prefixlen)
+        cursor.execute("INSERT INTO subnets (network, prefixlen) VALUES (?, ?)", (upper, prefixlen))
+
+    cursor.execute("INSERT INTO subnets (network, prefixlen) VALUES (?, ?)", (network, prefixlen))
+    return network, prefixlen
+
+def _delete_allocations(cursor, condition, params=()):
+    """
+    Delete the allocations matching an SQL condition and merge their prefixes
+    back into the free lists, within the transaction of `cursor`.
+
+    Returns:
+        list: The experiment ids of the deleted allocations.
+    """
+    rows = cursor.execute(f"SELECT rowid, network, prefixlen, experiment_id FROM allocations WHERE {condition}", params).fetchall()
+    for rowid, network, prefixlen, _ in rows:
+        cursor.execute("DELETE FROM allocations WHERE rowid = ?", (rowid,))
+        _coalesce(cursor, network, prefixlen)
+    return [experiment_id for _, _, _, experiment_id in rows]
+
+def _delete_expired(cursor, limit=-1):
+    """Delete up to `limit` expired allocations (all if negative), within the transaction of `cursor`."""
+    # Oldest first, the rowid makes the batch the same for both statements
+    expired = "SELECT rowid FROM allocations WHERE expiration_time < ? ORDER BY expiration_time, rowid LIMIT ?"
+    params = (_now(), limit)
+    rows = cursor.execute(f"SELECT network, prefixlen FROM allocations WHERE rowid IN ({expired})", params).fetchall()
+    cursor.execute(f"DELETE FROM allocations WHERE rowid IN ({expired})", params)
+    for network, prefixlen in rows:
+        _coalesce(cursor, network, prefixlen)
+    return len(rows)
+
+def _pick_free(cursor, query, params=()):
+    """
+    Return the first row of a free IP or subnet query.
+
+    Expired allocations are only removed by the reaper, so when nothing is
+    free they are reclaimed here before giving up, oldest first and
+    `REAP_BATCH_SIZE` at a time until something is free, so that a request
+    never pays for reclaiming a whole expired pool.
+    """
+    row = cursor.execute(query, params).fetchone()
+    while row is None and _delete_expired(cursor, REAP_BATCH_SIZE):
+        row = cursor.execute(query, params).fetchone()
+    return row
+
+def _allocate(cursor, owner, experiment_id, duration, prefixlen=DEFAULT_PREFIXLEN):
+    """Lease the first free IP and a free subnet to an experiment, within the transaction of `cursor`."""
+    # Get the first available IP that hasn't been allocated
+    ip_row = _pick_free(cursor, '''
+        SELECT ip_address FROM ips
+        WHERE allocated = 0
+        LIMIT 1
+    ''')
+
+    if ip_row is None:
+        raise NoIPAvailable()
+
+    ip = ip_row[0]
+
+    # Carve the subnet out of the smallest free block that is large enough
+    block_row = _pick_free(cursor, '''
+        SELECT network, prefixlen FROM subnets
+        WHERE allocated = 0 AND prefixlen <= ?
+        ORDER BY prefixlen DESC
+        LIMIT 1
+    ''', (prefixlen,))
+
+    if block_row is None:
+        raise NoPrefixAvailable()
+
+    network, prefixlen = _split(cursor, *block_row, prefixlen)
+
+    allocation_time = _now()
+    expiration_time = allocation_time + duration * 60
 
+    # Now insert the allocation
+    row = (ip, network, prefixlen, owner, experiment_id, allocation_time, expiration_time)
+    cursor.execute(f'''
+        INSERT INTO allocations ({_ALLOCATION_COLUMNS})
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', row)
+
+    allocation = _to_allocation(row)
+    logger.debug(f"Allocated IP {allocation.ip} to subnet {allocation.prefix} for owner '{owner}' in experiment '{experiment_id}'.")
+
+    return allocation
+
+def _get_or_allocate(owner, experiment_id, duration, prefixlen, db_path):
+    with transaction(db_path, immediate=True) as cursor:
+        row = cursor.execute(f'''
+            SELECT {_ALLOCATION_COLUMNS}
+            FROM allocations
+            WHERE experiment_id = ?
+        ''', (experiment_id,)).fetchone()
+
+        if row:
+            if row[-1] >= _now():
+                return _to_allocation(row)
+            # The allocation expired but hasn't been reaped yet
+            _delete_allocations(cursor, "experiment_id = ?", (experiment_id,))
+
+        return _allocate(cursor, owner, experiment_id, duration, prefixlen)
+
+def _get_or_allocate_many(requests, duration, best_effort, prefixlen, db_path):
+    allocations = {}
+    errors = {}
+    with transaction(db_path, immediate=True) as cursor:
+        for owner, experiment_id in requests:
+            row = cursor.execute(f'''
+                SELECT {_ALLOCATION_COLUMNS}
+                FROM allocations
+                WHERE experiment_id = ?
+            ''', (experiment_id,)).fetchone()
+
+            if row:
+                if row[-1] >= _now():
+                    allocations[experiment_id] = _to_allocation(row)
+                    continue
+                _delete_allocations(cursor, "experiment_id = ?", (experiment_id,))
+
+            try:
+                allocations[experiment_id] = _allocate(cursor, owner, experiment_id, duration, prefixlen)
+            except AllocationError as e:
+                if not best_effort:
+                    raise
+                errors[experiment_id] = e
+    return allocations, errors
+
+def allocate_many(requests, duration=120, best_effort=False, prefixlen=DEFAULT_PREFIXLEN, db_path='network_data.db'):
+    """
+    Get or allocate an IP and a subnet for many experiments in a single
+    transaction.
+
+    Args:
+        requests (list): (owner, experiment_id) pairs.
+        duration (int): Lifetime of new allocations, in minutes.
+        best_effort (bool): When False, nothing is allocated unless every
+            experiment can be served. When True, experiments that cannot be
+            served are reported in the errors and the others are allocated.
+        prefixlen (int): Length of the subnets of new allocations.
+        db_path (str): Path of the SQLite database.
+
+    Returns:
+        tuple: A dict mapping experiment ids to their `Allocation` and a dict
+        mapping the experiment ids that could not be served to the
+        `AllocationError` explaining why.
+
+    Raises:
+        NoIPAvailable: If no IP is free and `best_effort` is False.
+        NoPrefixAvailable: If no subnet is free and `best_effort` is False.
+        AllocationBusy: If the database stayed locked by other writers.
+        AllocationError: On any other database error.
+    """
     try:
-        # Get the first available IP that hasn't been allocated
-        cursor.execute('''
-            SELECT ip_address FROM ips
-            WHERE ip_address NOT IN (SELECT ip FROM allocations)
-            LIMIT 1
-        ''')
-        ip_row = cursor.fetchone()
+        return retry_on_busy(_get_or_allocate_many, list(requests), duration, best_effort, prefixlen, db_path)
+    except sqlite3.Error as e:
+        logger.error(f"Error allocating a batch of experiments: {e}")
+        raise AllocationError(str(e)) from e
 
-        if ip_row is None:
-            raise NoIPAvailable()
+def _release_many(experiment_ids, db_path):
+    released = []
+    with transaction(db_path, immediate=True) as cursor:
+        for experiment_id in experiment_ids:
+            released.extend(_delete_allocations(cursor, "experiment_id = ?", (experiment_id,)))
+    return released
 
-        ip = ip_row[0]
+def release_many(experiment_ids, db_path='network_data.db'):
+    """
+    Delete the allocations of many experiments in a single transaction.
 
-        # Get the first available subnet that hasn't been allocated
-        cursor.execute('''
-            SELECT subnet FROM subnets
-            WHERE subnet NOT IN (SELECT prefix FROM allocations)
-            LIMIT 1
-        ''')
-        prefix_row = cursor.fetchone()
+    Returns:
+        list: The experiment ids that had an allocation.
+    """
+    try:
+        released = retry_on_busy(_release_many, list(experiment_ids), db_path)
+    except sqlite3.Error as e:
+        logger.error(f"Error releasing a batch of experiments: {e}")
+        raise AllocationError(str(e)) from e
 
-        if prefix_row is None:
-            raise NoPrefixAvailable()
+    logger.debug(f"Released {len(released)} allocation(s).")
+    return released
 
-        prefix = prefix_row[0]
+def get_allocation(owner, experiment_id, duration=120, prefixlen=DEFAULT_PREFIXLEN, db_path='network_data.db'):
+    """
+    Return the allocation of an experiment, allocating an IP and a subnet to
+    it if it has none yet.
 
-        allocation_time = datetime.utcnow()
-        expiration_time = allocation_time + timedelta(minutes=duration)
+    The lookup and the allocation run in a single `BEGIN IMMEDIATE`
+    transaction, so concurrent callers, including other processes sharing the
+    database, can never lease the same IP or subnet twice.
 
-        # Format timestamps as string
-        allocation_time_str = allocation_time.strftime('%Y-%m-%d %H:%M:%S') + 'Z'
-        expiration_time_str = expiration_time.strftime('%Y-%m-%d %H:%M:%S') + 'Z'
+    Args:
+        owner (str): Owner recorded for a new allocation.
+        experiment_id (str): Experiment the allocation belongs to.
+        duration (int): Lifetime of a new allocation, in minutes.
+        prefixlen (int): Length of the subnet of a new allocation.
+        db_path (str): Path of the SQLite database.
 
+    Returns:
+        Allocation: The existing or newly created allocation.
 
-        # Now insert the allocation
-        cursor.execute('''
-            INSERT INTO allocations (ip, prefix, owner, experiment_id, allocation_time, expiration_time)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (ip, prefix, owner, experiment_id, allocation_time_str, expiration_time_str))
+    Raises:
+        NoIPAvailable: If no IP is free.
+        NoPrefixAvailable: If no subnet is free.
+        AllocationBusy: If the database stayed locked by other writers.
+        AllocationError: On any other database error.
+    """
+    try:
+        return retry_on_busy(_get_or_allocate, owner, experiment_id, duration, prefixlen, db_path)
+    except sqlite3.Error as e:
+        logger.error(f"Error retrieving allocation for experiment_id '{experiment_id}': {e}")
+        raise AllocationError(str(e)) from e
+
+def _allocate_new(owner, experiment_id, duration, prefixlen, db_path):
+    with transaction(db_path, immediate=True) as cursor:
+        return _allocate(cursor, owner, experiment_id, duration, prefixlen)
 
-        conn.commit()
-        logger.debug(f"Allocated IP {ip} to subnet {prefix} for owner '{owner}' in experiment '{experiment_id}'.")
+def allocate_ip_to_subnet(owner, experiment_id, duration=120, prefixlen=DEFAULT_PREFIXLEN, db_path='network_data.db'):
+    """
+    Automatically allocate an IP from the 'ips' table and a subnet from the 'subnets' table.
 
+    Raises:
+        AllocationError: If the experiment already has an allocation.
+    """
+    try:
+        return retry_on_busy(_allocate_new, owner, experiment_id, duration, prefixlen, db_path)
     except sqlite3.IntegrityError as e:
         logger.debug(f"Allocation failed: {e}")
-    finally:
-        conn.close()
-
-    return (ip, prefix, expiration_time_str)
+        raise AllocationError(f"Experiment '{experiment_id}' already has an allocation.") from e
 
 def get_all_allocations(db_path='network_data.db'):
     """
-    Retrieve all allocations from the allocation table.
+    Retrieve all allocations from the allocation table that have not expired.
     
     Returns:
-        List of tuples: Each tuple contains (ip, prefix, owner, allocation_time, experiment_id, expiration_time)
+        List of tuples: Each tuple contains (ip, prefix, owner, allocation_time, expiration_time, experiment_id)
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn = get_connection(db_path)
 
     try:
-        cursor.execute("SELECT * FROM allocations")
-        allocations = cursor.fetchall()  # Get all rows
-        return allocations
+        rows = conn.execute(f"SELECT {_ALLOCATION_COLUMNS} FROM allocations WHERE expiration_time >= ?", (_now(),))
+        return [(a.ip, a.prefix, a.owner, a.allocation_time, a.expiration_time, a.experiment_id)
+                for a in map(_to_allocation, rows)]
 
     except sqlite3.Error as e:
-        print(f"Error fetching allocations: {e}")
+        logger.error(f"Error fetching allocations: {e}")
         return []
 
-    finally:
-        conn.close()
 
+def _encode_cursor(allocation_time, experiment_id):
+    """Return the opaque cursor pointing after an allocation in listing order."""
+    key = json.dumps([allocation_time, experiment_id]).encode()
+    return base64.urlsafe_b64encode(key).decode()
+
+def _decode_cursor(cursor):
+    """Return the (allocation_time, experiment_id) key of a cursor."""
+    try:
+        allocation_time, experiment_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(allocation_time, int) or not isinstance(experiment_id, str):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor '{cursor}'.") from None
+    return allocation_time, experiment_id
+
+def _listing_query(owner, within, expiring_before, after):
+    """
+    Build the query listing the current allocations matching the filters, in
+    (allocation_time, experiment_id) order.
+
+    Raises:
+        ValueError: If `within` is not a valid prefix or `after` not a valid
+            cursor.
+    """
+    conditions = ["expiration_time >= ?"]
+    params = [_now()]
+
+    if owner is not None:
+        conditions.append("owner = ?")
+        params.append(owner)
+    if within is not None:
+        network = ipaddress.IPv4Network(within, strict=False)
+        base = int(network.network_address)
+        conditions.append("network >= ? AND network < ? AND prefixlen >= ?")
+        params.extend((base, base + network.num_addresses, network.prefixlen))
+    if expiring_before is not None:
+        if expiring_before.tzinfo is None:
+            expiring_before = expiring_before.replace(tzinfo=timezone.utc)
+        conditions.append("expiration_time < ?")
+        params.append(int(expiring_before.timestamp()))
+    if after is not None:
+        conditions.append("(allocation_time, experiment_id) > (?, ?)")
+        params.extend(_decode_cursor(after))
+
+    query = (f"SELECT {_ALLOCATION_COLUMNS} FROM allocations WHERE {' AND '.join(conditions)} "
+             "ORDER BY allocation_time, experiment_id")
+    return query, params
+
+def list_allocations(owner=None, within=None, expiring_before=None, after=None,
+                     limit=LIST_PAGE_SIZE, db_path='network_data.db'):
+    """
+    Return a page of the current allocations, oldest first.
+
+    Pages are delimited by the (allocation_time, experiment_id) key of their
+    last allocation, so that fetching a page costs the same wherever it is in
+    the listing, and allocations made or released between two pages neither
+    shift nor repeat rows.
+
+    Args:
+        owner (str): Only list the allocations of this owner.
+        within (str): Only list the allocations whose prefix is within this
+            prefix, in CIDR notation.
+        expiring_before (datetime): Only list the allocations expiring before
+            this time (UTC if naive).
+        after (str): Cursor returned with the previous page, or None for the
+            first page.
+        limit (int): Maximum number of allocations in the page.
+
+    Returns:
+        tuple: The list of `Allocation` of the page and the cursor of the next
+        page, or None if this is the last page.
+
+    Raises:
+        ValueError: If `within` is not a valid prefix or `after` not a valid
+            cursor.
+    """
+    query, params = _listing_query(owner, within, expiring_before, after)
+    conn = get_connection(db_path)
+    rows = conn.execute(f"{query} LIMIT ?", (*params, limit + 1)).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1][5], rows[-1][4])
+    return [_to_allocation(row) for row in rows], next_cursor
+
+def iter_allocations(owner=None, within=None, expiring_before=None, after=None,
+                     db_path='network_data.db'):
+    """
+    Iterate over all the current allocations matching the filters, oldest first.
+
+    Takes the same filters as `list_allocations`. Rows come from a single
+    query on a dedicated connection, fetched `LIST_PAGE_SIZE` at a time, so
+    the iteration sees a consistent snapshot and its memory does not grow
+    with the table. The iterator may be advanced from any thread, one at a
+    time.
+
+    Raises:
+        ValueError: If `within` is not a valid prefix or `after` not a valid
+            cursor (raised by this call, not by the iteration).
+    """
+    query, params = _listing_query(owner, within, expiring_before, after)
+
+    def rows():
+        conn = _connect(db_path)
+        try:
+            cursor = conn.execute(query, params)
+            while batch := cursor.fetchmany(LIST_PAGE_SIZE):
+                for row in batch:
+                    yield _to_allocation(row)
+        finally:
+            with _registry_lock:
+                if conn in _registry:
+                    _registry.remove(conn)
+            conn.close()
+
+    return rows()
 
 def delete_allocation(experiment_id, db_path='network_data.db'):
-    """Delete an allocation entry by experiment_id."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    """
+    Delete an allocation entry by experiment_id.
+
+    Returns:
+        int: The number of allocations deleted, 0 if the experiment had none.
 
+    Raises:
+        AllocationBusy: If the database stayed locked by other writers.
+        AllocationError: On any other database error.
+    """
     try:
         # Delete the allocation where the experiment_id matches
-        cursor.execute('''
-            DELETE FROM allocations WHERE experiment_id = ?
-        ''', (experiment_id,))
-
-        if cursor.rowcount == 0:
-            logger.debug(f"No allocation found with experiment_id '{experiment_id}'.")
-        else:
-            conn.commit()
-            logger.debug(f"Allocation with experiment_id '{experiment_id}' deleted successfully.")
-
+        rowcount = len(retry_on_busy(_release_many, [experiment_id], db_path))
     except sqlite3.Error as e:
-        logger.debug(f"Error deleting allocation: {e}")
-    finally:
-        conn.close()
+        logger.error(f"Error deleting allocation of experiment_id '{experiment_id}': {e}")
+        raise AllocationError(str(e)) from e
 
-    return cursor.rowcount
+    if rowcount == 0:
+        logger.debug(f"No allocation found with experiment_id '{experiment_id}'.")
+    else:
+        logger.debug(f"Allocation with experiment_id '{experiment_id}' deleted successfully.")
+    return rowcount
 
 def remaining_ips(db_path='network_data.db'):
     """Return the number of IPs that have not been allocated."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn = get_connection(db_path)
 
     try:
-        cursor.execute('''
-            SELECT COUNT(*) FROM ips
-            WHERE ip_address NOT IN (SELECT ip FROM allocations)
-        ''')
-        remaining_ip_count = cursor.fetchone()[0]
-        return remaining_ip_count
+        return conn.execute('''
+            SELECT COALESCE(SUM(free), 0) FROM pool_counters
+            WHERE pool = 'ips'
+        ''').fetchone()[0]
     except sqlite3.Error as e:
         logger.debug(f"Error retrieving remaining IPs: {e}")
-    finally:
-        conn.close()
     
 
-def remaining_subnets(db_path='network_data.db'):
-    """Return the number of subnets that have not been allocated."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def remaining_subnets(prefixlen=DEFAULT_PREFIXLEN, db_path='network_data.db'):
+    """Return the number of subnets of length `prefixlen` that can still be allocated."""
+    conn = get_connection(db_path)
 
     try:
-        cursor.execute('''
-            SELECT COUNT(*) FROM subnets
-            WHERE subnet NOT IN (SELECT prefix FROM allocations)
-        ''')
-        remaining_subnet_count = cursor.fetchone()[0]
-        return remaining_subnet_count
+        return conn.execute('''
+            SELECT COALESCE(SUM(free << (? - prefixlen)), 0) FROM pool_counters
+            WHERE pool = 'subnets' AND prefixlen <= ?
+        ''', (prefixlen, prefixlen)).fetchone()[0]
     except sqlite3.Error as e:
         logger.debug(f"Error retrieving remaining subnets: {e}")
-    finally:
-        conn.close()
 
-def remove_expired_allocations(db_path='network_data.db'):
+# Upper bounds (in hours) of the lease age histogram of pool_stats()
+LEASE_AGE_BUCKETS = (1, 6, 24, 72)
+
+def pool_stats(prefixlen=DEFAULT_PREFIXLEN, db_path='network_data.db'):
+    """
+    Return the capacity and pressure of the IP and prefix pools.
+
+    Only the counters maintained by triggers are read, and the leases that
+    expired but were not reaped yet, which are not counted as active, so the
+    cost does not depend on the size of the pools or on the number of
+    allocations.
+
+    Args:
+        prefixlen (int): Prefix length the prefix pool capacity is expressed in.
+        db_path (str): Path of the SQLite database.
+
+    Returns:
+        dict: For each pool (`ips`, `prefixes`) the total and free counts and
+        the estimated time to exhaustion in seconds (None if the pool isn't
+        shrinking), and for the leases (`leases`) the number of active leases,
+        their age distribution and the allocation and release rates per hour.
+    """
+    conn = get_connection(db_path)
+    now = int(time.time())
+    hour = now // 3600
+
+    counters = conn.execute("SELECT pool, prefixlen, total, free FROM pool_counters").fetchall()
+    buckets = dict(conn.execute("SELECT hour, count FROM lease_buckets").fetchall())
+    for bucket, count in conn.execute('''
+        SELECT allocation_time / 3600, COUNT(*)
+        FROM allocations
+        WHERE expiration_time <= ?
+        GROUP BY 1
+    ''', (now,)):
+        buckets[bucket] -= count
+    activity = conn.execute('''
+        SELECT COALESCE(SUM(allocated), 0), COALESCE(SUM(released), 0)
+        FROM pool_activity
+        WHERE hour >= ?
+    ''', (hour - 1,)).fetchone()
+
+    ips_total = sum(total for pool, _, total, _ in counters if pool == "ips")
+    ips_free = sum(free for pool, _, _, free in counters if pool == "ips")
+    subnets = [(length, total, free) for pool, length, total, free in counters if pool == "subnets"]
+    blocks = [(length, total) for pool, length, total, _ in counters if pool == "blocks"]
+
+    age = {f"<{bound}h": 0 for bound in LEASE_AGE_BUCKETS}
+    age[f">={LEASE_AGE_BUCKETS[-1]}h"] = 0
+    for bucket, count in buckets.items():
+        hours = hour - bucket
+        label = next((f"<{bound}h" for bound in LEASE_AGE_BUCKETS if hours < bound), f">={LEASE_AGE_BUCKETS[-1]}h")
+        age[label] += count
+
+    active = sum(buckets.values())
+    return _format_stats(now, prefixlen, ips_total, ips_free, subnets, blocks, active, age, *activity)
+
+def _format_stats(now, prefixlen, ips_total, ips_free, subnets, blocks, active, age, allocated, released):
+    """
+    Build the result of `pool_stats` from the pool counters.
+
+    Args:
+        subnets (list): (prefixlen, total, free) block counts per prefix length.
+        blocks (list): (prefixlen, total) counts of the blocks of the pool as
+            imported, which allocations don't split, per prefix length.
+        active (int): Number of leases.
+        age (dict): Number of leases per age bucket.
+        allocated (int): Allocations during the previous and the current hour.
+        released (int): Releases during the previous and the current hour.
+    """
+    prefixes_total = sum(total << (prefixlen - length) for length, total in blocks if length <= prefixlen)
+    prefixes_free = sum(free << (prefixlen - length) for length, _, free in subnets if length <= prefixlen)
+
+    # Net consumption rate over the previous and the current hour
+    window = 3600 + now % 3600
+    net_rate = (allocated - released) / window
+
+    def exhaustion(free):
+        return round(free / net_rate) if net_rate > 0 else None
+
+    return {
+        "ips": {
+            "total": ips_total,
+            "free": ips_free,
+            "seconds_to_exhaustion": exhaustion(ips_free),
+        },
+        "prefixes": {
+            "prefixlen": prefixlen,
+            "total": prefixes_total,
+            "free": prefixes_free,
+            "free_blocks": {f"/{length}": free for length, _, free in sorted(subnets) if free},
+            "seconds_to_exhaustion": exhaustion(prefixes_free),
+        },
+        "leases": {
+            "active": active,
+            "age": age,
+            "allocated_per_hour": round(allocated * 3600 / window, 1),
+            "released_per_hour": round(released * 3600 / window, 1),
+        },
+    }
+
+def _remove_expired_batch(batch_size, db_path):
+    with transaction(db_path, immediate=True) as cursor:
+        return _delete_expired(cursor, limit=batch_size)
+
+def remove_expired_allocations(db_path='network_data.db', batch_size=REAP_BATCH_SIZE):
     """
     Remove all allocations whose expiration_time is earlier than the current time.
+
+    Allocations are removed by batches of `batch_size`, each in its own
+    transaction, so that the write lock is never held for long.
+
+    Returns:
+        int: The number of allocations removed.
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    removed = 0
 
     try:
-        # Delete rows where expiration_time is in the past
-        cursor.execute('''
-            DELETE FROM allocations
-            WHERE expiration_time < CURRENT_TIMESTAMP
-        ''')
+        while True:
+            count = retry_on_busy(_remove_expired_batch, batch_size, db_path)
+            removed += count
+            if count < batch_size:
+                break
+    except (sqlite3.Error, AllocationBusy) as e:
+        logger.error(f"Database error while removing expired allocations: {e}")
+
+    logger.debug(f"Removed {removed} expired allocation(s).")
+    return removed
+
+def next_expiration(db_path='network_data.db'):
+    """
+    Return the earliest expiration time of the current allocations.
 
-        conn.commit()
-        print(f"Removed {cursor.rowcount} expired allocation(s).")
+    Returns:
+        datetime: The timezone-aware expiration time, or None if there is no
+        allocation.
+    """
+    conn = get_connection(db_path)
+    row = conn.execute("SELECT MIN(expiration_time) FROM allocations").fetchone()
+    if row[0] is None:
+        return None
+    return datetime.fromtimestamp(row[0], timezone.utc)
+
+# Kinds of entries of a pool file
+POOL_KINDS = ("ips", "subnets", "blocks")
+
+# Number of IPs inserted per executemany() call when importing a pool
+IMPORT_CHUNK_SIZE = 10000
+
+def _as_list(entries):
+    """Normalize a string or an iterable of strings to an iterable of strings."""
+    if isinstance(entries, str):
+        return [entries]
+    if isinstance(entries, (list, tuple)) or hasattr(entries, "__next__"):
+        return entries
+    raise ValueError("Input must be a string or a list of strings.")
+
+def _expand_ips(entries):
+    """
+    Yield the integer addresses of pool IP entries.
 
-    except sqlite3.Error as e:
-        print(f"Database error while removing expired allocations: {e}")
-    finally:
-        conn.close()
+    An entry is an address, a CIDR prefix (its usable host addresses) or an
+    inclusive `first-last` range of addresses.
+    """
+    for entry in entries:
+        entry = entry.strip()
+        if '-' in entry:
+            first, last = (int(ipaddress.IPv4Address(ip.strip())) for ip in entry.split('-', 1))
+            yield from range(first, last + 1)
+        elif '/' in entry:
+            network = ipaddress.IPv4Network(entry)
+            first, last = int(network.network_address), int(network.broadcast_address)
+            if network.prefixlen < 31:
+                first, last = first + 1, last - 1
+            yield from range(first, last + 1)
+        else:
+            yield int(ipaddress.IPv4Address(entry))
 
-def add_subnets(subnet_input, db_path='network_data.db'):
-    """Add one or more subnets to the 'subnets' table in the SQLite database."""
-    # Normalize input to a list
-    if isinstance(subnet_input, str):
-        subnet_list = [subnet_input]
-    elif isinstance(subnet_input, list):
-        subnet_list = subnet_input
+def _insert_ips(cursor, entries):
+    """Insert the IPs of pool entries that are not in the pool yet, returns the number inserted."""
+    cursor.executemany("INSERT OR IGNORE INTO ips (ip_address) VALUES (?)",
+                       ((ip,) for ip in _expand_ips(entries)))
+    return cursor.rowcount
+
+def _insert_subnet(cursor, subnet):
+    network = ipaddress.IPv4Network(subnet)
+    if _overlaps(cursor, int(network.network_address), network.prefixlen):
+        logger.debug(f"Subnet '{subnet}' already exists in the database. Skipping.")
+        return
+    _add_free_block(cursor, network)
+
+def _insert_block(cursor, block):
+    network = ipaddress.IPv4Network(block)
+    address, prefixlen = int(network.network_address), network.prefixlen
+    if _covered(cursor, address, prefixlen):
+        logger.debug(f"Block '{block}' already exists in the database. Skipping.")
+        return
+
+    # Add the parts of the block that are not in the pool yet
+    parts = [network]
+    for inner in _blocks_within(cursor, address, prefixlen):
+        inner = ipaddress.IPv4Network(inner)
+        parts = [part
+                 for free in parts
+                 for part in (free.address_exclude(inner) if inner.subnet_of(free) else [free])]
+    for part in parts:
+        _add_free_block(cursor, part)
+
+def read_pool(file_path):
+    """
+    Yield the (kind, entry) pairs of a pool file, kind being one of `POOL_KINDS`.
+
+    JSON files map each kind to a list of entries, like `pool.json`. They are
+    parsed whole, entries being ranges and prefixes that keep them small; a
+    pool listing too many entries for memory goes in a CSV file. CSV files
+    are read line by line and have one `kind,entry` pair per line, lines
+    starting with `#` being ignored.
+
+    Raises:
+        OSError: If the file can't be opened.
+        ValueError: If a JSON file is not an object of lists of entries.
+    """
+    if file_path.endswith('.csv'):
+        with open(file_path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if not row or row[0].lstrip().startswith('#'):
+                    continue
+                yield row[0].strip(), row[1].strip()
     else:
-        raise ValueError("Input must be a string or a list of strings.")
+        with open(file_path, 'r', encoding='utf-8') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON in the pool file {file_path}: {e}") from e
+        if not isinstance(data, dict):
+            raise ValueError(f"The pool file {file_path} must hold a JSON object, mapping {', '.join(POOL_KINDS)} to lists.")
+        for kind in POOL_KINDS:
+            for entry in data.get(kind, []):
+                yield kind, entry
+
+def _import_pool(cursor, file_path):
+    counts = dict.fromkeys(POOL_KINDS, 0)
+    ips = []
+    for kind, entry in read_pool(file_path):
+        if kind == "ips":
+            ips.append(entry)
+            if len(ips) >= IMPORT_CHUNK_SIZE:
+                counts["ips"] += _insert_ips(cursor, ips)
+                ips = []
+        elif kind == "subnets":
+            _insert_subnet(cursor, entry)
+            counts["subnets"] += 1
+        elif kind == "blocks":
+            _insert_block(cursor, entry)
+            counts["blocks"] += 1
+        else:
+            raise ValueError(f"Unknown pool entry kind '{kind}' in {file_path}.")
+    counts["ips"] += _insert_ips(cursor, ips)
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    logger.debug(f"Imported {file_path}: {counts}.")
+    return counts
 
-    for subnet in subnet_list:
-        try:
-            cursor.execute("INSERT INTO subnets (subnet) VALUES (?)", (subnet,))
-        except sqlite3.IntegrityError:
-            logger.debug(f"Subnet '{subnet}' already exists in the database. Skipping.")
+def import_pool(file_path, db_path='network_data.db'):
+    """
+    Import the IPs, subnets and blocks of a pool file in a single transaction.
 
-    conn.commit()
-    conn.close()
-    logger.debug("Subnet(s) added.")
+    IP entries are expanded and inserted in bulk, entries already in the
+    pool are skipped. See `read_pool` for the supported file formats.
 
-def add_ips(ip_input, db_path='network_data.db'):
-    """Add one or more IP addresses to the 'ips' table in the SQLite database."""
-    # Normalize input to a list
-    if isinstance(ip_input, str):
-        ip_list = [ip_input]
-    elif isinstance(ip_input, list):
-        ip_list = ip_input
-    else:
-        raise ValueError("Input must be a string or a list of strings.")
+    Returns:
+        dict: The number of new IPs and of subnet and block entries read.
+    """
+    with transaction(db_path, immediate=True) as cursor:
+        return _import_pool(cursor, file_path)
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def add_subnets(subnet_input, db_path='network_data.db'):
+    """Add one or more subnets to the 'subnets' table in the SQLite database."""
+    subnet_list = _as_list(subnet_input)
 
-    for ip in ip_list:
-        try:
-            cursor.execute("INSERT INTO ips (ip_address) VALUES (?)", (ip,))
-        except sqlite3.IntegrityError:
-            logger.debug(f"IP '{ip}' already exists in the database. Skipping.")
+    with transaction(db_path) as cursor:
+        for subnet in subnet_list:
+            _insert_subnet(cursor, subnet)
 
-    conn.commit()
-    conn.close()
-    logger.debug("IP address(es) added.")
+    logger.debug("Subnet(s) added.")
 
+def _covered(cursor, network, prefixlen):
+    """Whether a block is part of a block of the pool, itself included."""
+    for length in range(prefixlen + 1):
+        parent = network & ~(_block_size(length) - 1)
+        if cursor.execute("SELECT 1 FROM subnets WHERE network = ? AND prefixlen = ?", (parent, length)).fetchone():
+            return True
+    return False
+
+def _blocks_within(cursor, network, prefixlen):
+    """Return the blocks of the pool that are part of a block."""
+    return cursor.execute('''
+        SELECT network, prefixlen FROM subnets
+        WHERE network BETWEEN ? AND ?
+    ''', (network, network + _block_size(prefixlen) - 1)).fetchall()
+
+def _overlaps(cursor, network, prefixlen):
+    """Whether a block shares addresses with the blocks of the pool."""
+    return _covered(cursor, network, prefixlen) or bool(_blocks_within(cursor, network, prefixlen))
+
+def _add_free_block(cursor, network):
+    """Add a free block to the pool and merge it with its buddies."""
+    address, prefixlen = int(network.network_address), network.prefixlen
+    cursor.execute("INSERT INTO subnets (network, prefixlen) VALUES (?, ?)", (address, prefixlen))
+    _coalesce(cursor, address, prefixlen)
+    _add_pool_block(cursor, address, prefixlen)
+
+def add_blocks(block_input, db_path='network_data.db'):
+    """
+    Add one or more parent blocks to carve subnets from.
 
-if __name__ == '__main__':
-  if not logger.hasHandlers():
-    handler = logging.StreamHandler()
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    The parts of the blocks that are not in the pool yet are added as free
+    blocks. They are split on demand to serve prefixes of any length and
+    merged back when the prefixes are released.
+    """
+    block_list = _as_list(block_input)
 
-  create_db(db_path='network_data.db')
+    with transaction(db_path) as cursor:
+        for block in block_list:
+            _insert_block(cursor, block)
 
- 
+    logger.debug("Block(s) added.")
 
-  # remove_old_allocations(duration_minutes=1)
-  remove_expired_allocations()
-  logger.info(f"remaining IPs: {remaining_ips()}")
-  logger.info(f"remaining subnets: {remaining_subnets()}")
+def add_ips(ip_input, db_path='network_data.db'):
+    """
+    Add one or more IP addresses to the 'ips' table in the SQLite database.
+
+    Entries can be addresses, CIDR prefixes or `first-last` ranges, and are
+    inserted in bulk in a single transaction. IPs already in the table are
+    skipped.
 
-  for i in range(100):
-    xp = f"xp_{i}"
+    Returns:
+        int: The number of IPs added.
+    """
+    ip_list = _as_list(ip_input)
 
-    a = get_allocation(owner="dsaucezi", experiment_id=xp, duration=1)
-    logger.info(f"allocation for {xp} is {a}")
+    with transaction(db_path) as cursor:
+        added = _insert_ips(cursor, ip_list)
 
-    logger.info(f"remaining IPs: {remaining_ips()}")
-    logger.info(f"remaining subnets: {remaining_subnets()}")
\ No newline at end of file
+    logger.debug(f"{added} IP address(es) added.")
+    return added
@@ -1,33 +1,49 @@
 from enum import Enum
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Depends, Security, status, Response, Request, Query
+from fastapi import FastAPI, HTTPException, Depends, Security, status, Response, Request, Query, Header
 from fastapi.security import APIKeyHeader
+from fastapi.concurrency import run_in_threadpool
 import logging
 from uvicorn.config import LOGGING_CONFIG
 
 from pydantic import IPvAnyAddress, BaseModel, Field, field_validator
 import traceback
+from dataclasses import asdict
 from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
 import ip as iplib
 from ipaddr import IPAddress, IPv4Network
 import json
-from typing import List, Optional
+import asyncio
+import time
+import hashlib
+from typing import Dict, List, Optional
 import itertools
-from starlette.responses import StreamingResponse
+from starlette.responses import StreamingResponse, JSONResponse
 from io import StringIO
 from io import BytesIO
 import zipfile
-import boto3
-from botocore.client import Config
 import uuid
-import paramiko
 import os
 import yaml
 import re
 
 import pos
 
-from allocations import create_db, get_allocation, AllocationError, NoIPAvailable, NoPrefixAvailable, delete_allocation, remove_expired_allocations, get_all_allocations
+from allocations import DEFAULT_PREFIXLEN, LIST_PAGE_SIZE, TIME_FORMAT, AllocationError, NoIPAvailable, NoPrefixAvailable
+from backends import load_backend
+from async_allocations import AsyncAllocations
+from reaper import ExpiryReaper
+from jsonstore import JsonStore
+from executors import BoundedExecutor, ExecutorSaturated
+from jobs import JobQueue, JobQueueFull
+from s3client import S3ClientManager
+from sshpool import SSHPool
+from kubeconfigs import load_kubeconfig_cache
+from r2lab import DeviceStateCache, parse_pdu_states, pdu_status_command
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+from auth import TokenCache, RoleIndex, load_token_verifier
 
 # ===== CORS 
 from fastapi.middleware.cors import CORSMiddleware
@@ -50,45 +66,21 @@ origins = [
 import jwt
 api_key_header = APIKeyHeader(name="Bearer", auto_error=False)
 
-def get_s3_bucket():
-    credentials = load_db(dbfile="/credentials.json")
+# Claims of the tokens already validated
+token_cache = TokenCache()
 
-    bucket=credentials["bucket"]
+# Tokens are verified against the key set of their issuer (see JWKS_URL)
+token_verifier = load_token_verifier(cache=token_cache)
 
-    s3 = boto3.resource('s3',
-                        endpoint_url=credentials['endpointUrl'],
-                        aws_access_key_id=credentials['accessKey'],
-                        aws_secret_access_key=credentials['secretKey'],
-                        config=Config(signature_version='s3v4'))
+# S3 client shared by the requests, rebuilt when /credentials.json changes
+s3 = S3ClientManager("/credentials.json")
 
-    bucket=credentials["bucket"]
-    s3_bucket = s3.Bucket(bucket)
-    return s3_bucket
+# SSH connections to the hosts the commands run on, kept open between requests
+ssh_pool = SSHPool()
 
 def run_ssh_command_with_key(hostname, port, username, key_path, command):
-    # Create a new SSH client
-    ssh = paramiko.SSHClient()
-
-    # Automatically add the host key if it's new
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
-    try:
-        # Connect to the server using an SSH key
-        # private_key = paramiko.RSAKey.from_private_key_file(key_path, password='Cu3skO2JawWLye6')
-        # ssh.connect(hostname, port=port, username=username, pkey=private_key)
-        ssh.connect(hostname, port=port, username=username, key_filename=key_path)
-
-        # Execute the command
-        stdin, stdout, stderr = ssh.exec_command(command)
-
-        # Get the output and error
-        output = stdout.read().decode()
-        error = stderr.read().decode()
-
-        return output, error
-    finally:
-        # Close the SSH connection
-        ssh.close()
+    """Run a command on a host over a pooled SSH connection and return its output, error output and exit status."""
+    return ssh_pool.run(hostname, port, username, key_path, command)
 
 def check_role(allowed_roles: List[str]):
     """
@@ -107,10 +99,10 @@ def check_role(allowed_roles: List[str]):
         HTTPException: If the user's role is not found among the allowed roles, 
         it raises a 403 Forbidden error.
     """
+    allowed = frozenset(allowed_roles)
+
     def role_checker(info: dict = Depends(validate_token)):
-        roles = [db["_roles"][role] for role in allowed_roles]
-        users = list(set(itertools.chain(*roles)))
-        if info["preferred_username"] not in users:
+        if not role_index.roles_of(info["preferred_username"]) & allowed:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="You do not have the required role"
@@ -118,19 +110,34 @@ def check_role(allowed_roles: List[str]):
         return info
     return role_checker
 
+def decode_token(token: str):
+    """
+    Verify a token and return its claims.
+
+    A token signed with an unknown key may fetch the key set, so async
+    handlers call this in the thread pool (`run_in_threadpool`).
+
+    Raises:
+        jwt.ExpiredSignatureError: If the token has expired.
+        jwt.InvalidTokenError: If the token is invalid.
+    """
+    return token_verifier.decode(token)
+
 def validate_token(token: str = Security(api_key_header)):
-    decoded = jwt.decode(token, options={'verify_signature': False})
-    # TBD check that it is correct!!!
-    
-    # Check if not expired
-    current_time = datetime.now(timezone.utc)
-    if current_time > datetime.fromtimestamp(decoded['exp'], timezone.utc):
+    try:
+        return decode_token(token)
+    except jwt.ExpiredSignatureError:
         raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Token has expired",
                     headers={"WWW-Authenticate": "Bearer"},
                 )
-    return decoded
+    except jwt.InvalidTokenError:
+        raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid token",
+                    headers={"WWW-Authenticate": "Bearer"},
+                )
 
 # def validate_token(request: Request, token: str = Security(api_key_header)):
 #     if request.url.path in ["/ns"]:
@@ -151,34 +158,30 @@ def validate_token(token: str = Security(api_key_header)):
 
 # ==============================================================================
 
-def load_db(dbfile='/db.json'):
-    """
-    Loads and returns the content of a JSON database file.
-
-    This function opens the specified JSON file and returns its content as a
-    dictionary. If no file name is specified, it defaults to '/db.json'.
+# The database is written back to DB_FILE in the background, shortly after
+# it changed. It defaults to the /db.json bind mounted by the README docker
+# command.
+DB_FILE = os.environ.get("DB_FILE", "/db.json")
+db_store = JsonStore(DB_FILE)
+db = db_store.load()
+role_index = RoleIndex(db_store)
 
-    Args:
-        dbfile (str): The path to the JSON file to be loaded. Defaults to '/db.json'.
-
-    Returns:
-        dict: The database. 
+backend = load_backend()
+backend.create()
 
-    Raises:
-        FileNotFoundError: If the specified file does not exist.
-        json.JSONDecodeError: If the file contents cannot be decoded into valid JSON.
-    """
-    with open(dbfile, 'r') as json_file:
-        loaded_db = json.load(json_file)
-    return loaded_db
+store = AsyncAllocations(backend)
 
-def save_db(dbfile='/db.json'):
-    with open(dbfile, "w") as file:
-        json.dump(db, file, indent=4)
+reaper = ExpiryReaper(store)
 
-db = load_db()
+# Blocking work of the handlers runs in these pools, so that it doesn't block
+# the event loop: rendering and zipping in the CPU pool, S3 and SSH calls in
+# the I/O pool
+cpu_executor = BoundedExecutor("cpu", int(os.environ.get("CPU_WORKERS", os.cpu_count() or 4)))
+io_executor = BoundedExecutor("io", int(os.environ.get("IO_WORKERS", 16)))
 
-create_db()
+# POS bundles are generated in the background by these workers, their state is
+# kept in a SQLite database so that clients can poll it
+pos_jobs = JobQueue(os.environ.get("JOBS_DB", "jobs.db"), workers=int(os.environ.get("POS_JOB_WORKERS", 2)))
 
 ClusterNames = Enum('name', {cluster: cluster for cluster in db.keys()})
 
@@ -238,44 +241,15 @@ logging.config.dictConfig(LOGGING_CONFIG)
 
 logger = logging.getLogger("slices-backend")
 
-async def _process_after_request(request: Request):
-    """
-    Executes a list of post-processing logic.
-
-    Args:
-        request (Request): The incoming HTTP request object, which provides access to details such as 
-            headers, query parameters, and body.
-    """
-    save_db()
-
-@app.middleware("http")
-async def add_process_after_request(request: Request, call_next):
-    """
-    Middleware to execute custom post-processing logic after the endpoint has been called.
-
-    This function is applied as an HTTP middleware. After every request executes
-    the `process_after_request` additional logic after the endpoint processing
-    is complete.
-
-    Args:
-        request (Request): The incoming HTTP request object, which provides access to details such as 
-            headers, query parameters, and body.
-        call_next (Callable): A callable that forwards the request to the next handler in the middleware
-            stack, eventually reaching the endpoint.
-
-    Returns:
-        Response: The final HTTP response object after the request has been processed by the endpoint
-            and any additional logic in this middleware.
-    """
-    response = await call_next(request)
-
-    await _process_after_request(request=request)
-    return response
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Code to run on startup
+    reaper.start()
+    db_store.start()
+    if token_verifier.key_set is not None:
+        token_verifier.key_set.start()
+    ssh_pool.start()
+    pos_jobs.start()
 
     yield  # This yields control to the app during its run
 
@@ -283,10 +257,30 @@ async def lifespan(app: FastAPI):
     await shutdown_method()  # Replace with your specific shutdown method
 
 async def shutdown_method():
-    save_db()
+    await reaper.stop()
+    await db_store.stop()
+    if token_verifier.key_set is not None:
+        await token_verifier.key_set.stop()
+    await ssh_pool.stop()
+    await pos_jobs.stop()
+    pos_jobs.close()
+    store.close()
+    backend.close()
+    cpu_executor.shutdown()
+    io_executor.shutdown()
+    s3.close()
+    ssh_pool.close()
 
 app.router.lifespan_context = lifespan
 
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(JobQueueFull)
+async def job_queue_full_handler(request: Request, exc: JobQueueFull):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
 def expiration_time(delta=60):
     """
     Calculate the expiration time in UTC.
@@ -342,15 +336,20 @@ async def get_reset(user: dict = Depends(check_role(["admin"]))):
                    will be raised to deny access.
     """
     global db
-    db = load_db()
+    db = db_store.load()
     return {"db": db}
 
-@app.post("/pos/script/")
-async def post_pos_script(data: pos.PosScriptData, user: dict = Depends(validate_token)):
-# async def post_pos_script(data: pos.PosScriptData, user: dict = Depends(check_role(["user"]))):
-    # Generate an ID
-    id=data.experiment_id
+def build_pos_bundle(data: pos.PosScriptData, user: dict, id: str):
+    """
+    Render the POS scripts of an experiment and return them zipped, in a
+    `BytesIO` positioned at its start, along with their digest (see
+    `bundle_digest`).
 
+    Raises:
+    HTTPException:
+    - 503 if the OAI configuration can't be generated from the parameters.
+    - 500 if generating it failed otherwise.
+    """
     # Prefix the namespaces to belong to the user
     match = re.search(r'_(\w+)$', id)
     xid=match.group(1)
@@ -429,41 +428,279 @@ async def post_pos_script(data: pos.PosScriptData, user: dict = Depends(validate
 
     zip_buffer.seek(0)
 
-    s3_bucket = get_s3_bucket()
-    s3_bucket.upload_fileobj(zip_buffer, f"{id}.zip")
+    return zip_buffer, bundle_digest(zip_buffer)
+
+def bundle_digest(zip_buffer):
+    """
+    Return the SHA-256 of the content of a zipped bundle: the names, modes and
+    contents of its files, but not their timestamps, so that the same scripts
+    always have the same digest.
+    """
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(zip_buffer) as zip_file:
+        for info in sorted(zip_file.infolist(), key=lambda info: info.filename):
+            digest.update(f"{info.filename}\0{info.external_attr}\0{info.file_size}\0".encode())
+            digest.update(zip_file.read(info))
+    zip_buffer.seek(0)
+    return digest.hexdigest()
+
+# Metadata of the S3 objects holding the digest of their bundle
+BUNDLE_DIGEST_METADATA = "bundle-sha256"
+
+def head_s3_object(client, bucket, key):
+    """Return the metadata of an object of the S3 bucket, or None if it doesn't exist."""
+    try:
+        return client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            return None
+        raise
+
+def store_bundle(fileobj, digest, key):
+    """
+    Store a zipped bundle in the S3 bucket under `key`.
+
+    Bundles are uploaded once, under `bundles/<digest>.zip`, and copied to
+    `key` within S3, so storing a bundle already uploaded for another
+    experiment costs no upload, and storing the bundle `key` already holds
+    costs a single HEAD request.
+
+    Args:
+        fileobj (BytesIO): The bundle.
+        digest (str): Its digest (see `bundle_digest`).
+        key (str): Key to store it under.
 
+    Returns:
+        str: `unchanged` if `key` already held the bundle, `copied` if it was
+        uploaded before, or `uploaded`.
+    """
+    client, bucket = s3.get()
+
+    current = head_s3_object(client, bucket, key)
+    if current is not None and current.get("Metadata", {}).get(BUNDLE_DIGEST_METADATA) == digest:
+        return "unchanged"
+
+    source = f"bundles/{digest}.zip"
+    result = "copied"
+    if head_s3_object(client, bucket, source) is None:
+        client.upload_fileobj(fileobj, bucket, source, Config=s3.transfer_config,
+                              ExtraArgs={"ContentType": "application/x-zip-compressed",
+                                         "Metadata": {BUNDLE_DIGEST_METADATA: digest}})
+        result = "uploaded"
+    # The metadata, and thus the digest, is copied along
+    client.copy_object(Bucket=bucket, Key=key, CopySource={"Bucket": bucket, "Key": source})
+    return result
+
+# Size of the chunks in which S3 objects are streamed to the clients
+S3_CHUNK_SIZE = 64 * 1024
+
+# Ranges passed on to S3, which only supports a single byte range
+single_byte_range = re.compile(r'bytes=(\d+-\d*|-\d+)$')
+
+def get_s3_object(key, byte_range=None, if_none_match=None):
+    """
+    Open an object of the S3 bucket, or a byte range of it.
+
+    Args:
+        key (str): Key of the object.
+        byte_range (str): Value of a `Range` header, if any.
+        if_none_match (str): Value of an `If-None-Match` header, if any.
+
+    Returns:
+        dict: The response of S3 `get_object`, whose `Body` streams the object.
+
+    Raises:
+        botocore.exceptions.ClientError: If the object doesn't exist
+        (`NoSuchKey`), the range is not satisfiable (`InvalidRange`), the
+        ETag of the object matches `if_none_match` (HTTP status 304), or S3
+        failed.
+    """
+    client, bucket = s3.get()
+    conditions = {}
+    if byte_range is not None:
+        conditions["Range"] = byte_range
+    if if_none_match is not None:
+        conditions["IfNoneMatch"] = if_none_match
+    return client.get_object(Bucket=bucket, Key=key, **conditions)
+
+def s3_body_streamer(body, chunk_size=S3_CHUNK_SIZE):
+    """Generator function to yield the content of an S3 object, `chunk_size` bytes at a time."""
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+@app.post("/pos/script/")
+async def post_pos_script(data: pos.PosScriptData, user: dict = Depends(validate_token),
+                          asynchronous: bool = Query(False, alias="async")):
+# async def post_pos_script(data: pos.PosScriptData, user: dict = Depends(check_role(["user"]))):
+    """
+    POST /pos/script/ endpoint to generate the POS scripts of an experiment
+    and store them as a zip file in the S3 storage.
+
+    The scripts are generated by a background job. Identical requests of a
+    user made while the job runs share it.
+
+    Parameters:
+    data (pos.PosScriptData): Description of the experiment.
+    async (bool): Optional query parameter to return as soon as the job is
+                  queued, with status 202, instead of when the scripts are
+                  stored. Poll `GET /pos/jobs/{job}` for its progress.
+    user (dict): Authenticated user information.
+
+    Returns:
+    dict: The identifier of the experiment, or with `async`, the identifier of
+    the job and its `Location`.
+
+    Example Response:
+    {"identifier": "my-experiment"}
+
+    or with `async`:
+    {"job": "0f4c6a1e8b...", "status": "queued"}
+
+    Raises:
+    HTTPException:
+    - 503 if too many jobs are waiting, or the storage can't be reached.
+    """
+    # Generate an ID
+    id=data.experiment_id
+    username = user["preferred_username"]
+
+    async def work(job):
+        async with job.stage("render"):
+            zip_buffer, digest = await cpu_executor.run(build_pos_bundle, data, user, id)
+        async with job.stage("upload"):
+            try:
+                result = await io_executor.run(store_bundle, zip_buffer, digest, f"{id}.zip")
+            except (ClientError, BotoCoreError, S3UploadFailedError, OSError, ValueError, KeyError) as e:
+                raise HTTPException(status_code=503, detail=f"Failed to store the scripts: {e}")
+        logger.info(f"POS scripts of {id}: {result} (sha256 {digest})")
+        return {"identifier": id, "digest": digest, "upload": result}
+
+    # The scripts only depend on the request and on the user
+    key = hashlib.sha256(f"{username}\0{data.model_dump_json()}".encode()).hexdigest()
+    job_id, future = await pos_jobs.submit("pos-script", username, work, key=key)
+
+    if asynchronous:
+        return JSONResponse(status_code=202, content={"job": job_id, "status": "queued"},
+                            headers={"Location": f"/pos/jobs/{job_id}"})
+
+    # A request that is cancelled doesn't cancel the job
+    await asyncio.shield(future)
     return {"identifier": id}
 
+@app.get("/pos/jobs/{id}")
+async def get_pos_job(id: str, user: dict = Depends(validate_token)):
+    """
+    GET /pos/jobs/{id} endpoint to retrieve the state of a job generating POS
+    scripts.
+
+    Parameters:
+    id (str): Identifier of the job.
+    user (dict): Authenticated user information.
+
+    Returns:
+    dict: The state of the job (`queued`, `running`, `succeeded` or `failed`),
+    the stage it is running, its times, the duration in seconds of its
+    finished stages, and its result or error.
+
+    Example Response:
+    {
+        "id": "0f4c6a1e8b...",
+        "kind": "pos-script",
+        "owner": "jdoe",
+        "status": "succeeded",
+        "stage": null,
+        "created": "2024-10-10 12:00:00Z",
+        "started": "2024-10-10 12:00:00Z",
+        "finished": "2024-10-10 12:00:02Z",
+        "stages": {"render": 0.85, "upload": 1.21},
+        "result": {"identifier": "my-experiment", "digest": "...", "upload": "uploaded"},
+        "error": null
+    }
+
+    Raises:
+    HTTPException:
+    - 404 if there is no such job, or it belongs to another user.
+    """
+    job = await asyncio.to_thread(pos_jobs.get, id)
+    username = user["preferred_username"]
+    if job is None or (job["owner"] != username and "admin" not in role_index.roles_of(username)):
+        raise HTTPException(status_code=404, detail=f"Job {id} not found")
+
+    for field in ("created", "started", "finished"):
+        if job[field] is not None:
+            job[field] = datetime.fromtimestamp(job[field], timezone.utc).strftime(TIME_FORMAT)
+    return job
+
 @app.get("/pos/script/{id}")
-async def get_pos_script(id: str, user: dict = Depends(validate_token)):
-    try:
-        s3_bucket = get_s3_bucket()
+async def get_pos_script(id: str, user: dict = Depends(validate_token),
+                         byte_range: Optional[str] = Header(default=None, alias="Range"),
+                         if_none_match: Optional[str] = Header(default=None)):
+    """
+    GET /pos/script/{id} endpoint to download the POS scripts of an experiment
+    as a zip file, streamed from the S3 storage.
 
-        dir = "xp"
-        os.makedirs("xp", exist_ok=True)
+    Parameters:
+    id (str): Identifier of the experiment.
+    Range (str): Optional header to only download a single byte range of the
+                 file, e.g. to resume a download (`bytes=start-end`).
+    If-None-Match (str): Optional header with the ETag of a copy of the file
+                         already downloaded.
 
-        s3_filename=f'{id}.zip'
-        tempfile_path = f'{dir}/{s3_filename}'
+    Returns:
+    StreamingResponse: The zip file, with its `ETag`, or the requested range
+    of it with status 206. Status 304 without content if the file still has
+    the ETag given in `If-None-Match`.
 
-        s3_bucket.download_file(f"{s3_filename}", f'{tempfile_path}')
+    Raises:
+    HTTPException:
+    - 404 if there are no scripts for the experiment.
+    - 416 if the requested range is not satisfiable.
+    - 503 if the storage can't be reached.
+    """
+    s3_filename=f'{id}.zip'
 
-        # Open the file in binary mode
-        file_like = open(tempfile_path, mode="rb")
+    # Other ranges are ignored and the whole file is sent
+    if byte_range is not None and not single_byte_range.match(byte_range.strip()):
+        byte_range = None
 
-        # Return the file as a streaming response
-        return StreamingResponse(file_like, media_type="application/x-zip-compressed", 
-                                    headers={"Content-Disposition": f"attachment; filename={s3_filename}"})
-    except Exception as e:
+    try:
+        s3_object = await io_executor.run(get_s3_object, s3_filename, byte_range=byte_range, if_none_match=if_none_match)
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304 or code == "304":
+            etag = e.response.get("ResponseMetadata", {}).get("HTTPHeaders", {}).get("etag", if_none_match)
+            return Response(status_code=304, headers={"ETag": etag})
+        if code in ("NoSuchKey", "404"):
+            raise HTTPException(status_code=404, detail=f"No scripts for experiment {id}")
+        if code == "InvalidRange":
+            raise HTTPException(status_code=416, detail="Requested range not satisfiable")
         raise HTTPException(status_code=503, detail=str(e))
-    finally:
-        # remove the temporary file
-        if os.path.exists(s3_filename):
-            os.remove(s3_filename)
+    except (BotoCoreError, OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    headers = {
+        "Content-Disposition": f"attachment; filename={s3_filename}",
+        "Content-Length": str(s3_object["ContentLength"]),
+        "Accept-Ranges": "bytes",
+        "ETag": s3_object["ETag"],
+    }
+    if "LastModified" in s3_object:
+        headers["Last-Modified"] = format_datetime(s3_object["LastModified"].astimezone(timezone.utc), usegmt=True)
+
+    status_code = 200
+    if s3_object.get("ContentRange"):
+        headers["Content-Range"] = s3_object["ContentRange"]
+        status_code = 206
+
+    return StreamingResponse(s3_body_streamer(s3_object["Body"]), status_code=status_code,
+                             media_type="application/x-zip-compressed", headers=headers)
 
 
 
 ## R2LAB
-r2lab_devices = ["jaguar", "panther", "n300", "n320", "qhat01", "qhat02" "qhat03"]
+r2lab_devices = ["jaguar", "panther", "n300", "n320", "qhat01", "qhat02", "qhat03"]
 R2labDevices = Enum('name', {dev: dev for dev in r2lab_devices})
 
 class StateUpdate(BaseModel):
@@ -506,10 +743,130 @@ async def post_r2lab(state_update: StateUpdate, device: R2labDevices, user: dict
     elif normalized_state == "OFF":
         cmd = f"rhubarbe pdu off {device.name}"
 
-    output, error = run_ssh_command_with_key("faraday.inria.fr", 22, "inria_tum01", "/id_rsa", cmd)
+    output, error, exit_status, seconds = await run_r2lab_command(cmd)
+    r2lab_states.invalidate()
 
     return {"output": output}
 
+class BatchStateUpdate(BaseModel):
+    states: Dict[R2labDevices, str] = Field(..., description="New state of each device, either 'ON' or 'OFF'")
+
+    @field_validator('states')
+    def validate_states(cls, value):
+        normalized = {}
+        for device, state in value.items():
+            # Convert the input value to uppercase for case-insensitive comparison
+            normalized[device] = state.upper()
+            if normalized[device] not in ["ON", "OFF"]:
+                raise ValueError(f"State of {device.name} must be either 'ON' or 'OFF'")
+        return normalized
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "states": {"jaguar": "ON", "panther": "ON", "n300": "OFF"}
+            }
+        }
+
+# Host, port, user and key to run the rhubarbe commands of R2LAB with
+R2LAB_SSH = ("faraday.inria.fr", 22, "inria_tum01", "/id_rsa")
+
+async def run_r2lab_command(cmd):
+    """
+    Run a command on the R2LAB gateway and return its output, error output,
+    exit status and duration in seconds.
+    """
+    start = time.perf_counter()
+    output, error, exit_status = await io_executor.run(run_ssh_command_with_key, *R2LAB_SSH, cmd)
+    return output, error, exit_status, time.perf_counter() - start
+
+async def fetch_r2lab_states():
+    """
+    Return the power state of every R2LAB device, `UNKNOWN` if it couldn't be
+    read. The states are read with a single command.
+    """
+    try:
+        output, error, exit_status, seconds = await run_r2lab_command(pdu_status_command(r2lab_devices))
+    except Exception as e:
+        logger.error(f"Failed to read the states of the R2LAB devices: {e}")
+        return dict.fromkeys(r2lab_devices, "UNKNOWN")
+    return parse_pdu_states(output, r2lab_devices)
+
+# Dashboards poll the states, they are read from R2LAB at most every 10 seconds
+r2lab_states = DeviceStateCache(fetch_r2lab_states, ttl=10)
+
+@app.get("/r2lab/")
+async def get_r2lab(user: dict = Depends(validate_token)):
+    """
+    GET /r2lab/ endpoint to retrieve the power state of the R2lab devices.
+
+    The states are read from R2LAB at most every 10 seconds, and right after
+    they were changed through this API.
+
+    Parameters:
+    user (dict): Authenticated user information.
+
+    Returns:
+    dict: The state of each device (`"ON"`, `"OFF"` or `"UNKNOWN"` if it
+    couldn't be read), and when the states were read.
+
+    Example Response:
+    {
+        "states": {"jaguar": "ON", "panther": "OFF", ...},
+        "fetched": "2024-10-10 12:00:00Z"
+    }
+    """
+    states, fetched = await r2lab_states.get()
+    return {"states": states, "fetched": datetime.fromtimestamp(fetched, timezone.utc).strftime(TIME_FORMAT)}
+
+@app.patch("/r2lab/")
+async def patch_r2lab_batch(update: BatchStateUpdate, user: dict = Depends(validate_token)):
+    """
+    PATCH /r2lab/ endpoint to update the state of several R2lab devices at
+    once. The commands run concurrently over a single SSH connection to
+    R2LAB.
+
+    Parameters:
+    update (BatchStateUpdate): A dictionnary wich key `states` maps devices
+                               to their new state, either `"ON"` or `"OFF"`
+                               (case-insensitive).
+    user (dict): Authenticated user information.
+
+    Returns:
+    dict: Per device, its requested state, whether the command succeeded
+    (exited with status 0), its output and error output, and how long it took
+    in seconds, as well as the duration of the whole batch.
+
+    Example Response:
+    {
+        "devices": {
+            "jaguar": {"state": "ON", "ok": true, "output": "...", "error": "", "seconds": 1.2},
+            ...
+        },
+        "seconds": 1.3
+    }
+
+    Raises:
+    HTTPException:
+    - 422 if a device is unknown or a state is neither `"ON"` nor `"OFF"`.
+    """
+    async def apply(device, state):
+        try:
+            output, error, exit_status, seconds = await run_r2lab_command(f"rhubarbe pdu {state.lower()} {device.name}")
+        except Exception as e:
+            return {"state": state, "ok": False, "output": "", "error": str(e), "seconds": None}
+        return {"state": state, "ok": exit_status == 0, "output": output, "error": error,
+                "seconds": round(seconds, 3)}
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(apply(device, state) for device, state in update.states.items()))
+    r2lab_states.invalidate()
+
+    return {
+        "devices": {device.name: result for device, result in zip(update.states, results)},
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
 
 # Pydantic model to define the expected POST body structure
 class TokenRequest(BaseModel):
@@ -521,18 +878,206 @@ class TokenRequest(BaseModel):
             }
         }
 
+class BatchMode(str, Enum):
+    all = "all"
+    best_effort = "best-effort"
+
+class BatchTokenRequest(BaseModel):
+    tokens: List[str]
+    mode: BatchMode = BatchMode.all
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "tokens": ["an experiment token", "another experiment token"],
+                "mode": "all"
+            }
+        }
+
+# Lengths of the prefixes experiments can ask for. Shorter prefixes take a
+# large share of the pool, only admins can allocate them.
+MIN_USER_PREFIXLEN = 24
+MAX_PREFIXLEN = 30
+
+def check_prefixlen(prefixlen: int, user: dict):
+    """
+    Check that a user may allocate prefixes of length `prefixlen`.
+
+    Raises:
+        HTTPException: 403 if the prefix is shorter than `MIN_USER_PREFIXLEN`
+        and the user is not an admin.
+    """
+    if prefixlen < MIN_USER_PREFIXLEN and "admin" not in role_index.roles_of(user["preferred_username"]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail=f"Only admins can allocate prefixes shorter than /{MIN_USER_PREFIXLEN}")
+
+def decode_experiment_token(token: str):
+    """
+    Validate an experiment token and return its claims.
+
+    Raises:
+        HTTPException: 401 if the token is expired or invalid.
+    """
+    try:
+        return decode_token(token)
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Experiment token has expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid experiment token")
+
+def _decode_batch(request_body: BatchTokenRequest):
+    """
+    Decode the experiment tokens of a batch request.
+
+    In `all` mode any invalid token fails the whole request. In `best-effort`
+    mode invalid tokens are reported and skipped.
+
+    Returns:
+        tuple: The list of (owner, experiment_id) pairs of the valid tokens and
+        the list of errors, one per invalid token.
+    """
+    experiments = []
+    errors = []
+    for index, token in enumerate(request_body.tokens):
+        try:
+            data = decode_experiment_token(token)
+            experiments.append((data['act']['sub'], data['sub']))
+        except HTTPException as e:
+            if request_body.mode == BatchMode.all:
+                raise HTTPException(status_code=e.status_code, detail=f"Token {index}: {e.detail}")
+            errors.append({"token": index, "error": e.detail})
+    return experiments, errors
+
+def allocations_streamer(rows, chunk_size=LIST_PAGE_SIZE):
+    """Generator function to yield allocations as NDJSON, `chunk_size` lines at a time."""
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+        yield "".join(json.dumps(asdict(allocation)) + "\n" for allocation in chunk)
+
 @app.get("/prefix/")
-async def get_prefix(request_body: TokenRequest, user: dict = Depends(validate_token)):
-    remove_expired_allocations()
+async def get_prefix(user: dict = Depends(validate_token),
+                     owner: Optional[str] = Query(default=None, description="Only list the allocations of this owner"),
+                     within: Optional[str] = Query(default=None, description="Only list the allocations whose prefix is within this prefix (CIDR)"),
+                     expiring_before: Optional[datetime] = Query(default=None, description="Only list the allocations expiring before this time (UTC if no timezone)"),
+                     cursor: Optional[str] = Query(default=None, description="Cursor of the page, as returned with the previous page"),
+                     limit: int = Query(default=LIST_PAGE_SIZE, ge=1, le=1000, description="Maximum number of allocations in the page"),
+                     stream: bool = Query(default=False, description="Stream all the allocations from the cursor on as NDJSON instead of returning a page")):
+    """
+    GET /prefix/ endpoint to list the current allocations, oldest first,
+    optionally filtered by owner, prefix and expiration time.
+
+    Parameters:
+    user (dict): Authenticated user information.
+    owner (str): Only list the allocations of this owner.
+    within (str): Only list the allocations whose prefix is within this prefix.
+    expiring_before (datetime): Only list the allocations expiring before this time.
+    cursor (str): Cursor of the page (key `next` of the previous page).
+    limit (int): Maximum number of allocations in the page.
+    stream (bool): Stream every matching allocation, one JSON object per line
+                   (application/x-ndjson), instead of returning a page.
 
-    return get_all_allocations()
+    Returns:
+    dict: The allocations of the page (key `allocations`) and the cursor of
+    the next page (key `next`), null on the last page.
+
+    Example Response:
+    ```
+    {
+        "allocations": [
+            {
+                "ip": "198.51.100.1",
+                "prefix": "192.0.2.0/27",
+                "owner": "user",
+                "experiment_id": "exp_expauth.ilabt.imec.be_abcdefghijklmnopqrstuvwxyz",
+                "allocation_time": "2025-01-01 09:00:00Z",
+                "expiration_time": "2025-01-02 09:00:00Z"
+            }
+        ],
+        "next": null
+    }
+    ```
 
+    Raises:
+    HTTPException:
+    - 400 if `within` is not a valid prefix or `cursor` not a valid cursor.
+    """
+    try:
+        if stream:
+            rows = backend.iter_allocations(owner=owner, within=within, expiring_before=expiring_before, after=cursor)
+            return StreamingResponse(allocations_streamer(rows), media_type="application/x-ndjson")
+
+        page, next_cursor = await store.list_allocations(owner=owner, within=within, expiring_before=expiring_before,
+                                                         after=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"allocations": [asdict(allocation) for allocation in page], "next": next_cursor}
+
+
+@app.get("/pool/stats")
+async def get_pool_stats(user: dict = Depends(validate_token), prefixlen: int = Query(default=DEFAULT_PREFIXLEN, ge=0, le=32, description="Prefix length the prefix pool capacity is expressed in")):
+    """
+    GET /pool/stats endpoint to retrieve the capacity and pressure of the LB IP
+    and prefix pools. The statistics are read from counters maintained with
+    the allocations, so the endpoint is cheap enough to be polled.
+
+    Parameters:
+    user (dict): Authenticated user information.
+    prefixlen (int): Prefix length the prefix pool capacity is expressed in.
+
+    Returns:
+    dict: Total and free LB IPs (key `ips`) and prefixes (key `prefixes`)
+    with their estimated time to exhaustion, and the number, age
+    distribution and allocation/release rates of the leases (key `leases`).
+    """
+    return await store.pool_stats(prefixlen=prefixlen)
+
+@app.get("/prefix/reaper/")
+async def get_prefix_reaper(user: dict = Depends(check_role(["admin"]))):
+    """
+    GET /prefix/reaper/ endpoint to retrieve the statistics of the background
+    task removing expired allocations. Only accessible to users with the
+    "admin" role.
+
+    Returns:
+    dict: The number of runs and of allocations removed, and the time, result
+    and duration of the last run as well as the time of the next one.
+    """
+    return reaper.stats
+
+@app.get("/executors/")
+async def get_executors(user: dict = Depends(check_role(["admin"]))):
+    """
+    GET /executors/ endpoint to retrieve the load of the thread pools running
+    the blocking work of the handlers. Only accessible to users with the
+    "admin" role.
+
+    Returns:
+    dict: Per pool (`cpu` and `io`), its number of threads and queue size,
+    the calls running and queued, the peak number of pending calls, the
+    number of completed and rejected calls, the saturation (pending calls
+    over capacity), and the average and maximum time calls waited for a
+    thread.
+    """
+    return {"cpu": cpu_executor.stats, "io": io_executor.stats}
+
+@app.get("/ssh/")
+async def get_ssh(user: dict = Depends(check_role(["admin"]))):
+    """
+    GET /ssh/ endpoint to retrieve the state of the pooled SSH connections.
+    Only accessible to users with the "admin" role.
+
+    Returns:
+    dict: The number of connections opened, reopened and evicted and of
+    commands run, and per connection its host, whether it is up, the number
+    of commands running or waiting on it, and for how long it has been idle.
+    """
+    return {**ssh_pool.stats, "connections": ssh_pool.status()}
 
 @app.post("/prefix/")
-async def post_prefixnew(request_body: TokenRequest, user: dict = Depends(validate_token), duration: int = Query(default=1440, description="Optional duration in minutes")):
+async def post_prefixnew(request_body: TokenRequest, user: dict = Depends(validate_token), duration: int = Query(default=1440, description="Optional duration in minutes"), prefixlen: int = Query(default=DEFAULT_PREFIXLEN, ge=0, le=MAX_PREFIXLEN, description="Optional length of the allocated prefix")):
+    check_prefixlen(prefixlen, user)
     token = request_body.token
     try:
-        data = validate_token(token)
+        data = await run_in_threadpool(decode_token, token)
         exp = data['sub']
         user = data['act']['sub']
     except jwt.ExpiredSignatureError:
@@ -540,18 +1085,18 @@ async def post_prefixnew(request_body: TokenRequest, user: dict = Depends(valida
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid experiment token")
 
-    remove_expired_allocations()
-
     try:
-        allocation = get_allocation(owner=user, experiment_id=exp, duration=duration)
+        allocation = await store.get_allocation(owner=user, experiment_id=exp, duration=duration, prefixlen=prefixlen)
     except NoPrefixAvailable:
         raise HTTPException(status_code=404, detail="No prefix is available")
     except NoIPAvailable:
         raise HTTPException(status_code=404, detail="No LB IP is available")
+    except AllocationError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     return {
-        "subnet": allocation['prefix'],
-        "lb": allocation['ip'],
-        "expiration_time": allocation['expiration_time']
+        "subnet": allocation.prefix,
+        "lb": allocation.ip,
+        "expiration_time": allocation.expiration_time
         }
 
 @app.post("/prefixold/")
@@ -611,7 +1156,7 @@ async def post_prefix(request_body: TokenRequest, user: dict = Depends(validate_
 
     token = request_body.token
     try:
-        data = validate_token(token)
+        data = await run_in_threadpool(decode_token, token)
         exp = data['sub']
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Experiment token has expired")
@@ -681,7 +1226,7 @@ async def get_prefix(request_body: TokenRequest, user: dict = Depends(validate_t
 
     token = request_body.token
     try:
-        data = validate_token(token)
+        data = await run_in_threadpool(decode_token, token)
         exp = data['sub']
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Experiment token has expired")
@@ -739,32 +1284,145 @@ async def delete_prefixnew(request_body: TokenRequest, user: dict = Depends(vali
     Raises:
     HTTPException: 
     - 404 if no subnet or LB IP is allocated to the user's project.
+    - 503 if the allocation database is busy or failed.
     """
     proj = user['proj']
 
     token = request_body.token
     try:
-        data = validate_token(token)
+        data = await run_in_threadpool(decode_token, token)
         exp = data['sub']
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Experiment token has expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid experiment token")
 
-    count = delete_allocation(experiment_id=exp)
+    try:
+        count = await store.delete_allocation(experiment_id=exp)
+    except AllocationError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
     if count < 1:
         raise HTTPException(status_code=404, detail="No prefix is allocated to your experiment")
     
     return {"count": count}
 
-def string_streamer(data: str):
-    """Generator function to yield parts of a string."""
-    for char in data:
-        yield char
+@app.post("/prefix/batch/")
+async def post_prefix_batch(request_body: BatchTokenRequest, user: dict = Depends(validate_token), duration: int = Query(default=1440, description="Optional duration in minutes"), prefixlen: int = Query(default=DEFAULT_PREFIXLEN, ge=0, le=MAX_PREFIXLEN, description="Optional length of the allocated prefixes")):
+    """
+    POST /prefix/batch/ endpoint to retrieve, or allocate if needed, the subnet
+    and load balancer (LB) IP of many experiments at once. All the allocations
+    are made in a single transaction.
+
+    Parameters:
+    request_body (BatchTokenRequest): The experiment tokens (key `tokens`) and
+                                      the batch mode (key `mode`). In `all`
+                                      mode (default) nothing is allocated
+                                      unless every experiment can be served.
+                                      In `best-effort` mode the experiments
+                                      that cannot be served are reported in
+                                      `errors`.
+    user (dict): Authenticated user information.
+    duration (int): Duration of new allocations in minutes.
+    prefixlen (int): Length of the prefixes of new allocations, from
+                     /24 to /30, or shorter for admins.
+
+    Returns:
+    dict: The allocations (key `allocations`), one per served experiment, and
+    the errors (key `errors`).
+
+    Example Response:
+    ```
+    {
+        "allocations": [
+            {
+                "experiment_id": "exp_expauth.ilabt.imec.be_abcdefghijklmnopqrstuvwxyz",
+                "subnet": "192.0.2.0/27",
+                "lb": "198.51.100.1",
+                "expiration_time": "2025-01-01 10:00:00Z"
+            }
+        ],
+        "errors": []
+    }
+    ```
+
+    Raises:
+    HTTPException:
+    - 401 if a token is invalid, in `all` mode.
+    - 403 if a prefix shorter than /24 is requested by a user who is not an admin.
+    - 404 if no subnet or LB IP is available for an experiment, in `all` mode.
+    """
+    check_prefixlen(prefixlen, user)
+    experiments, errors = await run_in_threadpool(_decode_batch, request_body)
+    best_effort = request_body.mode == BatchMode.best_effort
+
+    try:
+        allocations, failures = await store.allocate_many(experiments, duration=duration, best_effort=best_effort, prefixlen=prefixlen)
+    except NoPrefixAvailable:
+        raise HTTPException(status_code=404, detail="No prefix is available")
+    except NoIPAvailable:
+        raise HTTPException(status_code=404, detail="No LB IP is available")
+    except AllocationError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    errors.extend({"experiment_id": exp, "error": str(e)} for exp, e in failures.items())
+    return {
+        "allocations": [
+            {
+                "experiment_id": allocation.experiment_id,
+                "subnet": allocation.prefix,
+                "lb": allocation.ip,
+                "expiration_time": allocation.expiration_time
+            } for allocation in allocations.values()
+        ],
+        "errors": errors
+    }
+
+@app.delete("/prefix/batch/")
+async def delete_prefix_batch(request_body: BatchTokenRequest, user: dict = Depends(validate_token)):
+    """
+    DELETE /prefix/batch/ endpoint to release the subnets and load balancer
+    (LB) IPs allocated to many experiments at once, in a single transaction.
+
+    Parameters:
+    request_body (BatchTokenRequest): The experiment tokens (key `tokens`) and
+                                      the batch mode (key `mode`). In
+                                      `best-effort` mode invalid tokens are
+                                      reported in `errors` instead of failing
+                                      the request.
+    user (dict): Authenticated user information.
+
+    Returns:
+    dict: The number of allocations released (key `count`), the experiments
+    they belonged to (key `released`) and the errors (key `errors`).
+
+    Raises:
+    HTTPException:
+    - 401 if a token is invalid, in `all` mode.
+    """
+    experiments, errors = await run_in_threadpool(_decode_batch, request_body)
+
+    try:
+        released = await store.release_many([exp for _, exp in experiments])
+    except AllocationError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {"count": len(released), "released": released, "errors": errors}
+
+# Size of the chunks in which strings are streamed to the clients
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def string_streamer(data: str, chunk_size=STREAM_CHUNK_SIZE):
+    """Generator function to yield parts of a string, `chunk_size` characters at a time."""
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+# Kubeconfigs generated for each user, until their credentials expire
+kubeconfig_cache = load_kubeconfig_cache()
 
 @app.post("/k8s/{cluster}")
-async def post_kubeconfig(cluster: Optional[str] = "centralhub", user: dict = Depends(validate_token)):
+async def post_kubeconfig(cluster: Optional[str] = "centralhub", user: dict = Depends(validate_token),
+                          refresh: bool = Query(default=False, description="Generate a new kubeconfig even if one is cached")):
     """
     POST /k8s/{cluster}/ endpoint to retrieve and return the kubeconfig file for a specific Kubernetes cluster.
 
@@ -775,6 +1433,11 @@ async def post_kubeconfig(cluster: Optional[str] = "centralhub", user: dict = De
 
     user (dict): Authenticated user information.
 
+    refresh : bool, default=False
+        Generate a new kubeconfig instead of returning the cached one. The
+        kubeconfig of a user is cached until shortly before its credentials
+        expire.
+
     Returns:
     --------
     StreamingResponse:
@@ -784,18 +1447,29 @@ async def post_kubeconfig(cluster: Optional[str] = "centralhub", user: dict = De
     -------
     HTTPException: 
     - 404 if the cluster does not exist.
+    - 503 if no kubeconfig could be generated.
     """
-    if cluster == "centralhub":
-        cmd = "cd users; ./add.sh {}".format(user['preferred_username'])
+    if cluster != "centralhub":
+        raise HTTPException(status_code=404, detail="The cluster doesn't exist")
+
+    username = user['preferred_username']
+
+    async def generate():
+        cmd = "cd users; ./add.sh {}".format(username)
         # output, error = run_ssh_command_with_key("172.29.0.11", 22, "backend", "/id_rsa", cmd)
         # output, error = run_ssh_command_with_key("172.28.2.84", 22, "backend", "/id_rsa", cmd)
         # output, error = run_ssh_command_with_key("172.28.2.82", 22, "backend", "/id_rsa", cmd)
-        output, error = run_ssh_command_with_key("172.28.2.81", 22, "backend", "/id_rsa", cmd)
+        output, error, exit_status = await io_executor.run(run_ssh_command_with_key, "172.28.2.81", 22, "backend", "/id_rsa", cmd)
         config = yaml.safe_load(output)
-    else:
-        raise HTTPException(status_code=404, detail="The cluster doesn't exist")
+        if not isinstance(config, dict):
+            raise HTTPException(status_code=503, detail=f"Failed to generate the kubeconfig: {error.strip()}")
+        return config
+
+    if refresh:
+        kubeconfig_cache.invalidate(username, cluster)
+    kubeconfig = await kubeconfig_cache.get(username, cluster, generate)
 
-    return StreamingResponse(string_streamer(yaml.dump(config)), media_type="application/x-yaml")
+    return StreamingResponse(string_streamer(kubeconfig), media_type="application/x-yaml")
 
 
 
@@ -813,7 +1487,7 @@ async def post_cleanup(request_body: TokenRequest, user: dict = Depends(validate
 
     token = request_body.token
     try:
-        data = validate_token(token)
+        data = await run_in_threadpool(decode_token, token)
         exp = data['sub']
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Experiment token has expired")
@@ -828,7 +1502,7 @@ async def post_cleanup(request_body: TokenRequest, user: dict = Depends(validate
 
     cmd = "cd namespaces; ./delete_nsprefix.sh {}".format(nsprefix)
     # output, error = run_ssh_command_with_key("172.29.0.11", 22, "backend", "/id_rsa", cmd)
-    output, error = run_ssh_command_with_key("172.28.2.84", 22, "backend", "/id_rsa", cmd)
+    output, error, exit_status = await io_executor.run(run_ssh_command_with_key, "172.28.2.84", 22, "backend", "/id_rsa", cmd)
     # config = yaml.safe_load(output)
 
     return {"output": output}
\ No newline at end of file
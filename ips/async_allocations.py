@@ -0,0 +1,78 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from allocations import DEFAULT_PREFIXLEN, LIST_PAGE_SIZE
+
+class AsyncAllocations:
+    """
+    Async facade over an allocation backend.
+
+    Every call runs in a thread so that the event loop never waits on the
+    store. Writes are queued to a single writer thread, which serializes them
+    within the process (other processes are handled by the backend, e.g. the
+    busy retries of the SQLite backend), and reads run on a small pool of
+    reader threads that WAL lets proceed while a write is in progress.
+
+    Methods have the same arguments, results and exceptions as the methods of
+    the backend.
+
+    Args:
+        backend (AllocationBackend): The backend to call.
+        readers (int): Number of reader threads.
+    """
+    def __init__(self, backend, readers=4):
+        self.backend = backend
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="allocations-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="allocations-reader")
+
+    async def _run(self, executor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+    async def _write(self, func, *args, **kwargs):
+        return await self._run(self._writer, func, *args, **kwargs)
+
+    async def _read(self, func, *args, **kwargs):
+        return await self._run(self._readers, func, *args, **kwargs)
+
+    async def get_allocation(self, owner, experiment_id, duration=120, prefixlen=DEFAULT_PREFIXLEN):
+        return await self._write(self.backend.get_allocation, owner, experiment_id, duration=duration, prefixlen=prefixlen)
+
+    async def allocate_many(self, requests, duration=120, best_effort=False, prefixlen=DEFAULT_PREFIXLEN):
+        return await self._write(self.backend.allocate_many, list(requests), duration=duration,
+                                 best_effort=best_effort, prefixlen=prefixlen)
+
+    async def delete_allocation(self, experiment_id):
+        return await self._write(self.backend.delete_allocation, experiment_id)
+
+    async def release_many(self, experiment_ids):
+        return await self._write(self.backend.release_many, list(experiment_ids))
+
+    async def remove_expired_allocations(self):
+        return await self._write(self.backend.remove_expired_allocations)
+
+    async def get_all_allocations(self):
+        return await self._read(self.backend.get_all_allocations)
+
+    async def list_allocations(self, owner=None, within=None, expiring_before=None, after=None,
+                               limit=LIST_PAGE_SIZE):
+        return await self._read(self.backend.list_allocations, owner=owner, within=within,
+                                expiring_before=expiring_before, after=after, limit=limit)
+
+    async def next_expiration(self):
+        return await self._read(self.backend.next_expiration)
+
+    async def pool_stats(self, prefixlen=DEFAULT_PREFIXLEN):
+        return await self._read(self.backend.pool_stats, prefixlen=prefixlen)
+
+    async def remaining_ips(self):
+        return await self._read(self.backend.remaining_ips)
+
+    async def remaining_subnets(self, prefixlen=DEFAULT_PREFIXLEN):
+        return await self._read(self.backend.remaining_subnets, prefixlen=prefixlen)
+
+    def close(self):
+        """Wait for the pending calls and stop the threads."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
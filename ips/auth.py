@@ -0,0 +1,312 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+
+import jwt
+
+logger = logging.getLogger("slices-backend")
+
+# Algorithms accepted for tokens signed by a key of the key set that doesn't
+# name its algorithm. Symmetric algorithms are never accepted, as anyone
+# holding the key set could sign tokens.
+ASYMMETRIC_ALGORITHMS = ["RS256", "RS384", "RS512", "PS256", "PS384", "PS512",
+                         "ES256", "ES384", "ES512", "EdDSA"]
+
+class TokenCache:
+    """
+    Bounded LRU cache of the claims of validated tokens.
+
+    Entries are keyed by the SHA-256 of the token, so tokens are not kept in
+    memory, and are dropped once the token expires (its `exp` claim), so a
+    hit is always a token that is still valid. The cached claims are shared
+    by every request presenting the token and must not be modified.
+
+    Args:
+        maxsize (int): Maximum number of tokens cached.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        """Return the cached claims of a token, or None if it's not cached or has expired."""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            claims, expiration = entry
+            if expiration is not None and time.time() > expiration:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, token, claims):
+        """Cache the claims of a validated token until its `exp` claim."""
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (claims, claims.get("exp"))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class RoleIndex:
+    """
+    Index of the roles of each user, built from the `_roles` entry of the
+    database (role -> list of users).
+
+    The index is rebuilt when the version of the database store changed
+    since it was built, so looking up the roles of a user is a dictionary
+    lookup.
+
+    Args:
+        store (JsonStore): Store of the database.
+    """
+    def __init__(self, store):
+        self.store = store
+        self._version = None
+        self._roles = {}
+        self._lock = threading.Lock()
+
+    def _index(self):
+        with self._lock:
+            if self._version != self.store.version:
+                version = self.store.version
+                roles = {}
+                for role, users in self.store.data.get("_roles", {}).items():
+                    for user in users:
+                        roles.setdefault(user, set()).add(role)
+                self._roles = {user: frozenset(user_roles) for user, user_roles in roles.items()}
+                self._version = version
+            return self._roles
+
+    def roles_of(self, user):
+        """Return the set of roles of a user."""
+        return self._index().get(user, frozenset())
+
+class KeySet:
+    """
+    JSON Web Key Set of the token issuer, cached in memory and indexed by `kid`.
+
+    The key set is read from a file or fetched from an URL (e.g. the
+    `jwks_uri` of the identity provider) by `refresh()`, which a background
+    task started with `start()` calls every `refresh_interval` seconds.
+    Looking up a `kid` that isn't in the key set refreshes it right away, to
+    pick up rotated keys, but at most once every `min_refresh_interval`
+    seconds, so tokens with made-up key IDs can't hammer the issuer.
+
+    Args:
+        source (str): URL (`http://` or `https://`) or path of the key set.
+        refresh_interval (float): Seconds between background refreshes.
+        min_refresh_interval (float): Minimum seconds between refreshes
+            triggered by unknown key IDs.
+        timeout (float): Seconds to wait for the key set to be fetched.
+    """
+    def __init__(self, source, refresh_interval=3600, min_refresh_interval=30, timeout=5):
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._last_attempt = None
+        self._task = None
+        self.stats = {
+            "refreshes": 0,
+            "last_refresh": None,
+            "last_error": None,
+        }
+
+    def _fetch(self):
+        if self.source.startswith(("http://", "https://")):
+            with urllib.request.urlopen(self.source, timeout=self.timeout) as response:
+                return json.load(response)
+        with open(self.source, 'r') as jwks_file:
+            return json.load(jwks_file)
+
+    def refresh(self):
+        """
+        Load the key set from its source, replacing the cached keys.
+
+        Raises:
+            OSError: If the key set can't be read or fetched.
+            ValueError: If it's not valid JSON.
+            jwt.PyJWKSetError: If it holds no usable key.
+        """
+        try:
+            keys = {key.key_id: key for key in jwt.PyJWKSet.from_dict(self._fetch()).keys}
+        except Exception as e:
+            self.stats["last_error"] = str(e)
+            raise
+        self._keys = keys
+        self.stats["refreshes"] += 1
+        self.stats["last_refresh"] = time.time()
+        self.stats["last_error"] = None
+        logger.info(f"Loaded {len(keys)} signing key(s) from {self.source}")
+
+    def _may_refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._last_attempt is not None and now - self._last_attempt < self.min_refresh_interval:
+                return False
+            self._last_attempt = now
+            return True
+
+    def get(self, kid):
+        """
+        Return the key with ID `kid` (a `jwt.PyJWK`), or None if there's none.
+
+        An unknown `kid` refreshes the key set first, unless it was refreshed
+        less than `min_refresh_interval` seconds ago.
+        """
+        key = self._keys.get(kid)
+        if key is None and self._may_refresh():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh the key set from {self.source}: {e}")
+            key = self._keys.get(kid)
+        return key
+
+    def __len__(self):
+        return len(self._keys)
+
+    def start(self):
+        """Start refreshing the key set in the background, in the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop refreshing the key set."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Failed to refresh the key set from {self.source}: {e}")
+
+class TokenVerifier:
+    """
+    Decode and verify JWTs, caching the claims of the valid ones.
+
+    Signatures are checked against the key of `key_set` named by the `kid`
+    header of the token, so verifying a token is a dictionary lookup and a
+    signature check. The expiration (`exp`, which is required) and, when
+    present, `nbf` and `iat` claims are checked too. Without a key set,
+    signatures are not verified.
+
+    Args:
+        key_set (KeySet): Keys of the token issuer, or None to skip the
+            signature verification.
+        audience (str): Expected `aud` claim, if any.
+        cache (TokenCache): Cache of the claims of the valid tokens.
+    """
+    def __init__(self, key_set=None, audience=None, cache=None):
+        self.key_set = key_set
+        self.audience = audience
+        self.cache = cache if cache is not None else TokenCache()
+
+    def _decode(self, token):
+        if self.key_set is None:
+            return jwt.decode(token, options={"verify_signature": False, "verify_exp": True,
+                                              "verify_nbf": True, "require": ["exp"]})
+
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.key_set.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key '{kid}'")
+
+        algorithms = [key.algorithm_name] if key.algorithm_name in ASYMMETRIC_ALGORITHMS else ASYMMETRIC_ALGORITHMS
+        return jwt.decode(token, key.key, algorithms=algorithms, audience=self.audience,
+                          options={"require": ["exp"], "verify_aud": self.audience is not None})
+
+    def decode(self, token):
+        """
+        Return the claims of a valid token.
+
+        Raises:
+            jwt.ExpiredSignatureError: If the token has expired.
+            jwt.InvalidTokenError: If the token is malformed, its signature is
+                wrong or made with an unknown key, or a claim is invalid.
+        """
+        if token is None:
+            raise jwt.InvalidTokenError("Missing token")
+
+        claims = self.cache.get(token)
+        if claims is None:
+            claims = self._decode(token)
+            self.cache.put(token, claims)
+        return claims
+
+def load_token_verifier(cache=None):
+    """
+    Return the token verifier configured by the environment.
+
+    Environment variables:
+        JWKS_URL: URL, or path, of the key set of the token issuer.
+        JWKS_REFRESH_INTERVAL: Seconds between refreshes of the key set
+            (default 3600).
+        JWKS_MIN_REFRESH_INTERVAL: Minimum seconds between refreshes
+            triggered by tokens signed with an unknown key (default 30).
+        JWT_AUDIENCE: Expected `aud` claim of the tokens, if any.
+        JWT_VERIFY: Set to `0` to skip the signature verification, for
+            development only.
+
+    Raises:
+        RuntimeError: If the signatures must be verified and JWKS_URL is not set.
+    """
+    audience = os.environ.get("JWT_AUDIENCE") or None
+
+    if os.environ.get("JWT_VERIFY", "1").lower() in ("0", "false", "no"):
+        logger.warning("JWT_VERIFY is disabled, token signatures are NOT verified.")
+        return TokenVerifier(None, audience=audience, cache=cache)
+
+    source = os.environ.get("JWKS_URL")
+    if not source:
+        raise RuntimeError("Set JWKS_URL to the key set of the token issuer, "
+                           "or JWT_VERIFY=0 to skip the signature verification.")
+
+    key_set = KeySet(source,
+                     refresh_interval=float(os.environ.get("JWKS_REFRESH_INTERVAL", 3600)),
+                     min_refresh_interval=float(os.environ.get("JWKS_MIN_REFRESH_INTERVAL", 30)))
+    try:
+        key_set.refresh()
+    except Exception as e:
+        # Retried when the first token comes in, and in the background
+        logger.error(f"Failed to load the key set from {source}: {e}")
+    return TokenVerifier(key_set, audience=audience, cache=cache)
@@ -0,0 +1,177 @@
+import os
+from abc import ABC, abstractmethod
+
+import allocations
+from allocations import DEFAULT_PREFIXLEN, LIST_PAGE_SIZE, REAP_BATCH_SIZE
+
+class AllocationBackend(ABC):
+    """
+    Store of the IPs and prefixes leased to experiments.
+
+    Methods have the same arguments (minus `db_path`), results and exceptions
+    as the functions of the same name of the allocations module, which
+    document them. Backends must be safe to call from several threads.
+    """
+    @abstractmethod
+    def create(self, pool_file='pool.json'):
+        """Prepare the store and import the pool file, unless it didn't change since the last import."""
+
+    @abstractmethod
+    def import_pool(self, file_path):
+        pass
+
+    @abstractmethod
+    def add_ips(self, ip_input):
+        pass
+
+    @abstractmethod
+    def add_subnets(self, subnet_input):
+        pass
+
+    @abstractmethod
+    def add_blocks(self, block_input):
+        pass
+
+    @abstractmethod
+    def get_allocation(self, owner, experiment_id, duration=120, prefixlen=DEFAULT_PREFIXLEN):
+        pass
+
+    @abstractmethod
+    def allocate_many(self, requests, duration=120, best_effort=False, prefixlen=DEFAULT_PREFIXLEN):
+        pass
+
+    @abstractmethod
+    def delete_allocation(self, experiment_id):
+        pass
+
+    @abstractmethod
+    def release_many(self, experiment_ids):
+        pass
+
+    @abstractmethod
+    def remove_expired_allocations(self, batch_size=REAP_BATCH_SIZE):
+        pass
+
+    @abstractmethod
+    def next_expiration(self):
+        pass
+
+    @abstractmethod
+    def list_allocations(self, owner=None, within=None, expiring_before=None, after=None, limit=LIST_PAGE_SIZE):
+        pass
+
+    @abstractmethod
+    def iter_allocations(self, owner=None, within=None, expiring_before=None, after=None):
+        pass
+
+    def get_all_allocations(self):
+        """Return the current allocations as (ip, prefix, owner, allocation_time, expiration_time, experiment_id) tuples."""
+        return [(a.ip, a.prefix, a.owner, a.allocation_time, a.expiration_time, a.experiment_id)
+                for a in self.iter_allocations()]
+
+    @abstractmethod
+    def remaining_ips(self):
+        pass
+
+    @abstractmethod
+    def remaining_subnets(self, prefixlen=DEFAULT_PREFIXLEN):
+        pass
+
+    @abstractmethod
+    def pool_stats(self, prefixlen=DEFAULT_PREFIXLEN):
+        pass
+
+    def close(self):
+        """Release the resources held by the backend."""
+
+class SQLiteBackend(AllocationBackend):
+    """
+    Backend storing the allocations in a local SQLite database, for a single
+    host (several processes may share the database file).
+    """
+    def __init__(self, db_path='network_data.db'):
+        self.db_path = db_path
+
+    def create(self, pool_file='pool.json'):
+        allocations.create_db(db_path=self.db_path, pool_file=pool_file)
+
+    def import_pool(self, file_path):
+        return allocations.import_pool(file_path, db_path=self.db_path)
+
+    def add_ips(self, ip_input):
+        return allocations.add_ips(ip_input, db_path=self.db_path)
+
+    def add_subnets(self, subnet_input):
+        allocations.add_subnets(subnet_input, db_path=self.db_path)
+
+    def add_blocks(self, block_input):
+        allocations.add_blocks(block_input, db_path=self.db_path)
+
+    def get_allocation(self, owner, experiment_id, duration=120, prefixlen=DEFAULT_PREFIXLEN):
+        return allocations.get_allocation(owner, experiment_id, duration=duration, prefixlen=prefixlen,
+                                          db_path=self.db_path)
+
+    def allocate_many(self, requests, duration=120, best_effort=False, prefixlen=DEFAULT_PREFIXLEN):
+        return allocations.allocate_many(requests, duration=duration, best_effort=best_effort,
+                                         prefixlen=prefixlen, db_path=self.db_path)
+
+    def delete_allocation(self, experiment_id):
+        return allocations.delete_allocation(experiment_id, db_path=self.db_path)
+
+    def release_many(self, experiment_ids):
+        return allocations.release_many(experiment_ids, db_path=self.db_path)
+
+    def remove_expired_allocations(self, batch_size=REAP_BATCH_SIZE):
+        return allocations.remove_expired_allocations(db_path=self.db_path, batch_size=batch_size)
+
+    def next_expiration(self):
+        return allocations.next_expiration(db_path=self.db_path)
+
+    def list_allocations(self, owner=None, within=None, expiring_before=None, after=None, limit=LIST_PAGE_SIZE):
+        return allocations.list_allocations(owner=owner, within=within, expiring_before=expiring_before,
+                                            after=after, limit=limit, db_path=self.db_path)
+
+    def iter_allocations(self, owner=None, within=None, expiring_before=None, after=None):
+        return allocations.iter_allocations(owner=owner, within=within, expiring_before=expiring_before,
+                                            after=after, db_path=self.db_path)
+
+    def get_all_allocations(self):
+        return allocations.get_all_allocations(db_path=self.db_path)
+
+    def remaining_ips(self):
+        return allocations.remaining_ips(db_path=self.db_path)
+
+    def remaining_subnets(self, prefixlen=DEFAULT_PREFIXLEN):
+        return allocations.remaining_subnets(prefixlen=prefixlen, db_path=self.db_path)
+
+    def pool_stats(self, prefixlen=DEFAULT_PREFIXLEN):
+        return allocations.pool_stats(prefixlen=prefixlen, db_path=self.db_path)
+
+    def close(self):
+        allocations.close_connections()
+
+# Backends selectable with the ALLOCATION_BACKEND environment variable
+BACKENDS = ("sqlite", "redis")
+
+def load_backend():
+    """
+    Return the allocation backend configured by the environment.
+
+    Environment variables:
+        ALLOCATION_BACKEND: `sqlite` (default) or `redis`.
+        ALLOCATION_DB: Path of the SQLite database (default `network_data.db`).
+        REDIS_URL: URL of the Redis server (default `redis://localhost:6379/0`).
+        REDIS_KEY_PREFIX: Prefix of the Redis keys (default `allocations:`).
+
+    Raises:
+        ValueError: If ALLOCATION_BACKEND is not one of `BACKENDS`.
+    """
+    name = os.environ.get("ALLOCATION_BACKEND", "sqlite").lower()
+
+    if name == "sqlite":
+        return SQLiteBackend(os.environ.get("ALLOCATION_DB", "network_data.db"))
+    if name == "redis":
+        from redis_allocations import RedisBackend
+        return RedisBackend.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0"),
+                                     prefix=os.environ.get("REDIS_KEY_PREFIX", "allocations:"))
+    raise ValueError(f"Unknown allocation backend '{name}', expected one of {', '.join(BACKENDS)}.")
@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+Benchmarks and stress tests of the allocation store, and of the S3 storage.
+
+`suite` measures, for pools of several sizes, the latency of single
+`get_allocation`, `delete_allocation` and `remove_expired_allocations` calls,
+the allocation throughput of several threads and of several processes, and
+the behaviour of the allocator when the pool is exhausted. It reports
+p50/p99 latencies and allocations per second as JSON, to be compared between
+versions.
+
+`backends` runs the latency and thread benchmarks on the SQLite backend and
+on the Redis backend, against a Redis server or an in-process fakeredis
+stand-in.
+
+`stress` runs several processes that concurrently request allocations for
+distinct experiments against the same SQLite database, checks that no IP or
+subnet has been leased twice and reports the allocation throughput.
+
+`async` runs concurrent clients in one event loop, the way the API handlers
+do, calling the allocation store either directly from the loop (`sync`) or
+through the async facade (`facade`), and reports the allocation latency and
+how late the event loop wakes up a task sleeping next to them.
+
+`s3` uploads and downloads objects the way the POS script endpoints do,
+first with a new S3 client per call, then with the shared `S3ClientManager`,
+and reports their latencies. It runs against the S3 endpoint of a
+credentials file, or an in-process moto server (plain HTTP, so it doesn't
+account for the TLS handshakes saved by reusing connections).
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import allocations
+from async_allocations import AsyncAllocations
+from backends import SQLiteBackend
+
+
+def synthetic_pool(size):
+    """Return `size` IPs and `size` /27 subnets that do not overlap."""
+    ips = [str(ipaddress.IPv4Address(0x0A000000 + i)) for i in range(size)]
+    subnets = [f"{ipaddress.IPv4Address(0x0B000000 + 32 * i)}/27" for i in range(size)]
+    return ips, subnets
+
+def fill_pool(backend, size):
+    """Add a synthetic pool of `size` IPs and subnets to an allocation backend."""
+    ips, subnets = synthetic_pool(size)
+    backend.add_ips(ips)
+    backend.add_subnets(subnets)
+
+def create_pool(db_path, size):
+    """Create a database at `db_path` holding a synthetic pool of `size` IPs and subnets."""
+    allocations.create_schema(db_path)
+    fill_pool(SQLiteBackend(db_path), size)
+
+def _stress_worker(db_path, worker, count, start, results):
+    start.wait()
+    leases = []
+    error = None
+    try:
+        for i in range(count):
+            experiment_id = f"xp_{worker}_{i}"
+            allocation = allocations.get_allocation(owner=f"worker{worker}", experiment_id=experiment_id, db_path=db_path)
+            # Asking again must return the same lease
+            again = allocations.get_allocation(owner=f"worker{worker}", experiment_id=experiment_id, db_path=db_path)
+            if again != allocation:
+                raise AssertionError(f"{experiment_id} got {allocation} then {again}")
+            leases.append((allocation.experiment_id, allocation.ip, allocation.prefix))
+    except Exception as e:
+        error = f"worker {worker}: {e!r}"
+    finally:
+        allocations.close_connections()
+        results.put((leases, error))
+
+def stress(db_path, processes, per_process):
+    """
+    Allocate `per_process` experiments from each of `processes` processes at
+    once, from a pool just large enough.
+
+    Returns:
+        dict: The number of allocations, the elapsed time, the allocation rate
+        and the list of problems found (duplicate leases, lost allocations).
+    """
+    create_pool(db_path, processes * per_process)
+    return _run_processes(db_path, processes, per_process)
+
+def _run_processes(db_path, processes, per_process):
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_stress_worker, args=(db_path, w, per_process, start, results))
+               for w in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    t0 = time.perf_counter()
+    start.set()
+    leases = []
+    problems = []
+    for _ in workers:
+        worker_leases, error = results.get()
+        leases.extend(worker_leases)
+        if error:
+            problems.append(error)
+    elapsed = time.perf_counter() - t0
+
+    for worker in workers:
+        worker.join()
+
+    for index, name in ((1, "IP"), (2, "prefix")):
+        values = [lease[index] for lease in leases]
+        if len(set(values)) != len(values):
+            problems.append(f"duplicate {name} leases")
+    if len(allocations.get_all_allocations(db_path=db_path)) != len(leases):
+        problems.append("allocations in the database do not match the leases")
+
+    return {
+        "processes": processes,
+        "allocations": len(leases),
+        "seconds": round(elapsed, 3),
+        "allocations_per_second": round(len(leases) / elapsed, 1),
+        "problems": problems,
+    }
+
+def compare_backends(directory, size, operations, threads, redis_url=None):
+    """
+    Run the latency and thread benchmarks on a pool of `size` IPs and subnets
+    in each backend, with at most `operations` allocations per benchmark.
+
+    The Redis backend uses the server at `redis_url`, under a key prefix
+    removed afterwards, or an in-process fakeredis server when None.
+
+    Returns:
+        list: One report per backend.
+    """
+    from redis_allocations import RedisBackend
+
+    if redis_url:
+        redis_backend = RedisBackend.from_url(redis_url, prefix=f"bench:{os.getpid()}:")
+    else:
+        import fakeredis
+        redis_backend = RedisBackend(fakeredis.FakeRedis(decode_responses=True))
+
+    db_path = os.path.join(directory, "backends.db")
+    allocations.create_schema(db_path)
+    count = min(operations, size)
+
+    reports = []
+    try:
+        for name, backend in (("sqlite", SQLiteBackend(db_path)), ("redis", redis_backend)):
+            fill_pool(backend, size)
+            reports.append({
+                "backend": name,
+                "pool_size": size,
+                "latency": bench_latency(backend, count),
+                "threads": bench_threads(backend, threads, count),
+            })
+    finally:
+        if redis_url:
+            for key in redis_backend.redis.scan_iter(f"{redis_backend.prefix}*"):
+                redis_backend.redis.delete(key)
+        redis_backend.close()
+        allocations.close_connections()
+    return reports
+
+def _percentile(values, q):
+    """Return the `q` percentile of `values` (nearest rank), or None if there are none."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+def _summary(seconds):
+    """Return the p50, p99 and maximum of durations in seconds, in milliseconds."""
+    return {
+        "p50_ms": round(_percentile(seconds, 50) * 1000, 3),
+        "p99_ms": round(_percentile(seconds, 99) * 1000, 3),
+        "max_ms": round(max(seconds) * 1000, 3),
+    }
+
+def _latency(seconds):
+    """Return the summary of the durations of sequential calls and their rate."""
+    return {"calls": len(seconds), **_summary(seconds), "per_second": round(len(seconds) / sum(seconds), 1)}
+
+def _timed(func, *args, **kwargs):
+    """Call `func` and return the time it took and its result."""
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - t0, result
+
+def _expire_all(db_path):
+    """Make every allocation of the database expired."""
+    with allocations.transaction(db_path, immediate=True) as cursor:
+        cursor.execute("UPDATE allocations SET expiration_time = ?", (int(time.time()) - 1,))
+
+def bench_latency(backend, operations):
+    """
+    Measure the latency of sequential calls to an allocation backend whose pool
+    has room for `operations` allocations.
+
+    Returns:
+        dict: The latency summary of `get_allocation` for new and for existing
+        leases and of `delete_allocation`, and the duration and rate of a
+        `remove_expired_allocations` call removing `operations` leases.
+    """
+    new, existing, deleted = [], [], []
+    for i in range(operations):
+        new.append(_timed(backend.get_allocation, owner="bench", experiment_id=f"xp_{i}")[0])
+        existing.append(_timed(backend.get_allocation, owner="bench", experiment_id=f"xp_{i}")[0])
+    for i in range(operations):
+        deleted.append(_timed(backend.delete_allocation, f"xp_{i}")[0])
+
+    # Leases that expired a minute ago
+    for i in range(operations):
+        backend.get_allocation(owner="bench", experiment_id=f"expired_{i}", duration=-1)
+    seconds, removed = _timed(backend.remove_expired_allocations)
+
+    return {
+        "get_allocation_new": _latency(new),
+        "get_allocation_existing": _latency(existing),
+        "delete_allocation": _latency(deleted),
+        "remove_expired_allocations": {
+            "removed": removed,
+            "seconds": round(seconds, 3),
+            "per_second": round(removed / seconds, 1),
+        },
+    }
+
+def bench_threads(backend, threads, operations):
+    """
+    Allocate `operations` experiments from `threads` threads at once.
+
+    Returns:
+        dict: The number of allocations, the allocation rate and the errors.
+    """
+    start = threading.Barrier(threads + 1)
+    errors = []
+
+    def worker(t):
+        start.wait()
+        try:
+            for i in range(operations // threads):
+                backend.get_allocation(owner=f"thread{t}", experiment_id=f"xp_{t}_{i}")
+        except Exception as e:
+            errors.append(f"thread {t}: {e!r}")
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+
+    count = (operations // threads) * threads
+    return {
+        "threads": threads,
+        "allocations": count,
+        "allocations_per_second": round(count / elapsed, 1),
+        "problems": errors,
+    }
+
+def bench_exhaustion(db_path, size, operations):
+    """
+    Fill a pool of `size` IPs and subnets, then ask for `operations` more
+    allocations, first while every lease is current, then once they have all
+    expired.
+
+    Returns:
+        dict: The rate at which the pool was filled, the latency of the calls
+        failing on the exhausted pool and of the calls reclaiming expired
+        leases, and the problems found (calls that did not fail or did not
+        succeed as expected).
+    """
+    seconds = 0
+    for first in range(0, size, 1000):
+        requests = [("bench", f"fill_{i}") for i in range(first, min(first + 1000, size))]
+        seconds += _timed(allocations.allocate_many, requests, db_path=db_path)[0]
+
+    problems = []
+    failed, reclaimed = [], []
+    for i in range(operations):
+        t0 = time.perf_counter()
+        try:
+            allocations.get_allocation(owner="bench", experiment_id=f"xp_{i}", db_path=db_path)
+            problems.append(f"xp_{i} was allocated from an exhausted pool")
+        except allocations.AllocationError:
+            pass
+        failed.append(time.perf_counter() - t0)
+
+    _expire_all(db_path)
+    for i in range(operations):
+        try:
+            reclaimed.append(_timed(allocations.get_allocation, owner="bench", experiment_id=f"xp_{i}", db_path=db_path)[0])
+        except allocations.AllocationError as e:
+            problems.append(f"xp_{i} could not reclaim an expired lease: {e}")
+
+    return {
+        "fill_per_second": round(size / seconds, 1),
+        "exhausted": _latency(failed),
+        "reclaim_expired": _latency(reclaimed) if reclaimed else None,
+        "problems": problems,
+    }
+
+def suite(directory, sizes, operations, threads, processes):
+    """
+    Run every benchmark on pools of each of `sizes` IPs and subnets, with at
+    most `operations` allocations per benchmark.
+
+    Every benchmark starts from a copy of the same freshly created pool.
+
+    Returns:
+        list: One report per pool size.
+    """
+    reports = []
+    for size in sizes:
+        count = min(operations, size)
+        template = os.path.join(directory, f"pool_{size}.db")
+        create_pool(template, size)
+        allocations.close_connections()
+
+        def fresh(name):
+            db_path = os.path.join(directory, f"{name}_{size}.db")
+            shutil.copyfile(template, db_path)
+            return db_path
+
+        reports.append({
+            "pool_size": size,
+            "latency": bench_latency(SQLiteBackend(fresh("latency")), count),
+            "threads": bench_threads(SQLiteBackend(fresh("threads")), threads, count),
+            "processes": _run_processes(fresh("processes"), processes, count // processes),
+            "exhaustion": bench_exhaustion(fresh("exhaustion"), size, min(count, 100)),
+        })
+        allocations.close_connections()
+    return reports
+
+async def _probe(stop, lags, interval=0.001):
+    """Record how late the event loop wakes up a task sleeping `interval` seconds."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - t0 - interval, 0))
+
+async def _async_load(db_path, mode, clients, per_client):
+    store = AsyncAllocations(SQLiteBackend(db_path)) if mode == "facade" else None
+    latencies = []
+    lags = []
+
+    async def client(c):
+        for i in range(per_client):
+            experiment_id = f"xp_{c}_{i}"
+            t0 = time.perf_counter()
+            if store:
+                await store.get_allocation(owner=f"client{c}", experiment_id=experiment_id)
+                await store.delete_allocation(experiment_id)
+            else:
+                allocations.get_allocation(owner=f"client{c}", experiment_id=experiment_id, db_path=db_path)
+                allocations.delete_allocation(experiment_id, db_path=db_path)
+                await asyncio.sleep(0)
+            latencies.append(time.perf_counter() - t0)
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe(stop, lags))
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(clients)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await probe
+    if store:
+        store.close()
+
+    return {
+        "mode": mode,
+        "clients": clients,
+        "allocations": len(latencies),
+        "allocations_per_second": round(len(latencies) / elapsed, 1),
+        "latency": _summary(latencies),
+        "loop_lag": _summary(lags),
+    }
+
+def _per_call_client(credentials_path):
+    """Build an S3 client from the credentials file, as every request used to."""
+    import boto3
+    from botocore.client import Config
+
+    with open(credentials_path, 'r') as json_file:
+        credentials = json.load(json_file)
+    s3 = boto3.resource('s3',
+                        endpoint_url=credentials['endpointUrl'],
+                        aws_access_key_id=credentials['accessKey'],
+                        aws_secret_access_key=credentials['secretKey'],
+                        config=Config(signature_version='s3v4'))
+    return s3.meta.client, credentials['bucket']
+
+def bench_s3(directory, operations, size, credentials_path=None):
+    """
+    Upload then download `operations` objects of `size` bytes, with a new S3
+    client per call and with a shared `S3ClientManager`.
+
+    Objects are stored in the bucket of `credentials_path`, under a `bench/`
+    prefix removed afterwards, or in an in-process moto server when None.
+
+    Returns:
+        list: One report per mode with the upload and download latencies.
+    """
+    import io
+    from s3client import S3ClientManager
+
+    server = None
+    if credentials_path is None:
+        from moto.server import ThreadedMotoServer
+
+        server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        server.start()
+        host, port = server.get_host_and_port()
+        credentials_path = os.path.join(directory, "credentials.json")
+        with open(credentials_path, 'w') as json_file:
+            json.dump({"endpointUrl": f"http://{host}:{port}", "accessKey": "bench", "secretKey": "bench",
+                       "bucket": "bench"}, json_file)
+        _per_call_client(credentials_path)[0].create_bucket(Bucket="bench")
+
+    manager = S3ClientManager(credentials_path)
+    modes = {
+        "per_call": lambda: _per_call_client(credentials_path),
+        "shared": manager.get,
+    }
+    payload = os.urandom(size)
+    path = os.path.join(directory, "download.zip")
+
+    def upload(get_client, key):
+        client, bucket = get_client()
+        client.upload_fileobj(io.BytesIO(payload), bucket, key)
+
+    def download(get_client, key):
+        client, bucket = get_client()
+        client.download_file(bucket, key, path)
+
+    reports = []
+    try:
+        for mode, get_client in modes.items():
+            uploads = []
+            downloads = []
+            for i in range(operations):
+                uploads.append(_timed(upload, get_client, f"bench/{mode}-{i}.zip")[0])
+            for i in range(operations):
+                downloads.append(_timed(download, get_client, f"bench/{mode}-{i}.zip")[0])
+            reports.append({
+                "mode": mode,
+                "object_size": size,
+                "upload": _latency(uploads),
+                "download": _latency(downloads),
+            })
+    finally:
+        client, bucket = manager.get()
+        for mode in modes:
+            for i in range(operations):
+                client.delete_object(Bucket=bucket, Key=f"bench/{mode}-{i}.zip")
+        manager.close()
+        if server is not None:
+            server.stop()
+    return reports
+
+def async_compare(directory, clients, per_client):
+    """
+    Allocate and release `per_client` experiments from each of `clients`
+    coroutines, first calling the store from the event loop, then through the
+    async facade.
+
+    Returns:
+        list: One report per mode with the allocation rate, the latency of an
+        allocation and release, and the event loop lag.
+    """
+    reports = []
+    for mode in ("sync", "facade"):
+        db_path = os.path.join(directory, f"{mode}.db")
+        create_pool(db_path, clients)
+        reports.append(asyncio.run(_async_load(db_path, mode, clients, per_client)))
+        allocations.close_connections()
+    return reports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark and stress test the allocation store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    parser_suite = commands.add_parser("suite", help="Latency, throughput and exhaustion benchmarks")
+    parser_suite.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000], help="Pool sizes (number of IPs and of subnets)")
+    parser_suite.add_argument('--operations', type=int, default=1000, help="Maximum number of allocations per benchmark")
+    parser_suite.add_argument('--threads', type=int, default=8, help="Number of concurrent threads")
+    parser_suite.add_argument('--processes', type=int, default=os.cpu_count(), help="Number of concurrent processes")
+    parser_backends = commands.add_parser("backends", help="Latency and throughput of the SQLite and Redis backends")
+    parser_backends.add_argument('--size', type=int, default=1000, help="Pool size (number of IPs and of subnets)")
+    parser_backends.add_argument('--operations', type=int, default=1000, help="Maximum number of allocations per benchmark")
+    parser_backends.add_argument('--threads', type=int, default=8, help="Number of concurrent threads")
+    parser_backends.add_argument('--redis-url', help="Redis server to use instead of an in-process fakeredis")
+    parser_stress = commands.add_parser("stress", help="Concurrent allocations from several processes")
+    parser_stress.add_argument('--processes', type=int, default=os.cpu_count(), help="Number of concurrent processes")
+    parser_stress.add_argument('--allocations', type=int, default=200, help="Number of allocations per process")
+    parser_async = commands.add_parser("async", help="Latency of sync and async allocation calls from an event loop")
+    parser_async.add_argument('--clients', type=int, default=50, help="Number of concurrent clients")
+    parser_async.add_argument('--allocations', type=int, default=20, help="Number of allocations per client")
+    parser_s3 = commands.add_parser("s3", help="Latency of S3 uploads and downloads with per-call and shared clients")
+    parser_s3.add_argument('--operations', type=int, default=100, help="Number of uploads and of downloads per mode")
+    parser_s3.add_argument('--size', type=int, default=64 * 1024, help="Size of the objects in bytes")
+    parser_s3.add_argument('--credentials', help="Credentials file of the S3 storage to use instead of an in-process moto server")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.command == "suite":
+            report = suite(tmp, args.sizes, args.operations, args.threads, args.processes)
+            problems = [problem for size in report for part in ("threads", "processes", "exhaustion")
+                        for problem in size[part]["problems"]]
+        elif args.command == "backends":
+            report = compare_backends(tmp, args.size, args.operations, args.threads, args.redis_url)
+            problems = [problem for backend in report for problem in backend["threads"]["problems"]]
+        elif args.command == "stress":
+            report = stress(os.path.join(tmp, "stress.db"), args.processes, args.allocations)
+            problems = report["problems"]
+        elif args.command == "s3":
+            report = bench_s3(tmp, args.operations, args.size, args.credentials)
+            problems = []
+        else:
+            report = async_compare(tmp, args.clients, args.allocations)
+            problems = []
+
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+class ExecutorSaturated(Exception):
+    """Raised when a call is submitted to an executor whose queue is full."""
+
+class BoundedExecutor:
+    """
+    Thread pool running blocking calls for the event loop, with a bounded
+    queue.
+
+    At most `workers` calls run at once and `queue_size` more wait for a
+    thread. Beyond that, calls are rejected with `ExecutorSaturated` rather
+    than queued, so that a stuck dependency (e.g. an SSH server that doesn't
+    answer) fails requests fast instead of piling them up. `stats` tells how
+    busy the pool is.
+
+    Args:
+        name (str): Name of the pool, used for its threads and stats.
+        workers (int): Number of threads.
+        queue_size (int): Number of calls that may wait for a thread.
+    """
+    def __init__(self, name, workers, queue_size=None):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size if queue_size is not None else 4 * workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active = 0
+        self._peak = 0
+        self._started = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _call(self, submitted, func):
+        waited = time.monotonic() - submitted
+        with self._lock:
+            self._active += 1
+            self._started += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` in the pool and return its result.
+
+        Raises:
+            ExecutorSaturated: If all the threads are busy and the queue is full.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                self._rejected += 1
+                raise ExecutorSaturated(f"The {self.name} pool is saturated")
+            self._pending += 1
+            self._peak = max(self._peak, self._pending)
+
+        try:
+            future = self._executor.submit(self._call, time.monotonic(), partial(func, *args, **kwargs))
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        # Released when the call ends, even if the caller was cancelled
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    @property
+    def stats(self):
+        """Current load of the pool and counters since it was created."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "active": self._active,
+                "queued": self._pending - self._active,
+                "peak": self._peak,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "saturation": self._pending / (self.workers + self.queue_size),
+                "avg_wait_ms": 1000 * self._wait_total / self._started if self._started else 0.0,
+                "max_wait_ms": 1000 * self._wait_max,
+            }
+
+    def shutdown(self, wait=True):
+        """Stop the threads, waiting for the pending calls unless `wait` is False."""
+        self._executor.shutdown(wait=wait)
@@ -1,35 +1,185 @@
 import ipaddress
 import random
+import struct
+from array import array
+
+class IPPool:
+  """
+  Pool of the usable host addresses of an IPv4 network.
+
+  Addresses are stored as integer offsets into the network. Free offsets are
+  kept in a dense array and a second array gives the position of every offset
+  in the first one (or `_USED` when it is not free), so that picking a random
+  address, taking or releasing a given address, testing membership and
+  getting the size of the pool are all O(1), with 8 bytes per address and no
+  Python object per address.
+
+  Args:
+      prefix (str): The network prefix in CIDR notation (e.g., '192.0.2.0/24').
+      free (bool): Whether the pool starts with all its addresses free (the
+          default) or with none of them.
+  """
+  _USED = 0xFFFFFFFF
+  _HEADER = struct.Struct("!IB")
+
+  def __init__(self, prefix, free=True):
+    self.network = ipaddress.IPv4Network(prefix)
+    self._base = int(self.network.network_address)
+
+    # Same addresses as IPv4Network.hosts(): no network and broadcast
+    # addresses, except for /31 and /32 networks
+    if self.network.prefixlen >= 31:
+      self._first, self.capacity = 0, self.network.num_addresses
+    else:
+      self._first, self.capacity = 1, self.network.num_addresses - 2
+
+    if free:
+      self._free = array("I", range(self._first, self._first + self.capacity))
+      self._pos = array("I", range(self.capacity))
+    else:
+      self._free = array("I")
+      self._pos = array("I", [self._USED]) * self.capacity
+
+  def _index(self, ip):
+    """Return the index of `ip` in the pool, or None if it's not a usable address of the network."""
+    index = int(ipaddress.IPv4Address(ip)) - self._base - self._first
+    if 0 <= index < self.capacity:
+      return index
+    return None
+
+  def _take(self, index):
+    position = self._pos[index]
+    last = self._free.pop()
+    if position < len(self._free):
+      self._free[position] = last
+      self._pos[last - self._first] = position
+    self._pos[index] = self._USED
+
+  def __len__(self):
+    return len(self._free)
+
+  def __contains__(self, ip):
+    index = self._index(ip)
+    return index is not None and self._pos[index] != self._USED
+
+  def __iter__(self):
+    for offset in self._free:
+      yield ipaddress.IPv4Address(self._base + offset)
+
+  def pick(self):
+    """
+    Take a random free address out of the pool.
+
+    Returns:
+        IPv4Address: The address taken.
+
+    Raises:
+        ValueError: If the pool is empty.
+    """
+    if not self._free:
+      raise ValueError("The IP pool is empty!")
+
+    offset = self._free[random.randrange(len(self._free))]
+    self._take(offset - self._first)
+    return ipaddress.IPv4Address(self._base + offset)
+
+  def take(self, ip):
+    """
+    Take a given address out of the pool.
+
+    Raises:
+        ValueError: If the address is not free in the pool.
+    """
+    index = self._index(ip)
+    if index is None or self._pos[index] == self._USED:
+      raise ValueError(f"{ip} is not free in {self.network}")
+    self._take(index)
+
+  def release(self, ip):
+    """
+    Give an address back to the pool.
+
+    Raises:
+        ValueError: If the address is not a usable address of the network or
+            is already free.
+    """
+    index = self._index(ip)
+    if index is None:
+      raise ValueError(f"{ip} is not a usable address of {self.network}")
+    if self._pos[index] != self._USED:
+      raise ValueError(f"{ip} is already free in {self.network}")
+    self._pos[index] = len(self._free)
+    self._free.append(index + self._first)
+
+  def to_bytes(self):
+    """
+    Serialize the pool.
+
+    Returns:
+        bytes: The network address and prefix length followed by a bitmap of
+        the free addresses.
+    """
+    bitmap = bytearray((self.capacity + 7) // 8)
+    first = self._first
+    for offset in self._free:
+      index = offset - first
+      bitmap[index >> 3] |= 1 << (index & 7)
+    return self._HEADER.pack(self._base, self.network.prefixlen) + bytes(bitmap)
+
+  @classmethod
+  def from_bytes(cls, data):
+    """
+    Rebuild a pool serialized with `to_bytes`.
+
+    Raises:
+        ValueError: If `data` is not a serialized pool, e.g. truncated.
+    """
+    if len(data) < cls._HEADER.size:
+      raise ValueError("Truncated IP pool header")
+    base, prefixlen = cls._HEADER.unpack_from(data)
+    pool = cls(f"{ipaddress.IPv4Address(base)}/{prefixlen}", free=False)
+
+    bitmap = memoryview(data)[cls._HEADER.size:]
+    if len(bitmap) != (pool.capacity + 7) // 8:
+      raise ValueError(f"The bitmap of {pool.network} has {len(bitmap)} bytes instead of {(pool.capacity + 7) // 8}")
+    if pool.capacity % 8 and bitmap[-1] >> (pool.capacity % 8):
+      raise ValueError(f"The bitmap of {pool.network} has addresses beyond its capacity")
+    for byte_index, byte in enumerate(bitmap):
+      while byte:
+        bit = byte & -byte
+        index = (byte_index << 3) + bit.bit_length() - 1
+        pool._pos[index] = len(pool._free)
+        pool._free.append(index + pool._first)
+        byte ^= bit
+    return pool
 
 def generate_ip_pool(prefix):
   """
   Generate a pool of usable IP addresses from a given IPv4 network prefix.
 
   This function takes a network prefix in CIDR notation (e.g., '192.0.2.0/24')
-  and returns a set of all usable host IP addresses within that network.
+  and returns a pool of all usable host IP addresses within that network.
 
   Args:
       prefix (str): A string representing the network prefix in CIDR notation.
 
   Returns:
-      set: A set of IPv4 addresses (as IPv4Address objects) that are usable 
-            within the specified network, excluding network and broadcast addresses.
+      IPPool: A pool of the addresses that are usable within the specified
+            network, excluding network and broadcast addresses.
   """
-  network = ipaddress.IPv4Network(prefix)
-  ip_pool = set(network.hosts())
-
-  return ip_pool
+  return IPPool(prefix)
 
 def pick_and_remove_ip(ip_pool):
   """
   Select and remove a random IP address from a given IP pool.
 
-  This function picks a random IP address from the provided set of IP addresses
-  and removes it from the pool. If the pool is empty, it raises a ValueError.
+  This function picks a random IP address from the provided pool of IP
+  addresses and removes it from the pool. If the pool is empty, it raises a
+  ValueError.
 
   Args:
-      ip_pool (set): A set of IP addresses (as IPv4Address objects) from which to 
-                      pick and remove an IP address.
+      ip_pool (IPPool): A pool of IP addresses from which to pick and remove
+                      an IP address.
 
   Returns:
       IPv4Address: The randomly selected IP address that has been removed from the pool.
@@ -37,10 +187,4 @@ def pick_and_remove_ip(ip_pool):
   Raises:
       ValueError: If the ip_pool is empty.
   """
-  if not ip_pool:
-    raise ValueError("The IP pool is empty!")
-  
-  selected_ip = random.choice(list(ip_pool))
-  ip_pool.remove(selected_ip)
-
-  return selected_ip
\ No newline at end of file
+  return ip_pool.pick()
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+logger = logging.getLogger("slices-backend")
+
+_JOB_COLUMNS = "id, kind, owner, status, stage, created, started, finished, stages, result, error"
+
+# Seconds to wait for the write lock of the database
+BUSY_TIMEOUT = 5
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but run by another user
+        return True
+    return True
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while `max_pending` jobs are already waiting."""
+
+class Job:
+    """
+    A job being run, handed to its work function to report its stages.
+
+    Attributes:
+        id (str): Identifier of the job.
+        stages (dict): Duration in seconds of each finished stage.
+    """
+    def __init__(self, queue, job_id):
+        self._queue = queue
+        self.id = job_id
+        self.stages = {}
+
+    @asynccontextmanager
+    async def stage(self, name):
+        """Run a stage of the job, recording that it is running and then its duration."""
+        await self._queue._update(self.id, stage=name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round(time.perf_counter() - start, 6)
+            await self._queue._update(self.id, stages=json.dumps(self.stages))
+
+class JobQueue:
+    """
+    Queue of jobs run in the background by a fixed number of workers, whose
+    state is kept in a SQLite database.
+
+    A job is a coroutine function called with its `Job`, whose result must
+    be JSON serializable. Submitting a job with the same key as a job still
+    queued or running returns that job instead of queueing another one. At
+    most `max_pending` jobs wait for a worker, further submissions are
+    rejected with `JobQueueFull`.
+
+    The state of each job (queued, running, succeeded or failed), its current
+    stage, the duration of its stages, and its result or error are recorded
+    in the database, and jobs finished for more than `retention` seconds are
+    deleted. The database can be shared by the processes of a host (e.g.
+    uvicorn workers): each job records the process running it, and jobs left
+    queued or running by a process that is gone are marked failed when a
+    queue is created and after each job, as are the jobs a queue didn't finish
+    when it is stopped. Workers are started with `start()`, or by the first
+    submission.
+
+    Args:
+        db_path (str): Path of the SQLite database.
+        workers (int): Number of jobs run at once.
+        max_pending (int): Maximum number of jobs waiting for a worker.
+        retention (float): Seconds finished jobs are kept.
+    """
+    def __init__(self, db_path='jobs.db', workers=2, max_pending=100, retention=7 * 24 * 3600):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention = retention
+        self._queue = None
+        self._waiting = 0
+        self._inflight = {}
+        self._tasks = []
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._create_db()
+        self._prune()
+
+    def _connection(self):
+        # Called with the lock held. A connection inherited from a parent
+        # process is never reused.
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        """Close the connection to the database, it is opened again when needed."""
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._pid = None
+
+    def _create_db(self):
+        with self._transaction() as cursor:
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                stages TEXT NOT NULL DEFAULT '{}',
+                result TEXT,
+                error TEXT,
+                pid INTEGER
+            )
+            ''')
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(jobs)")]
+            if "pid" not in columns:
+                cursor.execute("ALTER TABLE jobs ADD COLUMN pid INTEGER")
+            cursor.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs(finished)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)")
+
+    def _fail_orphans(self):
+        # Without workers, a job of this process id is from a previous process
+        # that had the same id (e.g. the main process of a restarted
+        # container), or was cancelled when the workers were stopped
+        with self._transaction() as cursor:
+            pids = [pid for (pid,) in cursor.execute(
+                "SELECT DISTINCT pid FROM jobs WHERE status IN ('queued', 'running')")]
+            gone = [pid for pid in pids
+                    if pid is None or (pid == os.getpid() and not self._tasks) or not _process_alive(pid)]
+            for pid in gone:
+                cursor.execute("UPDATE jobs SET status = 'failed', stage = NULL, finished = ?, "
+                               "error = 'Interrupted by a restart' "
+                               "WHERE status IN ('queued', 'running') AND pid IS ?", (time.time(), pid))
+
+    def _insert(self, job_id, kind, owner):
+        with self._transaction() as cursor:
+            cursor.execute("INSERT INTO jobs (id, kind, owner, status, created, pid) VALUES (?, ?, ?, 'queued', ?, ?)",
+                           (job_id, kind, owner, time.time(), os.getpid()))
+
+    def _write(self, job_id, fields):
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with self._transaction() as cursor:
+            cursor.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    async def _update(self, job_id, **fields):
+        await asyncio.to_thread(self._write, job_id, fields)
+
+    def _prune(self):
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM jobs WHERE finished < ?", (time.time() - self.retention,))
+        self._fail_orphans()
+
+    def get(self, job_id):
+        """
+        Return the state of a job, or None if there is no such job.
+
+        Returns:
+            dict: The job's `id`, `kind`, `owner`, `status`, current `stage`,
+            `created`, `started` and `finished` times (POSIX), duration of its
+            `stages`, and `result` or `error`.
+        """
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(_JOB_COLUMNS.split(", "), row))
+        job["stages"] = json.loads(job["stages"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    async def submit(self, kind, owner, work, key=None):
+        """
+        Queue a job.
+
+        Args:
+            kind (str): Kind of job.
+            owner (str): User the job runs for.
+            work (callable): Coroutine function run with the `Job`.
+            key (str): Key identifying identical jobs, if any.
+
+        Returns:
+            tuple: The identifier of the job and a future of its result,
+            either of the new job or of the identical job in progress.
+
+        Raises:
+            JobQueueFull: If `max_pending` jobs are already waiting.
+        """
+        # A finished job is forgotten once its worker is done with it, it
+        # can't be shared meanwhile
+        if key is not None and key in self._inflight and not self._inflight[key][1].done():
+            return self._inflight[key]
+        self.start()
+        if self._waiting >= self.max_pending:
+            raise JobQueueFull(f"{self.max_pending} jobs are already waiting")
+
+        # The job is reserved before the first await, so identical submissions
+        # made meanwhile share it
+        job_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        # Failures are recorded, they don't need to be awaited
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if key is not None:
+            self._inflight[key] = (job_id, future)
+        self._waiting += 1
+
+        try:
+            await asyncio.to_thread(self._insert, job_id, kind, owner)
+        except BaseException as e:
+            self._waiting -= 1
+            if key is not None:
+                self._inflight.pop(key, None)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.cancel()
+            raise
+        self._queue.put_nowait((job_id, key, work, future))
+        return job_id, future
+
+    async def _run(self, job_id, work, future):
+        job = Job(self, job_id)
+        await self._update(job_id, status="running", started=time.time())
+        try:
+            result = await work(job)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e!r}")
+            await self._update(job_id, status="failed", stage=None, finished=time.time(),
+                               error=str(getattr(e, "detail", e)))
+            if not future.done():
+                future.set_exception(e)
+        else:
+            await self._update(job_id, status="succeeded", stage=None, finished=time.time(),
+                               result=json.dumps(result))
+            if not future.done():
+                future.set_result(result)
+
+    async def _worker(self):
+        while True:
+            job_id, key, work, future = await self._queue.get()
+            self._waiting -= 1
+            try:
+                await self._run(job_id, work, future)
+                await asyncio.to_thread(self._prune)
+            except Exception as e:
+                # The database failed, the job can't be tracked anymore
+                logger.error(f"Job {job_id} couldn't be recorded: {e!r}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                if key is not None and self._inflight.get(key, (None,))[0] == job_id:
+                    del self._inflight[key]
+                self._queue.task_done()
+
+    def start(self):
+        """Start the workers in the running event loop, if they are not running yet."""
+        if not self._tasks:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Stop the workers, cancelling the jobs not finished, which are marked
+        failed.
+        """
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+        while self._queue is not None and not self._queue.empty():
+            job_id, key, work, future = self._queue.get_nowait()
+            future.cancel()
+        self._waiting = 0
+        self._inflight.clear()
+
+        try:
+            await asyncio.to_thread(self._fail_orphans)
+        except sqlite3.Error as e:
+            # Another process marks them failed once this one is gone
+            logger.error(f"Failed to record the jobs cancelled: {e!r}")
@@ -0,0 +1,305 @@
+import asyncio
+import errno
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger("slices-backend")
+
+def _track(value, on_change):
+    """Wrap the dicts and lists of `value` so that their changes call `on_change`."""
+    if isinstance(value, dict):
+        return TrackedDict(value, on_change)
+    if isinstance(value, list):
+        return TrackedList(value, on_change)
+    return value
+
+class TrackedDict(dict):
+    """
+    Dict calling `on_change` whenever it, or a dict or list it holds, is
+    modified. Dicts and lists stored into it are tracked too.
+    """
+    def __init__(self, data=(), on_change=None):
+        self._on_change = on_change
+        super().__init__((key, _track(value, on_change)) for key, value in dict(data).items())
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, _track(value, self._on_change))
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        super().update((key, _track(value, self._on_change)) for key, value in dict(*args, **kwargs).items())
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+class TrackedList(list):
+    """
+    List calling `on_change` whenever it, or a dict or list it holds, is
+    modified. Dicts and lists stored into it are tracked too.
+    """
+    def __init__(self, data=(), on_change=None):
+        self._on_change = on_change
+        super().__init__(_track(value, on_change) for value in data)
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change()
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [_track(item, self._on_change) for item in value]
+        else:
+            value = _track(value, self._on_change)
+        super().__setitem__(index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._changed()
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        result = super().__imul__(n)
+        self._changed()
+        return result
+
+    def append(self, value):
+        super().append(_track(value, self._on_change))
+        self._changed()
+
+    def extend(self, values):
+        super().extend(_track(value, self._on_change) for value in values)
+        self._changed()
+
+    def insert(self, index, value):
+        super().insert(index, _track(value, self._on_change))
+        self._changed()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def remove(self, value):
+        super().remove(value)
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        super().reverse()
+        self._changed()
+
+def write_atomic(path, content):
+    """
+    Replace the content of a file atomically.
+
+    The content is written and fsynced to a temporary file next to `path`,
+    which is then renamed over it. When the file can't be replaced (e.g. it's
+    a bind mount of a single file in a container), it is rewritten in place
+    instead, which is not atomic.
+
+    Args:
+        path (str): Path of the file.
+        content (str): New content of the file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "w") as tmp:
+            tmp.write(content)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        try:
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if e.errno not in (errno.EBUSY, errno.EXDEV):
+                raise
+            logger.debug(f"Can't replace {path} ({e}), rewriting it in place.")
+            with open(path, "w") as file:
+                file.write(content)
+                file.flush()
+                os.fsync(file.fileno())
+            os.remove(tmp_path)
+            return
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+class JsonStore:
+    """
+    JSON document kept in memory and written back to its file in the
+    background.
+
+    The document is made of `TrackedDict` and `TrackedList` containers, so
+    every change bumps `version` and marks the document dirty. A background
+    task started with `start()` writes the dirty document once it hasn't
+    changed for `delay` seconds, and at the latest `max_delay` seconds after
+    the first change, so that a burst of changes costs a single write. Writes
+    are atomic (see `write_atomic`). `stop()` writes pending changes.
+
+    The document should only be changed from the event loop thread, where it
+    is serialized.
+
+    Args:
+        path (str): Path of the JSON file.
+        delay (float): Seconds without changes before writing.
+        max_delay (float): Maximum seconds between a change and its write.
+    """
+    def __init__(self, path, delay=1.0, max_delay=10.0):
+        self.path = path
+        self.delay = delay
+        self.max_delay = max_delay
+        self.version = 0
+        self.data = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self.stats = {
+            "writes": 0,
+            "last_write": None,
+            "last_error": None,
+        }
+
+    def load(self):
+        """Load the document from its file, discarding unsaved changes, and return it."""
+        with open(self.path, 'r') as json_file:
+            self.data = TrackedDict(json.load(json_file), self._changed)
+        self._dirty = False
+        self.version += 1
+        return self.data
+
+    @property
+    def dirty(self):
+        """Whether the document has changes that are not written yet."""
+        return self._dirty
+
+    def _changed(self):
+        with self._lock:
+            self.version += 1
+            if self._dirty:
+                return
+            self._dirty = True
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _serialize(self):
+        # Changes from now on will need another write
+        self._dirty = False
+        try:
+            return json.dumps(self.data, indent=4)
+        except BaseException:
+            self._dirty = True
+            raise
+
+    def flush(self):
+        """Write the document now if it has unsaved changes."""
+        if self._dirty:
+            self._write(self._serialize())
+
+    def _write(self, content):
+        try:
+            write_atomic(self.path, content)
+        except OSError as e:
+            self._dirty = True
+            self.stats["last_error"] = str(e)
+            raise
+        self.stats["writes"] += 1
+        self.stats["last_write"] = self.version
+        self.stats["last_error"] = None
+
+    def start(self):
+        """Start the background writer in the running event loop."""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            if self._dirty:
+                self._wakeup.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background writer and write pending changes."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._loop = None
+        self.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            # Wait for the changes to settle
+            deadline = loop.time() + self.max_delay
+            version = self.version
+            while True:
+                await asyncio.sleep(max(min(self.delay, deadline - loop.time()), 0))
+                if self.version == version or loop.time() >= deadline:
+                    break
+                version = self.version
+
+            if not self._dirty:
+                continue
+            try:
+                await asyncio.to_thread(self._write, self._serialize())
+            except OSError as e:
+                logger.error(f"Failed to write {self.path}: {e}")
+                self._wakeup.set()
+                await asyncio.sleep(self.max_delay)
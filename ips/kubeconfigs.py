@@ -0,0 +1,240 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+
+import jwt
+import yaml
+from cryptography import x509
+from cryptography.fernet import Fernet, InvalidToken
+
+from jsonstore import write_atomic
+
+logger = logging.getLogger("slices-backend")
+
+def credentials_expiration(config):
+    """
+    Return when the first of the credentials of a kubeconfig expires.
+
+    The credentials are the client certificates (`client-certificate-data`)
+    and the JWT bearer tokens (`token`) of its users.
+
+    Args:
+        config (dict): The kubeconfig.
+
+    Returns:
+        float: The POSIX time of the earliest expiration, or None if no
+        credential expires.
+    """
+    expirations = []
+    for entry in config.get("users") or []:
+        user = (entry or {}).get("user") or {}
+
+        certificate_data = user.get("client-certificate-data")
+        if certificate_data:
+            try:
+                certificate = x509.load_pem_x509_certificate(base64.b64decode(certificate_data))
+            except ValueError:
+                logger.warning("Can't read the client certificate of a kubeconfig")
+            else:
+                not_after = getattr(certificate, "not_valid_after_utc", None)
+                if not_after is None:
+                    not_after = certificate.not_valid_after.replace(tzinfo=timezone.utc)
+                expirations.append(not_after.timestamp())
+
+        token = user.get("token")
+        if token:
+            try:
+                expiration = jwt.decode(token, options={"verify_signature": False}).get("exp")
+            except jwt.InvalidTokenError:
+                # Not a JWT, its lifetime is unknown
+                expiration = None
+            if expiration is not None:
+                expirations.append(float(expiration))
+    return min(expirations, default=None)
+
+class KubeconfigCache:
+    """
+    Cache of the kubeconfigs generated for each user and cluster.
+
+    A kubeconfig is kept until `margin` seconds before the first of its
+    credentials expires (see `credentials_expiration`), or for `default_ttl`
+    seconds if none expires, so that clients never get credentials about to
+    expire. At most `maxsize` kubeconfigs are kept in memory, the least
+    recently used ones are dropped first.
+
+    With `spill_dir`, kubeconfigs are also written to that directory,
+    encrypted with the Fernet key `spill_key`, and read back when they are not
+    in memory, e.g. after a restart or once dropped from memory.
+
+    Concurrent requests for a kubeconfig that is not cached share a single
+    generation.
+
+    Args:
+        default_ttl (float): Seconds to keep kubeconfigs whose credentials don't expire.
+        margin (float): Seconds before the expiration of the credentials to drop them.
+        maxsize (int): Maximum number of kubeconfigs kept in memory.
+        spill_dir (str): Directory to write the kubeconfigs to, if any.
+        spill_key (bytes): Fernet key to encrypt the kubeconfigs written to `spill_dir`.
+    """
+    def __init__(self, default_ttl=3600, margin=300, maxsize=1024, spill_dir=None, spill_key=None):
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self.maxsize = maxsize
+        self.spill_dir = spill_dir
+        self._fernet = Fernet(spill_key) if spill_dir is not None else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.stats = {
+            "hits": 0,
+            "spill_hits": 0,
+            "misses": 0,
+            "generations": 0,
+        }
+        if spill_dir is not None:
+            os.makedirs(spill_dir, mode=0o700, exist_ok=True)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            content, expires = entry
+            if time.time() >= expires:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return content
+
+    def _remember(self, key, content, expires):
+        with self._lock:
+            self._entries[key] = (content, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _spill_path(self, key):
+        name = hashlib.sha256("\0".join(key).encode()).hexdigest()
+        return os.path.join(self.spill_dir, f"{name}.kubeconfig")
+
+    def _spill(self, key, content, expires):
+        token = self._fernet.encrypt(json.dumps({"kubeconfig": content, "expires": expires}).encode())
+        write_atomic(self._spill_path(key), token.decode())
+
+    def _unspill(self, key):
+        path = self._spill_path(key)
+        try:
+            with open(path, 'r') as spill_file:
+                entry = json.loads(self._fernet.decrypt(spill_file.read().encode()))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, InvalidToken) as e:
+            # e.g. written with another key
+            logger.warning(f"Ignoring the cached kubeconfig {path}: {e!r}")
+            return None
+
+        if time.time() >= entry["expires"]:
+            os.remove(path)
+            return None
+        self._remember(key, entry["kubeconfig"], entry["expires"])
+        return entry["kubeconfig"]
+
+    def _expires(self, config):
+        expiration = credentials_expiration(config)
+        if expiration is None:
+            return time.time() + self.default_ttl
+        return expiration - self.margin
+
+    async def _generate(self, key, generate):
+        config = await generate()
+        content = yaml.dump(config)
+        self.stats["generations"] += 1
+
+        expires = self._expires(config)
+        if time.time() < expires:
+            self._remember(key, content, expires)
+            if self._fernet is not None:
+                try:
+                    await asyncio.to_thread(self._spill, key, content, expires)
+                except OSError as e:
+                    logger.error(f"Failed to write the cached kubeconfig: {e}")
+        return content
+
+    async def get(self, user, cluster, generate):
+        """
+        Return the kubeconfig of a user for a cluster, as YAML.
+
+        Args:
+            user (str): The user.
+            cluster (str): The cluster.
+            generate (callable): Coroutine function generating the kubeconfig
+                (as a dict), called when it's not cached.
+
+        Raises:
+            Exception: Whatever `generate` raised, to every request waiting for it.
+        """
+        key = (user, cluster)
+
+        content = self._lookup(key)
+        if content is not None:
+            self.stats["hits"] += 1
+            return content
+
+        if self._fernet is not None:
+            content = await asyncio.to_thread(self._unspill, key)
+            if content is not None:
+                self.stats["spill_hits"] += 1
+                return content
+
+        self.stats["misses"] += 1
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._generate(key, generate))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A request that is cancelled doesn't cancel the generation the others wait for
+        return await asyncio.shield(future)
+
+    def invalidate(self, user, cluster):
+        """Forget the kubeconfig of a user for a cluster."""
+        key = (user, cluster)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self._fernet is not None:
+            try:
+                os.remove(self._spill_path(key))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._entries)
+
+def load_kubeconfig_cache():
+    """
+    Return the kubeconfig cache configured by the environment.
+
+    Environment variables:
+        KUBECONFIG_CACHE_TTL: Seconds to keep kubeconfigs whose credentials
+            don't expire (default 3600).
+        KUBECONFIG_CACHE_DIR: Directory to also keep the kubeconfigs in,
+            encrypted, to survive restarts.
+        KUBECONFIG_CACHE_KEY: Fernet key to encrypt them with, required with
+            KUBECONFIG_CACHE_DIR (e.g. from
+            `python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"`).
+
+    Raises:
+        ValueError: If KUBECONFIG_CACHE_DIR is set without a valid KUBECONFIG_CACHE_KEY.
+    """
+    spill_dir = os.environ.get("KUBECONFIG_CACHE_DIR") or None
+    spill_key = os.environ.get("KUBECONFIG_CACHE_KEY") or None
+    if spill_dir is not None and spill_key is None:
+        raise ValueError("KUBECONFIG_CACHE_DIR requires KUBECONFIG_CACHE_KEY, kubeconfigs are never written in clear.")
+    return KubeconfigCache(default_ttl=float(os.environ.get("KUBECONFIG_CACHE_TTL", 3600)),
+                           spill_dir=spill_dir, spill_key=spill_key)
@@ -0,0 +1,95 @@
+import asyncio
+import re
+import shlex
+import time
+
+# State of a device in the output of `rhubarbe pdu status`
+_STATE = re.compile(r'\b(ON|OFF)\b', re.IGNORECASE)
+
+# Line printed before the status of each device by `pdu_status_command`
+_MARKER = "### rhubarbe pdu status "
+
+def parse_pdu_state(output):
+    """Return the power state (`ON` or `OFF`) reported by `rhubarbe pdu status`, or `UNKNOWN`."""
+    match = _STATE.search(output)
+    return match.group(1).upper() if match else "UNKNOWN"
+
+def pdu_status_command(devices):
+    """
+    Return a single shell command running `rhubarbe pdu status` for every
+    device, each output preceded by a marker line naming the device.
+    """
+    return "; ".join(f"echo {shlex.quote(_MARKER + device)}; rhubarbe pdu status {shlex.quote(device)} 2>&1"
+                     for device in devices)
+
+def parse_pdu_states(output, devices):
+    """
+    Return the power state of each device in the output of
+    `pdu_status_command`, as a dict device -> state (`UNKNOWN` for a device
+    whose state is missing).
+    """
+    sections = {}
+    device = None
+    for line in output.splitlines():
+        if line.startswith(_MARKER):
+            device = line[len(_MARKER):].strip()
+            sections[device] = []
+        elif device is not None:
+            sections[device].append(line)
+    return {device: parse_pdu_state("\n".join(sections.get(device, []))) for device in devices}
+
+class DeviceStateCache:
+    """
+    Power states of the R2LAB devices, fetched at most once every `ttl`
+    seconds.
+
+    Concurrent requests when the states are stale share a single fetch. A
+    fetch that started before `invalidate()` is not cached, so states changed
+    meanwhile are never hidden by older ones.
+
+    Args:
+        fetch (callable): Coroutine function returning the states, as a dict
+            device -> state.
+        ttl (float): Seconds the fetched states are returned for.
+    """
+    def __init__(self, fetch, ttl=10):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._states = None
+        self._fetched = None
+        self._generation = 0
+        self._inflight = None
+        self._inflight_generation = None
+
+    async def _refresh(self, generation):
+        states = await self.fetch()
+        fetched = time.time()
+        if generation == self._generation:
+            self._states = states
+            self._fetched = fetched
+        return states, fetched
+
+    def _forget(self, future):
+        if self._inflight is future:
+            self._inflight = None
+
+    async def get(self):
+        """
+        Return the states of the devices and when they were fetched (POSIX time).
+
+        Raises:
+            Exception: Whatever `fetch` raised.
+        """
+        if self._states is not None and time.time() - self._fetched < self.ttl:
+            return self._states, self._fetched
+
+        if self._inflight is None or self._inflight_generation != self._generation:
+            self._inflight = asyncio.ensure_future(self._refresh(self._generation))
+            self._inflight_generation = self._generation
+            self._inflight.add_done_callback(self._forget)
+        return await asyncio.shield(self._inflight)
+
+    def invalidate(self):
+        """Fetch the states again on the next request, e.g. after they were changed."""
+        self._generation += 1
+        self._states = None
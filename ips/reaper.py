@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+
+logger = logging.getLogger("slices-backend")
+
+class ExpiryReaper:
+    """
+    Background task removing expired allocations.
+
+    The reaper sleeps until the earliest expiration time known to the database
+    (bounded by `min_interval` and `max_interval` seconds), then removes the
+    expired allocations by batches. Requests never wait for it: allocation
+    functions treat expired allocations as free on their own.
+
+    Args:
+        store (AsyncAllocations): The allocation store to clean.
+    """
+    def __init__(self, store, min_interval=1, max_interval=60):
+        self.store = store
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._task = None
+        self.stats = {
+            "runs": 0,
+            "removed_total": 0,
+            "last_run": None,
+            "last_removed": 0,
+            "last_duration": None,
+            "last_error": None,
+            "next_run": None,
+        }
+
+    def start(self):
+        """Start the reaper in the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the reaper and wait for it to finish."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_once(self):
+        """Remove the expired allocations now and return the number removed."""
+        t0 = time.perf_counter()
+        removed = await self.store.remove_expired_allocations()
+
+        self.stats["runs"] += 1
+        self.stats["removed_total"] += removed
+        self.stats["last_run"] = datetime.now(timezone.utc).isoformat()
+        self.stats["last_removed"] = removed
+        self.stats["last_duration"] = round(time.perf_counter() - t0, 6)
+        if removed:
+            logger.info(f"Removed {removed} expired allocation(s).")
+        return removed
+
+    async def _delay(self):
+        """Seconds to sleep until the next expiration."""
+        expiration = await self.store.next_expiration()
+        if expiration is None:
+            return self.max_interval
+        delay = (expiration - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delay, self.min_interval), self.max_interval)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+                delay = await self._delay()
+                self.stats["last_error"] = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Expiry reaper failed: {e}")
+                self.stats["last_error"] = str(e)
+                delay = self.max_interval
+
+            self.stats["next_run"] = datetime.fromtimestamp(time.time() + delay, timezone.utc).isoformat()
+            await asyncio.sleep(delay)
@@ -0,0 +1,539 @@
+import logging
+import ipaddress
+import itertools
+import time
+from datetime import datetime, timezone
+
+import redis
+
+import allocations
+from allocations import (AllocationError, NoIPAvailable, NoPrefixAvailable, DEFAULT_PREFIXLEN,
+                         LIST_PAGE_SIZE, REAP_BATCH_SIZE, IMPORT_CHUNK_SIZE, LEASE_AGE_BUCKETS)
+from backends import AllocationBackend
+
+logger = logging.getLogger("slices-backend")
+
+# Lua helpers shared by the scripts below. Every script gets the key prefix
+# in KEYS[1], the current time (epoch seconds) in ARGV[1] and the number of
+# expired leases reclaimed at a time in ARGV[2].
+#
+# Keys, relative to the prefix:
+#   ips:all, ips:free       IPs of the pool and free IPs (sorted sets scored
+#                           by address)
+#   pool                    subnets and blocks imported into the pool
+#                           (sorted set of `network/prefixlen` scored by
+#                           network)
+#   free:<prefixlen>        free blocks of the buddy allocator (sorted sets
+#                           scored by network)
+#   blocks:<prefixlen>      blocks of the pool, merged with their buddies but
+#                           never split (sorted sets scored by network)
+#   allocated               number of allocated blocks per prefix length
+#   lease:<experiment_id>   the lease (hash), expiring with it
+#   held                    `ip network prefixlen allocation_time` held by
+#                           each experiment until its lease is released or
+#                           reclaimed, Redis not telling when a key expires
+#   expiry                  experiment ids scored by expiration time
+#   listing                 `allocation_time:experiment_id`, in listing order
+#   activity:<hour>         allocations and releases during an hour
+#   meta                    hash of the imported pool file, and whether the
+#                           blocks of the pool were built
+_LIB = '''
+local p = KEYS[1]
+local now = tonumber(ARGV[1])
+local batch = tonumber(ARGV[2])
+local unpack = unpack or table.unpack
+local FIELDS = {'ip', 'network', 'prefixlen', 'owner', 'allocation_time', 'expiration_time'}
+
+local function fmt(n) return string.format('%.0f', n) end
+local function size(len) return 2 ^ (32 - len) end
+local function free_key(len) return p .. 'free:' .. fmt(len) end
+local function listing_member(allocation_time, experiment_id)
+  return string.format('%010d', allocation_time) .. ':' .. experiment_id
+end
+
+local function count_activity(field, n)
+  if n == 0 then return end
+  local key = p .. 'activity:' .. fmt(math.floor(now / 3600))
+  redis.call('HINCRBY', key, field, n)
+  redis.call('EXPIRE', key, 172800)
+end
+
+-- Give a block back to the free lists, merged with its free buddies
+local function free_block(network, len)
+  while len > 0 do
+    local buddy = network + size(len)
+    if math.floor(network / size(len)) % 2 == 1 then buddy = network - size(len) end
+    if redis.call('ZREM', free_key(len), fmt(buddy)) == 0 then break end
+    network = math.min(network, buddy)
+    len = len - 1
+  end
+  redis.call('ZADD', free_key(len), fmt(network), fmt(network))
+end
+
+-- Add a block to the blocks of the pool, merged with its buddies
+local function add_pool_block(network, len)
+  while len > 0 do
+    local buddy = network + size(len)
+    if math.floor(network / size(len)) % 2 == 1 then buddy = network - size(len) end
+    if redis.call('ZREM', p .. 'blocks:' .. fmt(len), fmt(buddy)) == 0 then break end
+    network = math.min(network, buddy)
+    len = len - 1
+  end
+  redis.call('ZADD', p .. 'blocks:' .. fmt(len), fmt(network), fmt(network))
+end
+
+local function take_ip()
+  local ip = redis.call('ZRANGE', p .. 'ips:free', 0, 0)[1]
+  if ip then redis.call('ZREM', p .. 'ips:free', ip) end
+  return ip
+end
+
+-- Carve a block of length `len` out of the smallest free block large enough
+local function take_block(len)
+  for l = len, 0, -1 do
+    local network = redis.call('ZRANGE', free_key(l), 0, 0)[1]
+    if network then
+      redis.call('ZREM', free_key(l), network)
+      network = tonumber(network)
+      for half = l + 1, len do
+        redis.call('ZADD', free_key(half), fmt(network + size(half)), fmt(network + size(half)))
+      end
+      return network
+    end
+  end
+  return nil
+end
+
+local function release(experiment_id)
+  local held = redis.call('HGET', p .. 'held', experiment_id)
+  if not held then return false end
+  local ip, network, len, allocation_time = string.match(held, '^(%d+) (%d+) (%d+) (%d+)$')
+  len = tonumber(len)
+  redis.call('ZADD', p .. 'ips:free', ip, ip)
+  free_block(tonumber(network), len)
+  redis.call('HINCRBY', p .. 'allocated', fmt(len), -1)
+  redis.call('HDEL', p .. 'held', experiment_id)
+  redis.call('ZREM', p .. 'expiry', experiment_id)
+  redis.call('ZREM', p .. 'listing', listing_member(tonumber(allocation_time), experiment_id))
+  redis.call('DEL', p .. 'lease:' .. experiment_id)
+  return true
+end
+
+-- Release up to `limit` expired leases, oldest first
+local function reclaim(limit)
+  local expired = redis.call('ZRANGEBYSCORE', p .. 'expiry', '-inf', '(' .. fmt(now), 'LIMIT', 0, limit)
+  for _, experiment_id in ipairs(expired) do release(experiment_id) end
+  count_activity('released', #expired)
+  return #expired
+end
+
+-- Return the current lease of an experiment, releasing a lapsed one
+local function lookup(experiment_id)
+  local lease = redis.call('HMGET', p .. 'lease:' .. experiment_id, unpack(FIELDS))
+  if lease[1] and tonumber(lease[6]) >= now then return lease end
+  if release(experiment_id) then count_activity('released', 1) end
+  return nil
+end
+
+local function allocate(owner, experiment_id, duration, len)
+  local ip = take_ip()
+  while not ip and reclaim(batch) > 0 do ip = take_ip() end
+  if not ip then return nil, 'ip' end
+
+  local network = take_block(len)
+  while not network and reclaim(batch) > 0 do network = take_block(len) end
+  if not network then
+    redis.call('ZADD', p .. 'ips:free', ip, ip)
+    return nil, 'prefix'
+  end
+
+  local expiration = now + duration * 60
+  local lease = {ip, fmt(network), fmt(len), owner, fmt(now), fmt(expiration)}
+  local key = p .. 'lease:' .. experiment_id
+  redis.call('HMSET', key, 'ip', lease[1], 'network', lease[2], 'prefixlen', lease[3],
+             'owner', lease[4], 'allocation_time', lease[5], 'expiration_time', lease[6])
+  redis.call('EXPIREAT', key, fmt(expiration + 1))
+  redis.call('HSET', p .. 'held', experiment_id, ip .. ' ' .. lease[2] .. ' ' .. lease[3] .. ' ' .. lease[5])
+  redis.call('ZADD', p .. 'expiry', lease[6], experiment_id)
+  redis.call('ZADD', p .. 'listing', 0, listing_member(now, experiment_id))
+  redis.call('HINCRBY', p .. 'allocated', lease[3], 1)
+  return lease
+end
+'''
+
+# ARGV[3..]: duration, prefix length, best effort (0 or 1), then owner and
+# experiment id pairs. Returns one {'ok', experiment_id, lease fields...} or
+# {'error', experiment_id, 'ip' | 'prefix'} per request; in all-or-nothing
+# mode the leases allocated by the call are released on the first error and
+# only that error is returned.
+_ALLOCATE = _LIB + '''
+local duration = tonumber(ARGV[3])
+local len = tonumber(ARGV[4])
+local best_effort = ARGV[5] == '1'
+local results = {}
+local new = {}
+for i = 6, #ARGV, 2 do
+  local owner, experiment_id = ARGV[i], ARGV[i + 1]
+  local lease = lookup(experiment_id)
+  local err
+  if not lease then
+    lease, err = allocate(owner, experiment_id, duration, len)
+    if lease then new[#new + 1] = experiment_id end
+  end
+  if lease then
+    results[#results + 1] = {'ok', experiment_id, unpack(lease)}
+  elseif best_effort then
+    results[#results + 1] = {'error', experiment_id, err}
+  else
+    for _, id in ipairs(new) do release(id) end
+    return {{'error', experiment_id, err}}
+  end
+end
+count_activity('allocated', #new)
+return results
+'''
+
+# ARGV[3..]: experiment ids. Returns the ids that held a lease.
+_RELEASE = _LIB + '''
+local released = {}
+for i = 3, #ARGV do
+  if release(ARGV[i]) then released[#released + 1] = ARGV[i] end
+end
+count_activity('released', #released)
+return released
+'''
+
+_REAP = _LIB + '''
+return reclaim(batch)
+'''
+
+# ARGV[3..]: integer addresses. Returns the number of IPs new to the pool.
+_ADD_IPS = _LIB + '''
+local added = 0
+for i = 3, #ARGV do
+  if redis.call('ZADD', p .. 'ips:all', 'NX', ARGV[i], ARGV[i]) == 1 then
+    redis.call('ZADD', p .. 'ips:free', ARGV[i], ARGV[i])
+    added = added + 1
+  end
+end
+return added
+'''
+
+# ARGV[3], ARGV[4]: network and prefix length of a block. Returns 1 if the
+# block was added, 0 if it overlaps the pool.
+_ADD_BLOCK = _LIB + '''
+local network, len = tonumber(ARGV[3]), tonumber(ARGV[4])
+local before = redis.call('ZREVRANGEBYSCORE', p .. 'pool', fmt(network), '-inf', 'LIMIT', 0, 1)[1]
+if before then
+  local start, length = string.match(before, '^(%d+)/(%d+)$')
+  if tonumber(start) + size(tonumber(length)) > network then return 0 end
+end
+if redis.call('ZRANGEBYSCORE', p .. 'pool', fmt(network), '(' .. fmt(network + size(len)), 'LIMIT', 0, 1)[1] then
+  return 0
+end
+redis.call('ZADD', p .. 'pool', fmt(network), fmt(network) .. '/' .. fmt(len))
+free_block(network, len)
+add_pool_block(network, len)
+return 1
+'''
+
+# Builds the blocks of the pool from the blocks imported, for stores created
+# before they were kept.
+_BUILD_POOL_BLOCKS = _LIB + '''
+if redis.call('HEXISTS', p .. 'meta', 'blocks') == 1 then return 0 end
+for len = 0, 32 do redis.call('DEL', p .. 'blocks:' .. fmt(len)) end
+for _, entry in ipairs(redis.call('ZRANGE', p .. 'pool', 0, -1)) do
+  local network, len = string.match(entry, '^(%d+)/(%d+)$')
+  add_pool_block(tonumber(network), tonumber(len))
+end
+redis.call('HSET', p .. 'meta', 'blocks', 1)
+return 1
+'''
+
+_LEASE_FIELDS = ("ip", "network", "prefixlen", "owner", "allocation_time", "expiration_time")
+
+def _listing_member(allocation_time, experiment_id):
+    return f"{allocation_time:010d}:{experiment_id}"
+
+class RedisBackend(AllocationBackend):
+    """
+    Backend storing the allocations in Redis, shared by any number of
+    backend replicas.
+
+    Get-or-allocate, release and expiry each run as a single Lua script, so
+    they are atomic with respect to every replica. Leases are hashes that
+    expire with the lease, so a lapsed lease is never returned even if the
+    reaper is late; the IP and prefix it held are given back by the reaper or
+    by the first allocation that needs them.
+
+    The scripts access keys derived from the prefix, so on a Redis Cluster
+    the prefix must contain a hash tag (e.g. `{allocations}:`).
+
+    Args:
+        client (redis.Redis): Client created with `decode_responses=True`
+            (a `fakeredis.FakeRedis` client works too).
+        prefix (str): Prefix of the keys of the allocation store.
+    """
+    def __init__(self, client, prefix='allocations:'):
+        self.redis = client
+        self.prefix = prefix
+        self._allocate = client.register_script(_ALLOCATE)
+        self._release = client.register_script(_RELEASE)
+        self._reap = client.register_script(_REAP)
+        self._add_ips = client.register_script(_ADD_IPS)
+        self._add_block = client.register_script(_ADD_BLOCK)
+        self._build_pool_blocks = client.register_script(_BUILD_POOL_BLOCKS)
+
+    @classmethod
+    def from_url(cls, url, prefix='allocations:'):
+        """Return a backend connected to the Redis server at `url`."""
+        return cls(redis.Redis.from_url(url, decode_responses=True), prefix=prefix)
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def _run(self, script, *args, batch_size=REAP_BATCH_SIZE):
+        return script(keys=[self.prefix], args=[int(time.time()), batch_size, *args])
+
+    def create(self, pool_file='pool.json'):
+        self._run(self._build_pool_blocks)
+        digest = allocations._file_digest(pool_file)
+        if self.redis.hget(self._key("meta"), "pool_hash") == digest:
+            logger.debug(f"Pool file '{pool_file}' unchanged, skipping import.")
+            return
+
+        # Concurrent imports are harmless: entries already in the pool are skipped
+        self.import_pool(pool_file)
+        self.redis.hset(self._key("meta"), "pool_hash", digest)
+
+    def import_pool(self, file_path):
+        counts = dict.fromkeys(allocations.POOL_KINDS, 0)
+        ips = []
+        for kind, entry in allocations.read_pool(file_path):
+            if kind == "ips":
+                ips.append(entry)
+            elif kind == "subnets":
+                self.add_subnets(entry)
+                counts["subnets"] += 1
+            elif kind == "blocks":
+                self.add_blocks(entry)
+                counts["blocks"] += 1
+            else:
+                raise ValueError(f"Unknown pool entry kind '{kind}' in {file_path}.")
+        counts["ips"] = self.add_ips(ips)
+
+        logger.debug(f"Imported {file_path}: {counts}.")
+        return counts
+
+    def add_ips(self, ip_input):
+        addresses = allocations._expand_ips(allocations._as_list(ip_input))
+        added = 0
+        while chunk := list(itertools.islice(addresses, IMPORT_CHUNK_SIZE)):
+            added += self._run(self._add_ips, *chunk)
+
+        logger.debug(f"{added} IP address(es) added.")
+        return added
+
+    def add_subnets(self, subnet_input):
+        for subnet in allocations._as_list(subnet_input):
+            network = ipaddress.IPv4Network(subnet)
+            if not self._run(self._add_block, int(network.network_address), network.prefixlen):
+                logger.debug(f"Subnet '{subnet}' already exists in the pool. Skipping.")
+
+        logger.debug("Subnet(s) added.")
+
+    def add_blocks(self, block_input):
+        for block in allocations._as_list(block_input):
+            # Add the parts of the block that are not in the pool yet
+            parts = [ipaddress.IPv4Network(block)]
+            for inner in self.redis.zrange(self._key("pool"), 0, -1):
+                address, prefixlen = (int(value) for value in inner.split("/"))
+                inner = ipaddress.IPv4Network((address, prefixlen))
+                parts = [part
+                         for free in parts
+                         for part in ([] if free.subnet_of(inner) else
+                                      free.address_exclude(inner) if inner.subnet_of(free) else [free])]
+            for part in parts:
+                self._run(self._add_block, int(part.network_address), part.prefixlen)
+
+        logger.debug("Block(s) added.")
+
+    def _to_allocation(self, experiment_id, fields):
+        ip, network, prefixlen, owner, allocation_time, expiration_time = fields
+        return allocations._to_allocation((int(ip), int(network), int(prefixlen), owner, experiment_id,
+                                           int(allocation_time), int(expiration_time)))
+
+    def _allocate_many(self, requests, duration, best_effort, prefixlen):
+        args = [duration, prefixlen, int(best_effort)]
+        for owner, experiment_id in requests:
+            args.extend((owner, experiment_id))
+        try:
+            results = self._run(self._allocate, *args)
+        except redis.RedisError as e:
+            logger.error(f"Error allocating experiments: {e}")
+            raise AllocationError(str(e)) from e
+
+        leases = {}
+        errors = {}
+        for status, experiment_id, *fields in results:
+            if status == "ok":
+                leases[experiment_id] = self._to_allocation(experiment_id, fields)
+                continue
+            error = NoIPAvailable() if fields[0] == "ip" else NoPrefixAvailable()
+            if not best_effort:
+                raise error
+            errors[experiment_id] = error
+        return leases, errors
+
+    def get_allocation(self, owner, experiment_id, duration=120, prefixlen=DEFAULT_PREFIXLEN):
+        leases, _ = self._allocate_many([(owner, experiment_id)], duration, False, prefixlen)
+        return leases[experiment_id]
+
+    def allocate_many(self, requests, duration=120, best_effort=False, prefixlen=DEFAULT_PREFIXLEN):
+        return self._allocate_many(list(requests), duration, best_effort, prefixlen)
+
+    def release_many(self, experiment_ids):
+        experiment_ids = list(experiment_ids)
+        if not experiment_ids:
+            return []
+        try:
+            released = self._run(self._release, *experiment_ids)
+        except redis.RedisError as e:
+            logger.error(f"Error releasing a batch of experiments: {e}")
+            raise AllocationError(str(e)) from e
+
+        logger.debug(f"Released {len(released)} allocation(s).")
+        return released
+
+    def delete_allocation(self, experiment_id):
+        return len(self.release_many([experiment_id]))
+
+    def remove_expired_allocations(self, batch_size=REAP_BATCH_SIZE):
+        removed = 0
+        try:
+            while True:
+                count = self._run(self._reap, batch_size=batch_size)
+                removed += count
+                if count < batch_size:
+                    break
+        except redis.RedisError as e:
+            logger.error(f"Redis error while removing expired allocations: {e}")
+
+        logger.debug(f"Removed {removed} expired allocation(s).")
+        return removed
+
+    def next_expiration(self):
+        first = self.redis.zrange(self._key("expiry"), 0, 0, withscores=True)
+        if not first:
+            return None
+        return datetime.fromtimestamp(first[0][1], timezone.utc)
+
+    def _iter_leases(self, owner, within, expiring_before, after):
+        """Yield the (allocation_time, experiment_id, Allocation) of the current leases matching the filters."""
+        if within is not None:
+            within = ipaddress.IPv4Network(within, strict=False)
+        if expiring_before is not None:
+            if expiring_before.tzinfo is None:
+                expiring_before = expiring_before.replace(tzinfo=timezone.utc)
+            expiring_before = int(expiring_before.timestamp())
+        start = "-" if after is None else "(" + _listing_member(*allocations._decode_cursor(after))
+
+        def leases():
+            nonlocal start
+            while members := self.redis.zrangebylex(self._key("listing"), start, "+", start=0, num=LIST_PAGE_SIZE):
+                start = "(" + members[-1]
+                now = int(time.time())
+
+                pipe = self.redis.pipeline(transaction=False)
+                for member in members:
+                    pipe.hmget(self._key("lease:" + member.split(":", 1)[1]), _LEASE_FIELDS)
+                for member, fields in zip(members, pipe.execute()):
+                    allocation_time, experiment_id = member.split(":", 1)
+                    if fields[0] is None or int(fields[5]) < now:
+                        continue
+                    if owner is not None and fields[3] != owner:
+                        continue
+                    if within is not None and not (int(fields[2]) >= within.prefixlen and
+                                                   int(within.network_address) <= int(fields[1]) <= int(within.broadcast_address)):
+                        continue
+                    if expiring_before is not None and int(fields[5]) >= expiring_before:
+                        continue
+                    yield int(allocation_time), experiment_id, self._to_allocation(experiment_id, fields)
+
+        return leases()
+
+    def list_allocations(self, owner=None, within=None, expiring_before=None, after=None, limit=LIST_PAGE_SIZE):
+        page = list(itertools.islice(self._iter_leases(owner, within, expiring_before, after), limit + 1))
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = allocations._encode_cursor(*page[-1][:2])
+        return [allocation for _, _, allocation in page], next_cursor
+
+    def iter_allocations(self, owner=None, within=None, expiring_before=None, after=None):
+        return (allocation for _, _, allocation in self._iter_leases(owner, within, expiring_before, after))
+
+    def remaining_ips(self):
+        return self.redis.zcard(self._key("ips:free"))
+
+    def remaining_subnets(self, prefixlen=DEFAULT_PREFIXLEN):
+        pipe = self.redis.pipeline(transaction=False)
+        for length in range(prefixlen + 1):
+            pipe.zcard(self._key(f"free:{length}"))
+        return sum(free << (prefixlen - length) for length, free in enumerate(pipe.execute()))
+
+    def pool_stats(self, prefixlen=DEFAULT_PREFIXLEN):
+        now = int(time.time())
+        hour = now // 3600
+        # Lower bounds of the allocation times of each lease age bucket
+        bounds = [(hour - bound + 1) * 3600 for bound in LEASE_AGE_BUCKETS]
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(self._key("ips:all"))
+        pipe.zcard(self._key("ips:free"))
+        pipe.hgetall(self._key("allocated"))
+        pipe.hgetall(self._key(f"activity:{hour - 1}"))
+        pipe.hgetall(self._key(f"activity:{hour}"))
+        pipe.zcard(self._key("listing"))
+        for bound in bounds:
+            pipe.zlexcount(self._key("listing"), "[" + _listing_member(bound, ""), "+")
+        for length in range(33):
+            pipe.zcard(self._key(f"free:{length}"))
+        for length in range(33):
+            pipe.zcard(self._key(f"blocks:{length}"))
+        pipe.zcount(self._key("expiry"), "-inf", now)
+        ips_total, ips_free, allocated, previous, current, active, *rest, expired = pipe.execute()
+        newer, free, pool = rest[:len(bounds)], rest[len(bounds):len(bounds) + 33], rest[len(bounds) + 33:]
+
+        # Leases that expired but were not reclaimed yet are not active. They
+        # are read `REAP_BATCH_SIZE` at a time to take them out of their age
+        # bucket, the reaper normally leaves few of them
+        for offset in range(0, expired, REAP_BATCH_SIZE):
+            batch = self.redis.zrangebyscore(self._key("expiry"), "-inf", now,
+                                             start=offset, num=min(REAP_BATCH_SIZE, expired - offset))
+            if not batch:
+                break
+            held = self.redis.hmget(self._key("held"), batch)
+            expired_times = [int(entry.split()[3]) for entry in held if entry is not None]
+            active -= len(expired_times)
+            newer = [count - sum(allocation_time >= bound for allocation_time in expired_times)
+                     for bound, count in zip(bounds, newer)]
+
+        subnets = [(length, free[length] + int(allocated.get(str(length), 0)), free[length])
+                   for length in range(33)]
+        subnets = [(length, total, count) for length, total, count in subnets if total]
+        blocks = [(length, count) for length, count in enumerate(pool) if count]
+
+        age = {}
+        older = 0
+        for bound, count in zip(LEASE_AGE_BUCKETS, newer):
+            age[f"<{bound}h"] = count - older
+            older = count
+        age[f">={LEASE_AGE_BUCKETS[-1]}h"] = active - older
+
+        activity = [sum(int(h.get(field, 0)) for h in (previous, current)) for field in ("allocated", "released")]
+        return allocations._format_stats(now, prefixlen, ips_total, ips_free, subnets, blocks, active, age, *activity)
+
+    def close(self):
+        self.redis.close()
@@ -0,0 +1,102 @@
+import json
+import logging
+import os
+import threading
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+logger = logging.getLogger("slices-backend")
+
+class S3ClientManager:
+    """
+    Process-wide S3 client, built from a credentials file and rebuilt only
+    when that file changes.
+
+    The credentials file is the JSON document holding `endpointUrl`,
+    `accessKey`, `secretKey` and `bucket`. The client keeps a pool of up to
+    `max_pool_connections` keep-alive HTTP connections, so requests reuse
+    connections (and TLS sessions) instead of opening new ones, and retries
+    throttled and failed requests with the adaptive retry mode of botocore.
+    Clients are thread-safe, so the I/O threads share it. Uploads with
+    `transfer_config` send files larger than `multipart_threshold` in parts
+    of `multipart_chunksize` bytes, `max_concurrency` at a time.
+
+    Checking the credentials file costs a `stat()` per call of `get()`; the
+    client is rebuilt when its modification time, size or inode changed
+    (e.g. a new file bind mounted, or the secret rotated).
+
+    Args:
+        credentials_path (str): Path of the credentials file.
+        max_pool_connections (int): Maximum number of open HTTP connections.
+        max_attempts (int): Maximum number of attempts of a request.
+        connect_timeout (float): Seconds to wait for a connection.
+        read_timeout (float): Seconds to wait for data on a connection.
+        multipart_threshold (int): Size in bytes from which uploads are multipart.
+        multipart_chunksize (int): Size in bytes of the parts.
+        max_concurrency (int): Number of parts uploaded at once.
+    """
+    def __init__(self, credentials_path='/credentials.json', max_pool_connections=50, max_attempts=5,
+                 connect_timeout=5, read_timeout=60, multipart_threshold=8 * 1024 * 1024,
+                 multipart_chunksize=8 * 1024 * 1024, max_concurrency=4):
+        self.credentials_path = credentials_path
+        self.config = Config(signature_version='s3v4',
+                             max_pool_connections=max_pool_connections,
+                             tcp_keepalive=True,
+                             connect_timeout=connect_timeout,
+                             read_timeout=read_timeout,
+                             retries={"max_attempts": max_attempts, "mode": "adaptive"})
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                              multipart_chunksize=multipart_chunksize,
+                                              max_concurrency=max_concurrency)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._current = None
+        self.stats = {
+            "loads": 0,
+        }
+
+    def _file_signature(self):
+        stat = os.stat(self.credentials_path)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _load(self, signature):
+        with open(self.credentials_path, 'r') as json_file:
+            credentials = json.load(json_file)
+
+        session = boto3.session.Session()
+        client = session.client('s3',
+                                endpoint_url=credentials['endpointUrl'],
+                                aws_access_key_id=credentials['accessKey'],
+                                aws_secret_access_key=credentials['secretKey'],
+                                config=self.config)
+        # The previous client is left to the calls still using it
+        self._current = (client, credentials['bucket'])
+        self._signature = signature
+        self.stats["loads"] += 1
+        logger.info(f"Loaded the S3 credentials from {self.credentials_path}")
+
+    def get(self):
+        """
+        Return the S3 client and the name of the bucket, (re)loading the
+        credentials first if their file changed.
+
+        Raises:
+            OSError: If the credentials file can't be read.
+            KeyError, json.JSONDecodeError: If it is invalid.
+        """
+        signature = self._file_signature()
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._load(signature)
+        return self._current
+
+    def close(self):
+        """Close the connections of the client."""
+        with self._lock:
+            if self._current is not None:
+                self._current[0].close()
+            self._current = None
+            self._signature = None
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import socket
+import threading
+import time
+
+import paramiko
+
+logger = logging.getLogger("slices-backend")
+
+class _Connection:
+    """
+    Authenticated SSH client to one host. Its usage (`active` and
+    `last_used`) is protected by the lock of the pool, the client by `lock`.
+    """
+    def __init__(self, max_sessions):
+        self.client = None
+        self.sessions = threading.BoundedSemaphore(max_sessions)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_used = time.monotonic()
+
+    def healthy(self):
+        transport = self.client.get_transport() if self.client is not None else None
+        return transport is not None and transport.is_active() and transport.is_authenticated()
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+class SSHPool:
+    """
+    Pool of authenticated SSH connections, one per host, port, user and key.
+
+    Commands run as new channels of the connection to their host, so only the
+    first command pays for the TCP connection, the key exchange and the
+    authentication. At most `max_sessions` commands run at once on a host
+    (OpenSSH allows 10 sessions per connection by default); more wait for a
+    session. Keepalives are sent every `keepalive` seconds so that idle
+    connections are not dropped by firewalls, and connections found dead are
+    reopened. Connections unused for `idle_timeout` seconds are closed by
+    `evict_idle()`, which a background task started with `start()` calls.
+
+    Args:
+        max_sessions (int): Maximum number of commands running at once per host.
+        keepalive (int): Seconds between keepalives.
+        idle_timeout (float): Seconds after which an unused connection is closed.
+        connect_timeout (float): Seconds to wait for a connection.
+    """
+    def __init__(self, max_sessions=8, keepalive=30, idle_timeout=300, connect_timeout=10):
+        self.max_sessions = max_sessions
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._connections = {}
+        self._lock = threading.Lock()
+        # Counters are updated with connection locks held, so not with the pool lock
+        self._stats_lock = threading.Lock()
+        self._task = None
+        self.stats = {
+            "connects": 0,
+            "commands": 0,
+            "reconnects": 0,
+            "evictions": 0,
+        }
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _acquire(self, key):
+        # The connection is marked in use before the pool lock is released, so
+        # that it can't be evicted before the command runs
+        with self._lock:
+            connection = self._connections.get(key)
+            if connection is None:
+                connection = self._connections[key] = _Connection(self.max_sessions)
+            connection.active += 1
+            return connection
+
+    def _release(self, connection):
+        with self._lock:
+            connection.active -= 1
+            connection.last_used = time.monotonic()
+
+    def _connect(self, connection, hostname, port, username, key_path):
+        # Called with the lock of the connection held, so a single thread connects
+        connection.close()
+        client = paramiko.SSHClient()
+        # Automatically add the host key if it's new
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(hostname, port=port, username=username, key_filename=key_path,
+                       timeout=self.connect_timeout)
+        transport = client.get_transport()
+        transport.set_keepalive(self.keepalive)
+        # Commands are short request/response exchanges
+        transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.client = client
+        self._count("connects")
+        logger.info(f"Connected to {username}@{hostname}:{port}")
+
+    def _client(self, connection, hostname, port, username, key_path, failed=None):
+        # `failed` is a client on which a channel couldn't be opened. It is
+        # only replaced if its transport died: closing a live transport would
+        # kill the channels of the other commands. If another command already
+        # replaced it, the new client is returned.
+        with connection.lock:
+            if failed is not None and connection.client is failed and connection.healthy():
+                return None
+            if not connection.healthy():
+                if connection.client is not None:
+                    self._count("reconnects")
+                self._connect(connection, hostname, port, username, key_path)
+            return connection.client
+
+    def run(self, hostname, port, username, key_path, command, timeout=None):
+        """
+        Run a command on a host and return its output, error output and exit
+        status.
+
+        Args:
+            hostname (str): Host to connect to.
+            port (int): SSH port of the host.
+            username (str): User to log in as.
+            key_path (str): Path of the private key to authenticate with.
+            command (str): Command to run.
+            timeout (float): Seconds to wait for the command's output, or None
+                to wait as long as it takes.
+
+        Returns:
+            tuple: The standard output and the standard error of the command,
+            and its exit status (-1 if the server didn't report one).
+
+        Raises:
+            paramiko.SSHException: If the connection or authentication failed.
+            OSError: If the host can't be reached.
+            socket.timeout: If the command didn't answer within `timeout`.
+        """
+        connection = self._acquire((hostname, port, username, key_path))
+        try:
+            with connection.sessions:
+                client = self._client(connection, hostname, port, username, key_path)
+                try:
+                    stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+                except paramiko.ChannelException:
+                    # The server refused the session (e.g. MaxSessions reached),
+                    # the connection itself is fine
+                    raise
+                except (paramiko.SSHException, EOFError):
+                    # The connection may have died since it was checked, open a
+                    # new one unless it is still alive
+                    client = self._client(connection, hostname, port, username, key_path, failed=client)
+                    if client is None:
+                        raise
+                    stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+
+                # Get the output, error and exit status
+                output = stdout.read().decode()
+                error = stderr.read().decode()
+                exit_status = stdout.channel.recv_exit_status()
+                self._count("commands")
+                return output, error, exit_status
+        finally:
+            self._release(connection)
+
+    def evict_idle(self):
+        """Close the connections that have been unused for `idle_timeout` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            for key, connection in list(self._connections.items()):
+                if connection.active or now - connection.last_used < self.idle_timeout:
+                    continue
+                # Unused, so no command holds its lock
+                with connection.lock:
+                    connection.close()
+                del self._connections[key]
+                self._count("evictions")
+
+    def status(self):
+        """Return the connections of the pool, with their state and usage."""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "host": f"{username}@{hostname}:{port}",
+                "connected": connection.healthy(),
+                "commands": connection.active,
+                "idle_seconds": round(now - connection.last_used, 1),
+            } for (hostname, port, username, key_path), connection in self._connections.items()]
+
+    def start(self):
+        """Start evicting idle connections in the background, in the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop evicting idle connections."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 1))
+            await asyncio.to_thread(self.evict_idle)
+
+    def close(self):
+        """Close every connection."""
+        with self._lock:
+            for connection in self._connections.values():
+                with connection.lock:
+                    connection.close()
+            self._connections.clear()
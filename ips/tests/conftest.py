@@ -0,0 +1,81 @@
+import json
+import os
+import re
+import sys
+
+import pytest
+
+# The modules of the backend are imported as top-level modules, as when
+# uvicorn runs `api:app` from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: benchmark of the allocation store, run with --benchmark-only")
+
+def pytest_collection_modifyitems(config, items):
+    # The benchmarks take a while, they only run when asked for
+    if config.getoption("--benchmark-only", default=False):
+        return
+    skip = pytest.mark.skip(reason="benchmark, run with --benchmark-only")
+    for item in items:
+        if item.get_closest_marker("benchmark"):
+            item.add_marker(skip)
+
+@pytest.fixture(scope="session")
+def s3_endpoint():
+    """URL of an in-process moto S3 server."""
+    server = pytest.importorskip("moto.server").ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+@pytest.fixture
+def s3_credentials(s3_endpoint, tmp_path, request):
+    """Path of a credentials file for a new, empty bucket of the moto server."""
+    bucket = re.sub(r"[^a-z0-9]+", "-", request.node.name.lower())[:50].strip("-")
+    credentials = {"endpointUrl": s3_endpoint, "accessKey": "test", "secretKey": "test", "bucket": bucket}
+    path = tmp_path / "credentials.json"
+    path.write_text(json.dumps(credentials))
+
+    boto3 = pytest.importorskip("boto3")
+    client = boto3.client("s3", endpoint_url=s3_endpoint, aws_access_key_id="test",
+                          aws_secret_access_key="test", region_name="us-east-1")
+    client.create_bucket(Bucket=bucket)
+    yield str(path)
+    for item in client.list_objects_v2(Bucket=bucket).get("Contents", []):
+        client.delete_object(Bucket=bucket, Key=item["Key"])
+    client.delete_bucket(Bucket=bucket)
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """The api module, imported with a throwaway database and without token verification."""
+    directory = tmp_path_factory.mktemp("api")
+    db_file = directory / "db.json"
+    db_file.write_text(json.dumps({"_roles": {"admin": ["admin"]}, "cluster": {"subnets": [], "allocated": {}}}))
+
+    with pytest.MonkeyPatch.context() as mp:
+        # The pool is imported from pool.json, relative to the current directory
+        mp.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        mp.setenv("DB_FILE", str(db_file))
+        mp.setenv("JWT_VERIFY", "0")
+        mp.setenv("ALLOCATION_BACKEND", "sqlite")
+        mp.setenv("ALLOCATION_DB", str(directory / "network_data.db"))
+        mp.setenv("JOBS_DB", str(directory / "jobs.db"))
+        import api
+    return api
+
+@pytest.fixture(scope="session")
+def app_client(api):
+    """Client of the app, started once so that its background tasks share an event loop."""
+    from fastapi.testclient import TestClient
+
+    with TestClient(api.app) as client:
+        yield client
+
+@pytest.fixture
+def client(api, app_client):
+    """Client of the app, authenticated as `alice`."""
+    api.app.dependency_overrides[api.validate_token] = lambda: {"preferred_username": "alice"}
+    yield app_client
+    api.app.dependency_overrides.clear()
@@ -0,0 +1,466 @@
+import ipaddress
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import allocations
+from allocations import AllocationBusy, AllocationError, NoIPAvailable, NoPrefixAvailable
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "network_data.db")
+    allocations.create_schema(path)
+    allocations.add_subnets([f"10.1.{i}.0/27" for i in range(4)], db_path=path)
+    allocations.add_ips([f"10.0.0.{i}" for i in range(1, 33)], db_path=path)
+    yield path
+    allocations.close_connections()
+
+@pytest.fixture
+def block_db(tmp_path):
+    """A pool of 32 IPs and a single /24 block to carve prefixes from."""
+    path = str(tmp_path / "blocks.db")
+    allocations.create_schema(path)
+    allocations.add_ips([f"10.0.0.{i}" for i in range(1, 33)], db_path=path)
+    allocations.add_blocks("10.1.0.0/24", db_path=path)
+    yield path
+    allocations.close_connections()
+
+def free_blocks(db_path):
+    rows = allocations.get_connection(db_path).execute(
+        "SELECT network, prefixlen FROM subnets WHERE allocated = 0 ORDER BY network").fetchall()
+    return [allocations._subnet(network, prefixlen) for network, prefixlen in rows]
+
+def test_connection_is_shared_per_thread(db_path):
+    conn = allocations.get_connection(db_path)
+    assert allocations.get_connection(db_path) is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(allocations.get_connection(db_path)))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+def test_transaction_rolls_back_on_error(db_path):
+    with pytest.raises(sqlite3.IntegrityError):
+        with allocations.transaction(db_path) as cursor:
+            cursor.execute("INSERT INTO ips (ip_address) VALUES ('10.0.0.100')")
+            cursor.execute("INSERT INTO ips (ip_address) VALUES ('10.0.0.1')")
+    assert allocations.remaining_ips(db_path=db_path) == 32
+
+def test_close_connections_reopens_on_next_use(db_path):
+    conn = allocations.get_connection(db_path)
+    allocations.close_connections()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    assert allocations.get_connection(db_path) is not conn
+    assert allocations.remaining_ips(db_path=db_path) == 32
+
+def test_allocated_flags_follow_allocations(db_path):
+    lease = allocations.get_allocation("alice", "xp_1", db_path=db_path)
+    ip, prefix = lease.ip, lease.prefix
+    assert allocations.remaining_ips(db_path=db_path) == 31
+    assert allocations.remaining_subnets(db_path=db_path) == 3
+
+    conn = allocations.get_connection(db_path)
+    network = ipaddress.IPv4Network(prefix)
+    assert conn.execute("SELECT allocated FROM ips WHERE ip_address = ?",
+                        (int(ipaddress.IPv4Address(ip)),)).fetchone() == (1,)
+    assert conn.execute("SELECT allocated FROM subnets WHERE network = ? AND prefixlen = ?",
+                        (int(network.network_address), network.prefixlen)).fetchone() == (1,)
+
+    second = allocations.get_allocation("alice", "xp_2", db_path=db_path)
+    assert (second.ip, second.prefix) != (ip, prefix)
+
+    assert allocations.delete_allocation("xp_1", db_path=db_path) == 1
+    assert allocations.remaining_ips(db_path=db_path) == 31
+    assert allocations.remaining_subnets(db_path=db_path) == 3
+
+def test_free_lists_migration_flags_existing_allocations(tmp_path):
+    path = str(tmp_path / "network_data.db")
+    conn = sqlite3.connect(path)
+    allocations.create_subnets_table(conn)
+    allocations.create_ips_table(conn)
+    allocations.create_allocations_table(conn)
+    conn.executemany("INSERT INTO ips (ip_address) VALUES (?)", [("10.0.0.1",), ("10.0.0.2",)])
+    conn.executemany("INSERT INTO subnets (subnet) VALUES (?)", [("10.1.0.0/27",), ("10.1.1.0/27",)])
+    conn.execute('''
+        INSERT INTO allocations (ip, prefix, owner, expiration_time, experiment_id)
+        VALUES ('10.0.0.1', '10.1.0.0/27', 'alice', '2030-01-01 12:00:00Z', 'xp_old')
+    ''')
+    conn.commit()
+    conn.close()
+
+    try:
+        allocations.create_schema(path)
+        assert allocations.remaining_ips(db_path=path) == 1
+        assert allocations.remaining_subnets(db_path=path) == 1
+        new = allocations.get_allocation("bob", "xp_new", db_path=path)
+        assert (new.ip, new.prefix) == ("10.0.0.2", "10.1.1.0/27")
+    finally:
+        allocations.close_connections()
+
+def test_get_allocation_returns_the_existing_lease(db_path):
+    lease = allocations.get_allocation("alice", "xp_1", db_path=db_path)
+    assert allocations.get_allocation("alice", "xp_1", db_path=db_path) == lease
+    assert allocations.remaining_ips(db_path=db_path) == 31
+
+    with pytest.raises(AllocationError):
+        allocations.allocate_ip_to_subnet("alice", "xp_1", db_path=db_path)
+
+def test_concurrent_allocations_never_share_a_lease(db_path):
+    with ThreadPoolExecutor(8) as executor:
+        leases = list(executor.map(
+            lambda i: allocations.get_allocation("alice", f"xp_{i % 4}", db_path=db_path), range(16)))
+
+    assert len(set(leases)) == 4
+    assert len({lease.ip for lease in set(leases)}) == 4
+    assert len({lease.prefix for lease in set(leases)}) == 4
+    assert allocations.remaining_subnets(db_path=db_path) == 0
+
+    with pytest.raises(NoPrefixAvailable):
+        allocations.get_allocation("alice", "xp_5", db_path=db_path)
+
+def test_no_ip_available(tmp_path):
+    path = str(tmp_path / "network_data.db")
+    allocations.create_schema(path)
+    allocations.add_subnets("10.1.0.0/27", db_path=path)
+    try:
+        with pytest.raises(NoIPAvailable):
+            allocations.get_allocation("alice", "xp_1", db_path=path)
+    finally:
+        allocations.close_connections()
+
+def test_get_allocation_raises_when_busy(db_path, monkeypatch):
+    monkeypatch.setattr(allocations, "BUSY_RETRIES", 1)
+    monkeypatch.setattr(allocations, "BUSY_BACKOFF", 0.01)
+    blocker = sqlite3.connect(db_path, timeout=0, isolation_level=None)
+    allocations.get_connection(db_path).execute("PRAGMA busy_timeout = 50")
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(AllocationBusy):
+            allocations.get_allocation("alice", "xp_1", db_path=db_path)
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    assert allocations.get_allocation("alice", "xp_1", db_path=db_path).experiment_id == "xp_1"
+
+def test_delete_allocation_raises_when_busy(db_path, monkeypatch):
+    allocations.get_allocation("alice", "xp_1", db_path=db_path)
+    monkeypatch.setattr(allocations, "BUSY_RETRIES", 1)
+    monkeypatch.setattr(allocations, "BUSY_BACKOFF", 0.01)
+    blocker = sqlite3.connect(db_path, timeout=0, isolation_level=None)
+    allocations.get_connection(db_path).execute("PRAGMA busy_timeout = 50")
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(AllocationBusy):
+            allocations.delete_allocation("xp_1", db_path=db_path)
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    assert allocations.delete_allocation("xp_1", db_path=db_path) == 1
+    assert allocations.delete_allocation("xp_1", db_path=db_path) == 0
+
+def test_allocate_many_is_all_or_nothing(db_path):
+    existing = allocations.get_allocation("alice", "xp_0", db_path=db_path)
+    requests = [("alice", f"xp_{i}") for i in range(5)]
+
+    with pytest.raises(NoPrefixAvailable):
+        allocations.allocate_many(requests, db_path=db_path)
+    assert allocations.remaining_subnets(db_path=db_path) == 3
+
+    leases, failures = allocations.allocate_many(requests, best_effort=True, db_path=db_path)
+    assert sorted(leases) == ["xp_0", "xp_1", "xp_2", "xp_3"]
+    assert leases["xp_0"] == existing
+    assert list(failures) == ["xp_4"]
+    assert isinstance(failures["xp_4"], NoPrefixAvailable)
+
+def test_release_many(db_path):
+    allocations.allocate_many([("alice", "xp_1"), ("bob", "xp_2")], db_path=db_path)
+
+    assert allocations.release_many(["xp_1", "xp_2", "xp_3"], db_path=db_path) == ["xp_1", "xp_2"]
+    assert allocations.remaining_subnets(db_path=db_path) == 4
+    assert allocations.release_many(["xp_1"], db_path=db_path) == []
+
+def test_expired_allocations_are_reaped(db_path):
+    allocations.get_allocation("alice", "xp_1", duration=60, db_path=db_path)
+    for i in range(2, 5):
+        allocations.get_allocation("alice", f"xp_{i}", duration=0, db_path=db_path)
+    time.sleep(1.1)
+
+    assert [row[5] for row in allocations.get_all_allocations(db_path=db_path)] == ["xp_1"]
+    assert allocations.remove_expired_allocations(db_path=db_path, batch_size=2) == 3
+    assert allocations.remaining_subnets(db_path=db_path) == 3
+    assert allocations.remove_expired_allocations(db_path=db_path) == 0
+
+def test_expired_allocations_are_reaped_oldest_first(db_path):
+    for i in range(3):
+        allocations.get_allocation("alice", f"xp_{i}", duration=60, db_path=db_path)
+    now = allocations._now()
+    with allocations.transaction(db_path) as cursor:
+        for i, age in enumerate([10, 30, 20]):
+            cursor.execute("UPDATE allocations SET expiration_time = ? WHERE experiment_id = ?", (now - age, f"xp_{i}"))
+
+    assert allocations._remove_expired_batch(2, db_path) == 2
+    rows = allocations.get_connection(db_path).execute("SELECT experiment_id FROM allocations").fetchall()
+    assert rows == [("xp_0",)]
+    assert allocations.remaining_subnets(db_path=db_path) == 3
+
+def test_expired_lease_is_replaced(db_path):
+    expired = allocations.get_allocation("alice", "xp_1", duration=0, db_path=db_path)
+    time.sleep(1.1)
+
+    renewed = allocations.get_allocation("alice", "xp_1", duration=60, db_path=db_path)
+    assert renewed.expiration_time > expired.expiration_time
+    assert allocations.next_expiration(db_path=db_path).strftime(allocations.TIME_FORMAT) == renewed.expiration_time
+
+def test_expired_leases_are_reclaimed_when_the_pool_is_full(db_path):
+    for i in range(4):
+        allocations.get_allocation("alice", f"xp_{i}", duration=0, db_path=db_path)
+    time.sleep(1.1)
+
+    assert allocations.get_allocation("bob", "xp_new", db_path=db_path).owner == "bob"
+
+def test_buddy_allocation_splits_and_coalesces(block_db):
+    first = allocations.get_allocation("alice", "xp_1", prefixlen=26, db_path=block_db)
+    second = allocations.get_allocation("alice", "xp_2", prefixlen=28, db_path=block_db)
+    assert first.prefix == "10.1.0.0/26"
+    # Carved from the smallest free block large enough, the /26 left by the first split
+    assert second.prefix == "10.1.0.64/28"
+    assert free_blocks(block_db) == ["10.1.0.80/28", "10.1.0.96/27", "10.1.0.128/25"]
+    assert allocations.remaining_subnets(prefixlen=28, db_path=block_db) == 11
+
+    assert allocations.delete_allocation("xp_2", db_path=block_db) == 1
+    assert free_blocks(block_db) == ["10.1.0.64/26", "10.1.0.128/25"]
+    assert allocations.delete_allocation("xp_1", db_path=block_db) == 1
+    assert free_blocks(block_db) == ["10.1.0.0/24"]
+
+def test_allocations_never_overlap(block_db):
+    leases = [allocations.get_allocation("alice", f"xp_{i}", prefixlen=length, db_path=block_db)
+              for i, length in enumerate([27, 28, 26, 28, 27, 30, 29])]
+    networks = [ipaddress.IPv4Network(lease.prefix) for lease in leases]
+    assert not any(a.overlaps(b) for i, a in enumerate(networks) for b in networks[i + 1:])
+    assert len({lease.ip for lease in leases}) == len(leases)
+
+    allocations.release_many([f"xp_{i}" for i in range(len(leases))], db_path=block_db)
+    assert free_blocks(block_db) == ["10.1.0.0/24"]
+
+def test_pool_exhaustion(block_db):
+    allocations.get_allocation("alice", "xp_1", prefixlen=25, db_path=block_db)
+    allocations.get_allocation("alice", "xp_2", prefixlen=25, db_path=block_db)
+    with pytest.raises(NoPrefixAvailable):
+        allocations.get_allocation("alice", "xp_3", prefixlen=27, db_path=block_db)
+    # The IP taken for the failed allocation was given back
+    assert allocations.remaining_ips(db_path=block_db) == 30
+
+def test_add_blocks_only_adds_what_is_missing(block_db):
+    allocations.get_allocation("alice", "xp_1", prefixlen=26, db_path=block_db)
+
+    allocations.add_blocks(["10.1.0.0/23", "10.1.0.0/24"], db_path=block_db)
+    assert free_blocks(block_db) == ["10.1.0.64/26", "10.1.0.128/25", "10.1.1.0/24"]
+    # Adjacent /27 subnets coalesce with each other
+    allocations.add_subnets(["10.1.2.0/27", "10.1.2.32/27"], db_path=block_db)
+    assert free_blocks(block_db)[-1] == "10.1.2.0/26"
+
+def test_pool_counters_follow_allocations(block_db):
+    stats = allocations.pool_stats(prefixlen=27, db_path=block_db)
+    assert (stats["ips"]["total"], stats["ips"]["free"]) == (32, 32)
+    assert (stats["prefixes"]["total"], stats["prefixes"]["free"]) == (8, 8)
+    assert stats["prefixes"]["free_blocks"] == {"/24": 1}
+
+    allocations.get_allocation("alice", "xp_1", prefixlen=26, db_path=block_db)
+    allocations.get_allocation("alice", "xp_2", prefixlen=27, db_path=block_db)
+    stats = allocations.pool_stats(prefixlen=27, db_path=block_db)
+    assert stats["ips"]["free"] == 30
+    assert stats["prefixes"]["free"] == 5
+    assert stats["prefixes"]["free_blocks"] == {"/25": 1, "/27": 1}
+    assert stats["leases"]["active"] == 2
+    assert stats["leases"]["age"]["<1h"] == 2
+    assert stats["ips"]["seconds_to_exhaustion"] > 0
+    assert allocations.remaining_ips(db_path=block_db) == 30
+    assert allocations.remaining_subnets(prefixlen=27, db_path=block_db) == 5
+
+    allocations.release_many(["xp_1", "xp_2"], db_path=block_db)
+    stats = allocations.pool_stats(prefixlen=27, db_path=block_db)
+    assert (stats["ips"]["free"], stats["prefixes"]["free"]) == (32, 8)
+    assert stats["leases"]["active"] == 0
+    assert stats["ips"]["seconds_to_exhaustion"] is None
+
+def create_baseline_db(path):
+    """Create a database with the schema and data of the first version of the backend."""
+    conn = sqlite3.connect(path)
+    allocations.create_subnets_table(conn)
+    allocations.create_ips_table(conn)
+    allocations.create_allocations_table(conn)
+    conn.executemany("INSERT INTO ips (ip_address) VALUES (?)", [(f"10.0.0.{i}",) for i in range(1, 5)])
+    conn.executemany("INSERT INTO subnets (subnet) VALUES (?)",
+                     [("10.1.0.0/27",), ("10.1.0.32/27",), ("10.1.0.64/27",)])
+    conn.execute('''
+        INSERT INTO allocations (ip, prefix, owner, allocation_time, expiration_time, experiment_id)
+        VALUES ('10.0.0.1', '10.1.0.32/27', 'alice', '2030-01-01 10:00:00Z', '2030-01-01 12:00:00Z', 'xp_old')
+    ''')
+    conn.commit()
+    conn.close()
+
+def test_migrate_baseline_db(tmp_path):
+    path = str(tmp_path / "network_data.db")
+    create_baseline_db(path)
+
+    try:
+        allocations.create_schema(path)
+        conn = allocations.get_connection(path)
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(allocations.MIGRATIONS)
+        # Addresses and times are stored as integers
+        assert conn.execute("SELECT ip, network, prefixlen, expiration_time FROM allocations").fetchone() == (
+            int(ipaddress.IPv4Address("10.0.0.1")), int(ipaddress.IPv4Address("10.1.0.32")), 27, 1893499200)
+
+        (lease,) = allocations.get_all_allocations(db_path=path)
+        assert lease == ("10.0.0.1", "10.1.0.32/27", "alice",
+                         "2030-01-01 10:00:00Z", "2030-01-01 12:00:00Z", "xp_old")
+
+        # The counters were backfilled and the free lists rebuilt
+        stats = allocations.pool_stats(prefixlen=27, db_path=path)
+        assert (stats["ips"]["total"], stats["ips"]["free"]) == (4, 3)
+        assert (stats["prefixes"]["total"], stats["prefixes"]["free"]) == (3, 2)
+        assert stats["leases"]["active"] == 1
+
+        # And the migrated database keeps working
+        new = allocations.get_allocation("bob", "xp_new", db_path=path)
+        assert new.prefix in ("10.1.0.0/27", "10.1.0.64/27")
+        assert allocations.delete_allocation("xp_old", db_path=path) == 1
+        assert allocations.pool_stats(prefixlen=27, db_path=path)["prefixes"]["free"] == 2
+
+        # Migrating again is a no-op
+        allocations.create_schema(path)
+        assert len(allocations.get_all_allocations(db_path=path)) == 1
+    finally:
+        allocations.close_connections()
+
+def schema(path):
+    """Return the columns of each table, and the names of the indexes and triggers of a database."""
+    conn = sqlite3.connect(path)
+    objects = conn.execute("SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'").fetchall()
+    columns = {name: conn.execute(f"PRAGMA table_info({name})").fetchall()
+               for kind, name in objects if kind == "table"}
+    conn.close()
+    return columns, sorted(objects)
+
+def test_new_db_is_created_in_the_current_schema(tmp_path, monkeypatch):
+    new = str(tmp_path / "new.db")
+    migrated = str(tmp_path / "migrated.db")
+    create_baseline_db(migrated)
+
+    try:
+        allocations.create_schema(migrated)
+        # No migration runs on a new database
+        monkeypatch.setattr(allocations, "MIGRATIONS", [None] * len(allocations.MIGRATIONS))
+        allocations.create_schema(new)
+        assert allocations.get_connection(new).execute("PRAGMA user_version").fetchone()[0] == len(allocations.MIGRATIONS)
+    finally:
+        allocations.close_connections()
+
+    assert schema(new) == schema(migrated)
+
+def test_add_ips_expands_ranges_and_prefixes(tmp_path):
+    path = str(tmp_path / "network_data.db")
+    allocations.create_schema(path)
+    try:
+        assert allocations.add_ips(["10.0.0.1-10.0.0.10", "10.0.1.0/28", "10.0.2.1"], db_path=path) == 10 + 14 + 1
+        # Entries already in the pool are skipped
+        assert allocations.add_ips(iter(["10.0.0.5-10.0.0.12"]), db_path=path) == 2
+        assert allocations.remaining_ips(db_path=path) == 27
+    finally:
+        allocations.close_connections()
+
+def test_import_pool_from_csv_and_json(tmp_path):
+    path = str(tmp_path / "network_data.db")
+    csv_pool = tmp_path / "pool.csv"
+    csv_pool.write_text("# kind,entry\nips,10.0.0.0/24\nblocks,10.1.0.0/24\nsubnets,10.2.0.0/27\n")
+    json_pool = tmp_path / "pool.json"
+    json_pool.write_text('{"ips": ["10.0.1.1-10.0.1.4"], "subnets": ["10.2.0.32/27"]}')
+
+    allocations.create_schema(path)
+    try:
+        assert allocations.import_pool(str(csv_pool), db_path=path) == {"ips": 254, "subnets": 1, "blocks": 1}
+        assert allocations.import_pool(str(json_pool), db_path=path) == {"ips": 4, "subnets": 1, "blocks": 0}
+        assert allocations.remaining_ips(db_path=path) == 258
+        assert allocations.remaining_subnets(prefixlen=27, db_path=path) == 8 + 2
+    finally:
+        allocations.close_connections()
+
+def test_unreadable_pool_files_are_rejected(tmp_path):
+    path = str(tmp_path / "network_data.db")
+    allocations.create_schema(path)
+    invalid = tmp_path / "invalid.json"
+    invalid.write_text('{"ips": ["10.0.0.1"],')
+    listed = tmp_path / "listed.json"
+    listed.write_text('["10.0.0.1"]')
+
+    try:
+        with pytest.raises(ValueError, match="invalid.json"):
+            allocations.import_pool(str(invalid), db_path=path)
+        with pytest.raises(ValueError, match="must hold a JSON object"):
+            allocations.import_pool(str(listed), db_path=path)
+        with pytest.raises(FileNotFoundError):
+            allocations.import_pool(str(tmp_path / "missing.json"), db_path=path)
+        assert allocations.remaining_ips(db_path=path) == 0
+    finally:
+        allocations.close_connections()
+
+def test_create_db_skips_an_unchanged_pool(tmp_path, monkeypatch):
+    path = str(tmp_path / "network_data.db")
+    pool = tmp_path / "pool.json"
+    pool.write_text('{"ips": ["10.0.0.1-10.0.0.4"], "subnets": ["10.1.0.0/27"]}')
+
+    imports = []
+    import_pool = allocations._import_pool
+    monkeypatch.setattr(allocations, "_import_pool",
+                        lambda cursor, file_path: imports.append(file_path) or import_pool(cursor, file_path))
+    try:
+        allocations.create_db(path, pool_file=str(pool))
+        allocations.create_db(path, pool_file=str(pool))
+        assert len(imports) == 1
+
+        pool.write_text('{"ips": ["10.0.0.1-10.0.0.8"], "subnets": ["10.1.0.0/27"]}')
+        allocations.create_db(path, pool_file=str(pool))
+        assert len(imports) == 2
+        assert allocations.remaining_ips(db_path=path) == 8
+    finally:
+        allocations.close_connections()
+
+def test_list_allocations_pages_and_filters(block_db):
+    for i in range(5):
+        allocations.get_allocation("alice" if i % 2 else "bob", f"xp_{i}", duration=10 + i,
+                                   prefixlen=28, db_path=block_db)
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = allocations.list_allocations(after=cursor, limit=2, db_path=block_db)
+        seen += [lease.experiment_id for lease in page]
+        assert len(page) <= 2
+        if cursor is None:
+            break
+    assert sorted(seen) == [f"xp_{i}" for i in range(5)]
+
+    page, _ = allocations.list_allocations(owner="alice", db_path=block_db)
+    assert sorted(lease.experiment_id for lease in page) == ["xp_1", "xp_3"]
+    page, _ = allocations.list_allocations(within="10.1.0.0/27", db_path=block_db)
+    assert all(ipaddress.IPv4Network(lease.prefix).subnet_of(ipaddress.IPv4Network("10.1.0.0/27"))
+               for lease in page)
+    assert len(page) == 2
+
+    soon = datetime.now(timezone.utc) + timedelta(minutes=11.5)
+    page, _ = allocations.list_allocations(expiring_before=soon, db_path=block_db)
+    assert sorted(lease.experiment_id for lease in page) == ["xp_0", "xp_1"]
+
+    streamed = [lease.experiment_id for lease in allocations.iter_allocations(db_path=block_db)]
+    assert streamed == seen
+
+    with pytest.raises(ValueError):
+        allocations.list_allocations(after="not a cursor", db_path=block_db)
+    with pytest.raises(ValueError):
+        allocations.list_allocations(within="10.1.0.0/33", db_path=block_db)
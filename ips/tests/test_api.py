@@ -0,0 +1,255 @@
+import io
+import json
+import subprocess
+import zipfile
+
+import pytest
+
+from kubeconfigs import KubeconfigCache
+from s3client import S3ClientManager
+
+@pytest.fixture
+def s3(api, s3_credentials, monkeypatch):
+    """The S3 storage of the app, a bucket of the moto server."""
+    manager = S3ClientManager(s3_credentials)
+    monkeypatch.setattr(api, "s3", manager)
+    yield manager
+    manager.close()
+
+BUNDLE = bytes(range(256)) * 64
+
+@pytest.fixture
+def bundle(s3):
+    client, bucket = s3.get()
+    return client.put_object(Bucket=bucket, Key="xp_1.zip", Body=BUNDLE)["ETag"]
+
+def test_get_pos_script_streams_the_bundle(client, bundle):
+    response = client.get("/pos/script/xp_1")
+    assert response.status_code == 200
+    assert response.content == BUNDLE
+    assert response.headers["etag"] == bundle
+    assert response.headers["content-length"] == str(len(BUNDLE))
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["last-modified"].endswith(" GMT")
+
+def test_get_pos_script_range(client, bundle):
+    response = client.get("/pos/script/xp_1", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == BUNDLE[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(BUNDLE)}"
+
+    response = client.get("/pos/script/xp_1", headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.content == BUNDLE[-10:]
+
+    # Multiple ranges are not supported, the whole file is sent
+    response = client.get("/pos/script/xp_1", headers={"Range": "bytes=0-1,5-6"})
+    assert response.status_code == 200
+    assert response.content == BUNDLE
+
+    response = client.get("/pos/script/xp_1", headers={"Range": f"bytes={len(BUNDLE)}-"})
+    assert response.status_code == 416
+
+def test_get_pos_script_if_none_match(client, bundle):
+    response = client.get("/pos/script/xp_1", headers={"If-None-Match": bundle})
+    assert response.status_code == 304
+    assert response.headers["etag"] == bundle
+    assert response.content == b""
+
+    response = client.get("/pos/script/xp_1", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+def test_get_pos_script_errors(client, s3, api, monkeypatch, tmp_path):
+    assert client.get("/pos/script/nope").status_code == 404
+
+    monkeypatch.setattr(api, "s3", S3ClientManager(str(tmp_path / "missing.json")))
+    assert client.get("/pos/script/xp_1").status_code == 503
+
+def make_zip(files, date_time=(2024, 1, 1, 0, 0, 0), mode=0o644):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for name, content in files.items():
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            info.external_attr = mode << 16
+            zip_file.writestr(info, content)
+    buffer.seek(0)
+    return buffer
+
+def test_bundle_digest_ignores_timestamps(api):
+    files = {"inventory.yaml": "all: {}", "deploy.sh": "#!/bin/sh"}
+    digest = api.bundle_digest(make_zip(files))
+    assert api.bundle_digest(make_zip(dict(reversed(files.items())), date_time=(2025, 6, 1, 12, 0, 0))) == digest
+    assert api.bundle_digest(make_zip(files, mode=0o755)) != digest
+    assert api.bundle_digest(make_zip({**files, "deploy.sh": "#!/bin/bash"})) != digest
+
+def test_store_bundle_uploads_each_bundle_once(api, s3):
+    client, bucket = s3.get()
+    first = make_zip({"deploy.sh": "one"})
+    digest = api.bundle_digest(first)
+
+    assert api.store_bundle(first, digest, "xp_1.zip") == "uploaded"
+    assert api.store_bundle(make_zip({"deploy.sh": "one"}), digest, "xp_1.zip") == "unchanged"
+    assert api.store_bundle(make_zip({"deploy.sh": "one"}), digest, "xp_2.zip") == "copied"
+    assert client.get_object(Bucket=bucket, Key="xp_2.zip")["Body"].read() == make_zip({"deploy.sh": "one"}).read()
+
+    second = make_zip({"deploy.sh": "two"})
+    second_digest = api.bundle_digest(second)
+    assert api.store_bundle(second, second_digest, "xp_1.zip") == "uploaded"
+    assert client.get_object(Bucket=bucket, Key="xp_1.zip")["Body"].read() == make_zip({"deploy.sh": "two"}).read()
+
+    keys = sorted(item["Key"] for item in client.list_objects_v2(Bucket=bucket)["Contents"])
+    assert keys == sorted(["xp_1.zip", "xp_2.zip", f"bundles/{digest}.zip", f"bundles/{second_digest}.zip"])
+
+@pytest.fixture
+def build_pos_bundle(api, monkeypatch):
+    """Replace the rendering of the POS scripts by a fixed bundle."""
+    def build(data, user, id):
+        bundle = make_zip({"deploy.sh": f"#!/bin/sh\n# {data.name}\n"})
+        return bundle, api.bundle_digest(bundle)
+    monkeypatch.setattr(api, "build_pos_bundle", build)
+
+POS_SCRIPT = {"experiment_id": "exp_xp_1", "name": "xp", "description": "", "deploy_node": "node",
+              "resources": [], "xp_url": "http://example.org/xp.tar.gz", "params_5g": {}}
+
+def test_post_pos_script(client, s3, build_pos_bundle):
+    response = client.post("/pos/script/", json=POS_SCRIPT)
+    assert response.status_code == 200
+    assert response.json() == {"identifier": "exp_xp_1"}
+
+    download = client.get("/pos/script/exp_xp_1")
+    assert zipfile.ZipFile(io.BytesIO(download.content)).read("deploy.sh") == b"#!/bin/sh\n# xp\n"
+
+def test_post_pos_script_storage_errors(client, api, s3_endpoint, build_pos_bundle, monkeypatch, tmp_path):
+    credentials = tmp_path / "credentials.json"
+    credentials.write_text(json.dumps({"endpointUrl": s3_endpoint, "accessKey": "test", "secretKey": "test",
+                                       "bucket": "missing-bucket"}))
+    monkeypatch.setattr(api, "s3", S3ClientManager(str(credentials)))
+    response = client.post("/pos/script/", json=dict(POS_SCRIPT, experiment_id="exp_xp_3"))
+    assert response.status_code == 503
+    assert response.json()["detail"].startswith("Failed to store the scripts")
+
+    monkeypatch.setattr(api, "s3", S3ClientManager(str(tmp_path / "missing.json")))
+    response = client.post("/pos/script/?async=true", json=dict(POS_SCRIPT, experiment_id="exp_xp_4"))
+    job_id = response.json()["job"]
+    assert client.post("/pos/script/", json=dict(POS_SCRIPT, experiment_id="exp_xp_4")).status_code == 503
+    job = client.get(f"/pos/jobs/{job_id}").json()
+    assert job["status"] == "failed"
+    assert job["error"].startswith("Failed to store the scripts")
+
+def test_post_pos_script_async(client, api, s3, build_pos_bundle):
+    data = dict(POS_SCRIPT, experiment_id="exp_xp_2")
+    response = client.post("/pos/script/?async=true", json=data)
+    assert response.status_code == 202
+    job_id = response.json()["job"]
+    assert response.headers["location"] == f"/pos/jobs/{job_id}"
+    # An identical request shares the job while it runs, or runs a new one
+    assert client.post("/pos/script/", json=data).json() == {"identifier": "exp_xp_2"}
+
+    job = client.get(f"/pos/jobs/{job_id}").json()
+    assert job["status"] == "succeeded"
+    assert job["owner"] == "alice"
+    assert job["result"]["identifier"] == "exp_xp_2"
+    assert list(job["stages"]) == ["render", "upload"]
+
+    api.app.dependency_overrides[api.validate_token] = lambda: {"preferred_username": "bob"}
+    assert client.get(f"/pos/jobs/{job_id}").status_code == 404
+    assert client.get("/pos/jobs/nope").status_code == 404
+
+def test_post_kubeconfig_is_cached(client, api, monkeypatch):
+    commands = []
+
+    def run_ssh_command_with_key(host, port, user, key_path, command):
+        commands.append(command)
+        return "apiVersion: v1\nkind: Config\nusers: []\n", "", 0
+
+    monkeypatch.setattr(api, "run_ssh_command_with_key", run_ssh_command_with_key)
+    monkeypatch.setattr(api, "kubeconfig_cache", KubeconfigCache())
+
+    for _ in range(2):
+        response = client.post("/k8s/centralhub")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-yaml"
+        assert "kind: Config" in response.text
+    assert commands == ["cd users; ./add.sh alice"]
+
+    assert client.post("/k8s/centralhub?refresh=true").status_code == 200
+    assert len(commands) == 2
+    assert client.post("/k8s/other").status_code == 404
+
+def test_post_kubeconfig_errors_are_not_cached(client, api, monkeypatch):
+    monkeypatch.setattr(api, "run_ssh_command_with_key", lambda *args: ("", "add.sh: no such user\n", 1))
+    monkeypatch.setattr(api, "kubeconfig_cache", KubeconfigCache())
+
+    response = client.post("/k8s/centralhub")
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Failed to generate the kubeconfig: add.sh: no such user"
+    assert len(api.kubeconfig_cache) == 0
+
+@pytest.fixture
+def r2lab(api, monkeypatch, tmp_path):
+    """
+    The commands run on R2LAB, run locally with a fake rhubarbe which reports
+    every device ON but `panther`, which can't be reached, and fails to
+    connect to R2LAB to power `n300` on.
+    """
+    rhubarbe = tmp_path / "rhubarbe"
+    rhubarbe.write_text('#!/bin/sh\n'
+                        'case "$3" in panther) echo "panther unreachable" >&2; exit 1;; esac\n'
+                        'case "$2" in status) echo "$3 is ON";; *) echo "$3 turned $2";; esac\n')
+    rhubarbe.chmod(0o755)
+    commands = []
+
+    def run_ssh_command_with_key(host, port, user, key_path, command):
+        commands.append(command)
+        if command == "rhubarbe pdu on n300":
+            raise OSError("Connection reset")
+        result = subprocess.run(["sh", "-c", command], capture_output=True, text=True,
+                                env={"PATH": f"{tmp_path}:/usr/bin:/bin"})
+        return result.stdout, result.stderr, result.returncode
+
+    monkeypatch.setattr(api, "run_ssh_command_with_key", run_ssh_command_with_key)
+    monkeypatch.setattr(api, "r2lab_states", api.DeviceStateCache(api.fetch_r2lab_states, ttl=10))
+    return commands
+
+def test_get_r2lab_states_are_cached(client, api, r2lab):
+    response = client.get("/r2lab/")
+    assert response.status_code == 200
+    states = response.json()["states"]
+    assert states == {device: "ON" for device in api.r2lab_devices if device != "panther"} | {"panther": "UNKNOWN"}
+
+    client.get("/r2lab/")
+    # The states of all the devices are read with a single command
+    assert len(r2lab) == 1
+
+def test_patch_r2lab_batch(client, api, r2lab):
+    client.get("/r2lab/")
+    response = client.patch("/r2lab/", json={"states": {"jaguar": "off", "panther": "ON", "n300": "on"}})
+    assert response.status_code == 200
+    devices = response.json()["devices"]
+    assert devices["jaguar"] == {"state": "OFF", "ok": True, "output": "jaguar turned off\n", "error": "",
+                                 "seconds": devices["jaguar"]["seconds"]}
+    # rhubarbe failed
+    assert devices["panther"] == {"state": "ON", "ok": False, "output": "", "error": "panther unreachable\n",
+                                  "seconds": devices["panther"]["seconds"]}
+    assert not devices["n300"]["ok"]
+    assert devices["n300"]["error"] == "Connection reset"
+    assert "rhubarbe pdu off jaguar" in r2lab
+
+    # The states are read again after a change
+    fetched = len(r2lab)
+    client.get("/r2lab/")
+    assert len(r2lab) == fetched + 1
+
+    response = client.patch("/r2lab/", json={"states": {"jaguar": "maybe"}})
+    assert response.status_code == 422
+
+def test_prefix_lengths_are_bounded(client, api):
+    body = {"token": "unused"}
+    assert client.post("/prefix/?prefixlen=31", json=body).status_code == 422
+    response = client.post("/prefix/?prefixlen=16", json=body)
+    assert response.status_code == 403
+    assert client.post("/prefix/batch/?prefixlen=16", json={"tokens": []}).status_code == 403
+
+    # Admins may, the request then fails on its invalid token
+    api.app.dependency_overrides[api.validate_token] = lambda: {"preferred_username": "admin"}
+    assert client.post("/prefix/?prefixlen=16", json=body).status_code == 401
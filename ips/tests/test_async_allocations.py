@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+import pytest
+
+import allocations
+from allocations import NoPrefixAvailable
+from async_allocations import AsyncAllocations
+from backends import SQLiteBackend
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / "network_data.db")
+    allocations.create_schema(path)
+    allocations.add_ips([f"10.0.0.{i}" for i in range(1, 33)], db_path=path)
+    allocations.add_blocks("10.1.0.0/24", db_path=path)
+    store = AsyncAllocations(SQLiteBackend(path))
+    yield store
+    store.close()
+    allocations.close_connections()
+
+def test_calls_run_off_the_event_loop(store, monkeypatch):
+    threads = set()
+    get_allocation = allocations.get_allocation
+
+    def spy(*args, **kwargs):
+        threads.add(threading.current_thread().name)
+        return get_allocation(*args, **kwargs)
+    monkeypatch.setattr(allocations, "get_allocation", spy)
+
+    async def main():
+        return await asyncio.gather(*(store.get_allocation("alice", f"xp_{i}") for i in range(8)))
+
+    leases = asyncio.run(main())
+    assert len({lease.prefix for lease in leases}) == 8
+    # Writes are serialized on the writer thread
+    assert len(threads) == 1 and threads.pop().startswith("allocations-writer")
+
+def test_results_and_errors_are_those_of_the_module(store):
+    async def main():
+        leases, failures = await store.allocate_many([("alice", "xp_1"), ("alice", "xp_2")], prefixlen=25)
+        assert sorted(leases) == ["xp_1", "xp_2"]
+        with pytest.raises(NoPrefixAvailable):
+            await store.get_allocation("alice", "xp_3", prefixlen=25)
+
+        assert await store.remaining_subnets(prefixlen=25) == 0
+        assert await store.release_many(["xp_1", "xp_2"]) == ["xp_1", "xp_2"]
+        return await store.pool_stats(prefixlen=25)
+
+    stats = asyncio.run(main())
+    assert stats["prefixes"]["free"] == 2
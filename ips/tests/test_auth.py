@@ -0,0 +1,139 @@
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from auth import KeySet, RoleIndex, TokenCache, TokenVerifier
+from jsonstore import JsonStore
+
+def rsa_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def write_jwks(path, keys):
+    jwks = {"keys": [dict(json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key())),
+                          kid=kid, alg="RS256", use="sig")
+                     for kid, key in keys.items()]}
+    path.write_text(json.dumps(jwks))
+
+def token(key, kid, exp=3600, **claims):
+    claims = {"preferred_username": "alice", "exp": int(time.time()) + exp, **claims}
+    return jwt.encode(claims, key, algorithm="RS256", headers={"kid": kid})
+
+@pytest.fixture
+def key():
+    return rsa_key()
+
+@pytest.fixture
+def jwks_path(tmp_path, key):
+    path = tmp_path / "jwks.json"
+    write_jwks(path, {"k1": key})
+    return path
+
+@pytest.fixture
+def verifier(jwks_path):
+    key_set = KeySet(str(jwks_path), min_refresh_interval=60)
+    key_set.refresh()
+    return TokenVerifier(key_set)
+
+def test_valid_token(verifier, key):
+    claims = verifier.decode(token(key, "k1"))
+    assert claims["preferred_username"] == "alice"
+
+def test_expired_token(verifier, key):
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verifier.decode(token(key, "k1", exp=-60))
+
+def test_token_without_expiration(verifier, key):
+    unbounded = jwt.encode({"preferred_username": "alice"}, key, algorithm="RS256", headers={"kid": "k1"})
+    with pytest.raises(jwt.MissingRequiredClaimError):
+        verifier.decode(unbounded)
+
+def test_forged_token(verifier):
+    with pytest.raises(jwt.InvalidSignatureError):
+        verifier.decode(token(rsa_key(), "k1"))
+
+def test_symmetric_token_is_rejected(verifier):
+    forged = jwt.encode({"preferred_username": "alice", "exp": int(time.time()) + 60},
+                        "secret", algorithm="HS256", headers={"kid": "k1"})
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.decode(forged)
+
+def test_unknown_kid(verifier, key):
+    with pytest.raises(jwt.InvalidTokenError, match="Unknown signing key"):
+        verifier.decode(token(key, "nope"))
+
+def test_unknown_kid_picks_up_rotated_keys(tmp_path, key):
+    path = tmp_path / "jwks.json"
+    write_jwks(path, {"k1": key})
+    key_set = KeySet(str(path), min_refresh_interval=0)
+    key_set.refresh()
+    verifier = TokenVerifier(key_set)
+
+    rotated = rsa_key()
+    write_jwks(path, {"k1": key, "k2": rotated})
+    assert verifier.decode(token(rotated, "k2"))["preferred_username"] == "alice"
+    assert key_set.stats["refreshes"] == 2
+
+def test_unknown_kid_refreshes_are_rate_limited(verifier, key):
+    key_set = verifier.key_set
+    for _ in range(5):
+        with pytest.raises(jwt.InvalidTokenError):
+            verifier.decode(token(key, "nope"))
+    # The initial load and a single refresh for the unknown key
+    assert key_set.stats["refreshes"] == 2
+
+def test_audience(jwks_path, key):
+    key_set = KeySet(str(jwks_path))
+    key_set.refresh()
+    verifier = TokenVerifier(key_set, audience="slices")
+    assert verifier.decode(token(key, "k1", aud="slices"))
+    with pytest.raises(jwt.InvalidAudienceError):
+        verifier.decode(token(key, "k1", aud="other"))
+
+def test_valid_tokens_are_cached(verifier, key):
+    valid = token(key, "k1")
+    verifier.decode(valid)
+    verifier.decode(valid)
+    assert (verifier.cache.hits, verifier.cache.misses) == (1, 1)
+
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verifier.decode(token(key, "k1", exp=-60))
+    assert len(verifier.cache) == 1
+
+def test_cache_hits_until_expiration():
+    cache = TokenCache()
+    cache.put("token", {"preferred_username": "alice", "exp": time.time() + 60})
+    assert cache.get("token")["preferred_username"] == "alice"
+    assert cache.get("other") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_cache_drops_expired_tokens():
+    cache = TokenCache()
+    cache.put("token", {"exp": time.time() - 1})
+    assert cache.get("token") is None
+    assert len(cache) == 0
+
+def test_cache_evicts_the_least_recently_used_token():
+    cache = TokenCache(maxsize=2)
+    for token in ("a", "b"):
+        cache.put(token, {"exp": time.time() + 60})
+    cache.get("a")
+    cache.put("c", {"exp": time.time() + 60})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+def test_role_index_follows_the_store(tmp_path):
+    path = tmp_path / "db.json"
+    path.write_text(json.dumps({"_roles": {"admin": ["alice"], "user": ["alice", "bob"]}}))
+    store = JsonStore(str(path))
+    store.load()
+    index = RoleIndex(store)
+
+    assert index.roles_of("alice") == {"admin", "user"}
+    assert index.roles_of("bob") == {"user"}
+    assert index.roles_of("carol") == set()
+
+    store.data["_roles"]["admin"].append("bob")
+    assert index.roles_of("bob") == {"admin", "user"}
@@ -0,0 +1,132 @@
+import ipaddress
+import time
+
+import pytest
+
+import allocations
+from allocations import NoPrefixAvailable
+from backends import SQLiteBackend
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path):
+    """Each allocation backend, with 32 IPs and a /24 block to carve prefixes from."""
+    if request.param == "sqlite":
+        backend = SQLiteBackend(str(tmp_path / "network_data.db"))
+        allocations.create_schema(backend.db_path)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        from redis_allocations import RedisBackend
+        backend = RedisBackend(fakeredis.FakeRedis(decode_responses=True))
+
+    backend.add_ips("10.0.0.1-10.0.0.32")
+    backend.add_blocks("10.1.0.0/24")
+    yield backend
+    backend.close()
+
+def test_allocate_release_round_trip(backend):
+    first = backend.get_allocation("alice", "xp_1", prefixlen=26)
+    second = backend.get_allocation("alice", "xp_2", prefixlen=28)
+    assert not ipaddress.IPv4Network(first.prefix).overlaps(ipaddress.IPv4Network(second.prefix))
+    assert first.ip != second.ip
+    assert backend.get_allocation("alice", "xp_1", prefixlen=26) == first
+
+    assert backend.delete_allocation("xp_1") == 1
+    assert backend.delete_allocation("xp_1") == 0
+    assert backend.release_many(["xp_2", "xp_3"]) == ["xp_2"]
+
+    # The released prefixes were merged back into the whole block
+    assert backend.get_allocation("bob", "xp_4", prefixlen=24).prefix == "10.1.0.0/24"
+    assert backend.remaining_ips() == 31
+
+def test_allocate_many_is_all_or_nothing(backend):
+    requests = [("alice", f"xp_{i}") for i in range(3)]
+
+    with pytest.raises(NoPrefixAvailable):
+        backend.allocate_many(requests, prefixlen=25)
+    assert backend.remaining_ips() == 32
+    assert backend.pool_stats(prefixlen=25)["prefixes"]["free"] == 2
+
+    leases, failures = backend.allocate_many(requests, best_effort=True, prefixlen=25)
+    assert sorted(leases) == ["xp_0", "xp_1"]
+    assert list(failures) == ["xp_2"]
+    assert isinstance(failures["xp_2"], NoPrefixAvailable)
+
+def test_expired_leases(backend):
+    backend.get_allocation("alice", "xp_1", duration=60)
+    expired = backend.get_allocation("alice", "xp_2", duration=0)
+    time.sleep(1.1)
+
+    stats = backend.pool_stats()
+    assert stats["leases"]["active"] == 1
+    assert sum(stats["leases"]["age"].values()) == 1
+
+    # An expired lease is never returned, the experiment gets a new one
+    renewed = backend.get_allocation("alice", "xp_2", duration=60)
+    assert renewed.expiration_time > expired.expiration_time
+
+    backend.get_allocation("alice", "xp_3", duration=0)
+    time.sleep(1.1)
+    assert backend.remove_expired_allocations() == 1
+    assert sorted(lease.experiment_id for lease in backend.list_allocations()[0]) == ["xp_1", "xp_2"]
+
+def test_pool_stats(backend):
+    stats = backend.pool_stats(prefixlen=27)
+    assert (stats["ips"]["total"], stats["ips"]["free"]) == (32, 32)
+    assert (stats["prefixes"]["total"], stats["prefixes"]["free"]) == (8, 8)
+
+    backend.get_allocation("alice", "xp_1", prefixlen=26)
+    stats = backend.pool_stats(prefixlen=27)
+    assert stats["ips"]["free"] == 31
+    assert stats["prefixes"]["free"] == 6
+    assert stats["leases"]["active"] == 1
+
+def test_prefix_capacity_is_not_changed_by_allocations(backend):
+    backend.add_subnets(["10.2.0.0/27", "10.2.0.32/27"])
+    assert backend.pool_stats(prefixlen=27)["prefixes"]["total"] == 10
+    # The two subnets are buddies, they also hold a /26
+    assert backend.pool_stats(prefixlen=26)["prefixes"]["total"] == 5
+
+    for i, length in enumerate([28, 30, 26, 29]):
+        backend.get_allocation("alice", f"xp_{i}", prefixlen=length)
+        stats = backend.pool_stats(prefixlen=27)["prefixes"]
+        assert stats["total"] == 10
+    # One /27 was split for the /28, /30 and /29, two taken by the /26
+    assert stats["free"] == 7
+
+def test_redis_pool_blocks_are_built_for_existing_stores(tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    from redis_allocations import RedisBackend
+
+    backend = RedisBackend(fakeredis.FakeRedis(decode_responses=True))
+    backend.add_blocks("10.1.0.0/24")
+    # As kept before the blocks of the pool were
+    backend.redis.delete(*backend.redis.keys("allocations:blocks:*"))
+    assert backend.pool_stats(prefixlen=27)["prefixes"]["total"] == 0
+
+    pool = tmp_path / "pool.json"
+    pool.write_text('{"ips": ["10.0.0.1"]}')
+    backend.create(str(pool))
+    assert backend.pool_stats(prefixlen=27)["prefixes"]["total"] == 8
+    backend.close()
+
+def test_redis_pool_stats_reads_expired_leases_in_batches(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import redis_allocations
+    from redis_allocations import RedisBackend
+
+    monkeypatch.setattr(redis_allocations, "REAP_BATCH_SIZE", 2)
+    backend = RedisBackend(fakeredis.FakeRedis(decode_responses=True))
+    backend.add_ips("10.0.0.1-10.0.0.8")
+    backend.add_blocks("10.1.0.0/24")
+    backend.get_allocation("alice", "xp_0", duration=60)
+    for i in range(1, 6):
+        backend.get_allocation("alice", f"xp_{i}", duration=0)
+    time.sleep(1.1)
+
+    stats = backend.pool_stats()
+    assert stats["leases"]["active"] == 1
+    assert sum(stats["leases"]["age"].values()) == 1
+    backend.close()
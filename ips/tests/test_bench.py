@@ -0,0 +1,70 @@
+import itertools
+
+import pytest
+
+import allocations
+import bench
+from backends import SQLiteBackend
+
+pytest.importorskip("pytest_benchmark")
+
+pytestmark = pytest.mark.benchmark
+
+# Room for every round of the benchmarks
+POOL_SIZE = 2000
+ROUNDS = 200
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path):
+    """Each allocation backend, with a synthetic pool of `POOL_SIZE` IPs and /27 subnets."""
+    if request.param == "sqlite":
+        db_path = str(tmp_path / "bench.db")
+        allocations.create_schema(db_path)
+        backend = SQLiteBackend(db_path)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        from redis_allocations import RedisBackend
+        backend = RedisBackend(fakeredis.FakeRedis(decode_responses=True))
+
+    bench.fill_pool(backend, POOL_SIZE)
+    yield backend
+    backend.close()
+    allocations.close_connections()
+
+def test_get_allocation_new(benchmark, backend):
+    ids = (f"xp_{i}" for i in itertools.count())
+
+    def setup():
+        return ("bench", next(ids)), {}
+
+    benchmark.pedantic(backend.get_allocation, setup=setup, rounds=ROUNDS)
+    assert backend.remaining_ips() == POOL_SIZE - ROUNDS
+
+def test_get_allocation_existing(benchmark, backend):
+    lease = backend.get_allocation("bench", "xp")
+    assert benchmark(backend.get_allocation, "bench", "xp") == lease
+
+def test_delete_allocation(benchmark, backend):
+    ids = (f"xp_{i}" for i in itertools.count())
+
+    def setup():
+        experiment_id = next(ids)
+        backend.get_allocation("bench", experiment_id)
+        return (experiment_id,), {}
+
+    benchmark.pedantic(backend.delete_allocation, setup=setup, rounds=ROUNDS)
+    assert backend.remaining_ips() == POOL_SIZE
+
+def test_remove_expired_allocations(benchmark, backend):
+    batches = itertools.count()
+
+    def setup():
+        # Leases that expired a minute ago
+        batch = next(batches)
+        for i in range(ROUNDS):
+            backend.get_allocation("bench", f"expired_{batch}_{i}", duration=-1)
+        return (), {}
+
+    removed = benchmark.pedantic(backend.remove_expired_allocations, setup=setup, rounds=5)
+    assert removed == ROUNDS
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+
+from executors import BoundedExecutor, ExecutorSaturated
+
+@pytest.fixture
+def executor():
+    executor = BoundedExecutor("test", workers=2, queue_size=1)
+    yield executor
+    executor.shutdown()
+
+def test_runs_calls_in_its_threads(executor):
+    async def main():
+        return await executor.run(lambda x, y=0: (threading.current_thread().name, x + y), 1, y=2)
+
+    name, result = asyncio.run(main())
+    assert name.startswith("test")
+    assert result == 3
+    assert executor.stats["completed"] == 1
+
+def test_errors_are_raised_to_the_caller(executor):
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(executor.run(fail))
+    assert executor.stats["active"] == 0
+
+def test_calls_beyond_the_queue_are_rejected(executor):
+    release = threading.Event()
+
+    async def main():
+        # 2 running calls and 1 queued fill the pool
+        calls = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        stats = executor.stats
+        assert (stats["active"], stats["queued"], stats["saturation"]) == (2, 1, 1.0)
+
+        with pytest.raises(ExecutorSaturated):
+            await executor.run(release.wait)
+
+        release.set()
+        await asyncio.gather(*calls)
+
+    asyncio.run(main())
+    stats = executor.stats
+    assert (stats["completed"], stats["rejected"], stats["peak"]) == (3, 1, 3)
+    assert stats["max_wait_ms"] > 0
+
+def test_cancelled_caller_frees_the_slot_when_the_call_ends(executor):
+    release = threading.Event()
+
+    async def main():
+        call = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        await asyncio.sleep(0)
+        # The thread still runs the call, so its slot is still taken
+        assert executor.stats["active"] == 1
+        release.set()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    stats = executor.stats
+    assert (stats["active"], stats["queued"], stats["completed"]) == (0, 0, 1)
@@ -0,0 +1,47 @@
+import ipaddress
+
+import pytest
+
+from ip import IPPool, generate_ip_pool, pick_and_remove_ip
+
+def test_pick_take_release():
+    pool = IPPool("192.0.2.0/29")
+    assert len(pool) == 6
+    assert ipaddress.IPv4Address("192.0.2.0") not in pool
+
+    pool.take("192.0.2.6")
+    with pytest.raises(ValueError):
+        pool.take("192.0.2.6")
+    picked = pool.pick()
+    assert picked not in pool and len(pool) == 4
+
+    pool.release(picked)
+    assert picked in pool
+    with pytest.raises(ValueError):
+        pool.release(picked)
+
+def test_serialization_round_trip():
+    pool = IPPool("192.0.2.0/27")
+    taken = {pool.pick() for _ in range(10)}
+
+    restored = IPPool.from_bytes(pool.to_bytes())
+    assert set(restored) == set(pool)
+    assert not taken & set(restored)
+
+def test_pick_and_remove_ip_empties_the_pool():
+    pool = generate_ip_pool("192.0.2.0/30")
+    picked = {pick_and_remove_ip(pool) for _ in range(2)}
+    assert picked == {ipaddress.IPv4Address("192.0.2.1"), ipaddress.IPv4Address("192.0.2.2")}
+    with pytest.raises(ValueError):
+        pick_and_remove_ip(pool)
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:-1],
+    lambda data: data + b"\0",
+    lambda data: data[:3],
+    lambda data: data[:-1] + bytes([data[-1] | 0x80]),
+])
+def test_corrupted_serialization_is_rejected(corrupt):
+    data = IPPool("192.0.2.0/29").to_bytes()
+    with pytest.raises(ValueError):
+        IPPool.from_bytes(corrupt(data))
@@ -0,0 +1,175 @@
+import asyncio
+import sqlite3
+import subprocess
+import threading
+
+import pytest
+
+from jobs import JobQueue, JobQueueFull
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+def run_queue(db_path, scenario, **kwargs):
+    """Run `scenario(queue)` in an event loop, with a queue stopped and closed afterwards."""
+    async def main():
+        queue = JobQueue(db_path, **kwargs)
+        try:
+            return await scenario(queue)
+        finally:
+            await queue.stop()
+            queue.close()
+    return asyncio.run(main())
+
+def test_job_records_its_stages_and_result(db_path):
+    async def work(job):
+        async with job.stage("render"):
+            await asyncio.sleep(0.05)
+        async with job.stage("upload"):
+            await asyncio.sleep(0.01)
+        return {"identifier": "xp"}
+
+    async def scenario(queue):
+        job_id, future = await queue.submit("pos-script", "alice", work)
+        assert queue.get(job_id)["status"] in ("queued", "running")
+        assert await future == {"identifier": "xp"}
+        return queue.get(job_id)
+
+    job = run_queue(db_path, scenario)
+    assert job["status"] == "succeeded"
+    assert job["owner"] == "alice"
+    assert job["result"] == {"identifier": "xp"}
+    assert list(job["stages"]) == ["render", "upload"]
+    assert job["stages"]["render"] >= 0.05
+    assert job["created"] <= job["started"] <= job["finished"]
+
+def test_failed_job_records_its_error(db_path):
+    async def work(job):
+        async with job.stage("render"):
+            raise ValueError("bad parameters")
+
+    async def scenario(queue):
+        job_id, future = await queue.submit("pos-script", "alice", work)
+        with pytest.raises(ValueError):
+            await future
+        return queue.get(job_id)
+
+    job = run_queue(db_path, scenario)
+    assert job["status"] == "failed"
+    assert job["error"] == "bad parameters"
+    assert "render" in job["stages"]
+
+def test_identical_jobs_are_deduplicated(db_path):
+    calls = []
+
+    async def work(job):
+        calls.append(job.id)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def scenario(queue):
+        submitted = await asyncio.gather(*(queue.submit("pos-script", "alice", work, key="same") for _ in range(5)))
+        assert len({job_id for job_id, _ in submitted}) == 1
+        results = await asyncio.gather(*(future for _, future in submitted))
+
+        # Once finished, the same key runs a new job
+        job_id, future = await queue.submit("pos-script", "alice", work, key="same")
+        assert job_id != submitted[0][0]
+        return results, await future
+
+    results, again = run_queue(db_path, scenario)
+    assert results == [1] * 5
+    assert again == 2
+    assert len(calls) == 2
+
+def test_queue_rejects_jobs_beyond_max_pending(db_path):
+    release = None
+
+    async def work(job):
+        await release.wait()
+
+    async def scenario(queue):
+        nonlocal release
+        release = asyncio.Event()
+        running = [await queue.submit("pos-script", "alice", work)]
+        await asyncio.sleep(0.05)
+        waiting = [await queue.submit("pos-script", "alice", work) for _ in range(2)]
+        with pytest.raises(JobQueueFull):
+            await queue.submit("pos-script", "alice", work)
+
+        release.set()
+        await asyncio.gather(*(future for _, future in running + waiting))
+
+    run_queue(db_path, scenario, workers=1, max_pending=2)
+
+def test_jobs_of_gone_processes_are_failed(db_path):
+    JobQueue(db_path).close()
+
+    sibling = subprocess.Popen(["sleep", "30"])
+    gone = subprocess.Popen(["true"])
+    gone.wait()
+    try:
+        conn = sqlite3.connect(db_path)
+        conn.executemany("INSERT INTO jobs (id, kind, owner, status, created, pid) VALUES (?, 'k', 'o', ?, 0, ?)",
+                         [("live", "running", sibling.pid), ("orphan", "running", gone.pid),
+                          ("waiting", "queued", gone.pid)])
+        conn.commit()
+        conn.close()
+
+        queue = JobQueue(db_path)
+        assert queue.get("live")["status"] == "running"
+        for job_id in ("orphan", "waiting"):
+            job = queue.get(job_id)
+            assert job["status"] == "failed"
+            assert job["error"] == "Interrupted by a restart"
+        queue.close()
+    finally:
+        sibling.kill()
+        sibling.wait()
+
+def test_unknown_job(db_path):
+    queue = JobQueue(db_path)
+    assert queue.get("nope") is None
+    queue.close()
+
+def test_stop_fails_the_unfinished_jobs(db_path):
+    async def work(job):
+        await asyncio.sleep(10)
+
+    async def scenario(queue):
+        running, _ = await queue.submit("pos-script", "alice", work)
+        waiting, _ = await queue.submit("pos-script", "alice", work)
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        return [queue.get(job_id) for job_id in (running, waiting)]
+
+    for job in run_queue(db_path, scenario, workers=1):
+        assert job["status"] == "failed"
+        assert job["error"] == "Interrupted by a restart"
+
+def test_database_is_not_used_on_the_event_loop(db_path, monkeypatch):
+    queue = JobQueue(db_path)
+    threads = []
+    transaction = queue._transaction
+
+    def recording_transaction():
+        threads.append(threading.current_thread())
+        return transaction()
+
+    monkeypatch.setattr(queue, "_transaction", recording_transaction)
+
+    async def work(job):
+        async with job.stage("render"):
+            return "done"
+
+    async def main():
+        queue.start()
+        job_id, future = await queue.submit("pos-script", "alice", work)
+        assert await future == "done"
+        await queue.stop()
+
+    asyncio.run(main())
+    queue.close()
+    assert threads
+    assert threading.main_thread() not in threads
@@ -0,0 +1,102 @@
+import asyncio
+import errno
+import json
+import os
+
+import pytest
+
+import jsonstore
+from jsonstore import JsonStore, TrackedDict, TrackedList
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / "db.json"
+    path.write_text(json.dumps({"users": {"alice": {"roles": ["user"]}}, "experiments": []}))
+    store = JsonStore(str(path), delay=0.05, max_delay=0.5)
+    store.load()
+    return store
+
+def read(store):
+    with open(store.path) as f:
+        return json.load(f)
+
+def test_nested_changes_are_tracked(store):
+    assert not store.dirty
+    version = store.version
+
+    store.data["users"]["alice"]["roles"].append("admin")
+    assert store.dirty
+    assert store.version == version + 1
+
+    store.data["experiments"].append({"id": "xp_1", "nodes": []})
+    store.data["experiments"][0]["nodes"].append(1)
+    assert isinstance(store.data["experiments"][0], TrackedDict)
+    assert isinstance(store.data["experiments"][0]["nodes"], TrackedList)
+    assert store.version == version + 3
+
+    store.flush()
+    assert not store.dirty
+    # Reads don't mark the document dirty
+    assert store.data["users"]["alice"]["roles"] == ["user", "admin"]
+    assert not store.dirty
+
+def test_flush_writes_only_when_dirty(store):
+    store.flush()
+    assert store.stats["writes"] == 0
+
+    store.data["experiments"].append("xp_1")
+    store.flush()
+    assert read(store)["experiments"] == ["xp_1"]
+    assert store.stats["writes"] == 1
+    store.flush()
+    assert store.stats["writes"] == 1
+    # No temporary file is left behind
+    assert os.listdir(os.path.dirname(store.path)) == ["db.json"]
+
+def test_load_discards_unsaved_changes(store):
+    store.data["experiments"].append("xp_1")
+    store.load()
+    assert store.data["experiments"] == []
+    assert not store.dirty
+
+def test_bursts_of_changes_are_written_once(store):
+    async def main():
+        store.start()
+        for i in range(20):
+            store.data["experiments"].append(f"xp_{i}")
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+        writes = store.stats["writes"]
+
+        store.data["experiments"].pop()
+        await store.stop()
+        return writes
+
+    assert asyncio.run(main()) == 1
+    assert store.stats["writes"] == 2
+    assert read(store)["experiments"] == [f"xp_{i}" for i in range(19)]
+
+def test_busy_file_is_rewritten_in_place(store, monkeypatch):
+    def replace(src, dst):
+        raise OSError(errno.EBUSY, "Device or resource busy")
+    monkeypatch.setattr(jsonstore.os, "replace", replace)
+
+    store.data["experiments"].append("xp_1")
+    store.flush()
+    assert read(store)["experiments"] == ["xp_1"]
+    assert os.listdir(os.path.dirname(store.path)) == ["db.json"]
+
+def test_failed_write_keeps_the_changes(store, monkeypatch):
+    def replace(src, dst):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    monkeypatch.setattr(jsonstore.os, "replace", replace)
+
+    store.data["experiments"].append("xp_1")
+    with pytest.raises(OSError):
+        store.flush()
+    assert store.dirty
+    assert store.stats["last_error"]
+
+    monkeypatch.undo()
+    store.flush()
+    assert read(store)["experiments"] == ["xp_1"]
@@ -0,0 +1,165 @@
+import asyncio
+import base64
+import datetime
+import os
+import time
+
+import jwt
+import pytest
+import yaml
+from cryptography import x509
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from kubeconfigs import KubeconfigCache, credentials_expiration, load_kubeconfig_cache
+
+def certificate_data(lifetime):
+    """Base64 PEM of a self-signed certificate valid for `lifetime` seconds."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "alice")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(name).issuer_name(name)
+                   .public_key(key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now - datetime.timedelta(minutes=1))
+                   .not_valid_after(now + datetime.timedelta(seconds=lifetime))
+                   .sign(key, hashes.SHA256()))
+    return base64.b64encode(certificate.public_bytes(serialization.Encoding.PEM)).decode()
+
+def kubeconfig(**user):
+    return {"apiVersion": "v1", "kind": "Config", "users": [{"name": "alice", "user": user}]}
+
+class Generator:
+    """Coroutine function returning `config`, counting its calls."""
+    def __init__(self, config, delay=0):
+        self.config = config
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.config
+
+def test_credentials_expiration():
+    exp = int(time.time()) + 600
+    token = jwt.encode({"exp": exp}, "secret", algorithm="HS256")
+    config = {"users": [{"name": "a", "user": {"client-certificate-data": certificate_data(7200)}},
+                        {"name": "b", "user": {"token": token}}]}
+    assert credentials_expiration(config) == exp
+
+    assert credentials_expiration(kubeconfig(token="not-a-jwt")) is None
+    assert credentials_expiration({"users": None}) is None
+
+    expiration = credentials_expiration(kubeconfig(**{"client-certificate-data": certificate_data(7200)}))
+    assert expiration == pytest.approx(time.time() + 7200, abs=5)
+
+def test_concurrent_requests_share_one_generation():
+    cache = KubeconfigCache()
+    generate = Generator(kubeconfig(token="static"), delay=0.05)
+
+    async def main():
+        first = await asyncio.gather(*(cache.get("alice", "hub", generate) for _ in range(10)))
+        return first, await cache.get("alice", "hub", generate)
+
+    first, again = asyncio.run(main())
+    assert generate.calls == 1
+    assert set(first) == {again}
+    assert yaml.safe_load(again) == generate.config
+    assert cache.stats["hits"] == 1
+
+def test_entries_expire_before_their_credentials():
+    cache = KubeconfigCache(margin=300)
+    short = Generator(kubeconfig(**{"client-certificate-data": certificate_data(200)}))
+    long = Generator(kubeconfig(**{"client-certificate-data": certificate_data(7200)}))
+
+    async def main():
+        for _ in range(2):
+            await cache.get("alice", "hub", short)
+            await cache.get("bob", "hub", long)
+
+    asyncio.run(main())
+    # Credentials expiring within the margin are never cached
+    assert short.calls == 2
+    assert long.calls == 1
+    (_, expires), = cache._entries.values()
+    assert expires == pytest.approx(time.time() + 7200 - 300, abs=5)
+
+def test_least_recently_used_entries_are_dropped():
+    cache = KubeconfigCache(maxsize=2)
+    generate = Generator(kubeconfig(token="static"))
+
+    async def main():
+        for user in ["alice", "bob", "alice", "carol", "alice", "bob"]:
+            await cache.get(user, "hub", generate)
+
+    asyncio.run(main())
+    assert len(cache) == 2
+    # bob was dropped for carol, and generated again
+    assert generate.calls == 4
+
+def test_failed_generation_is_not_cached():
+    cache = KubeconfigCache()
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise RuntimeError("add.sh failed")
+
+    async def main():
+        results = await asyncio.gather(*(cache.get("alice", "hub", generate) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        with pytest.raises(RuntimeError):
+            await cache.get("alice", "hub", generate)
+
+    asyncio.run(main())
+    assert len(calls) == 2
+    assert len(cache) == 0
+
+def test_invalidate():
+    cache = KubeconfigCache()
+    generate = Generator(kubeconfig(token="static"))
+
+    async def main():
+        await cache.get("alice", "hub", generate)
+        cache.invalidate("alice", "hub")
+        await cache.get("alice", "hub", generate)
+
+    asyncio.run(main())
+    assert generate.calls == 2
+
+def test_spilled_kubeconfigs_survive_a_restart(tmp_path):
+    key = Fernet.generate_key()
+    spill_dir = str(tmp_path / "kubeconfigs")
+    generate = Generator(kubeconfig(token="secret-token"))
+
+    first = KubeconfigCache(spill_dir=spill_dir, spill_key=key)
+    content = asyncio.run(first.get("alice", "hub", generate))
+
+    (name,) = os.listdir(spill_dir)
+    with open(os.path.join(spill_dir, name)) as spill_file:
+        assert "secret-token" not in spill_file.read()
+
+    restarted = KubeconfigCache(spill_dir=spill_dir, spill_key=key)
+    assert asyncio.run(restarted.get("alice", "hub", generate)) == content
+    assert restarted.stats["spill_hits"] == 1
+    assert generate.calls == 1
+
+    # Spilled with another key, the kubeconfig is generated again
+    rekeyed = KubeconfigCache(spill_dir=spill_dir, spill_key=Fernet.generate_key())
+    assert asyncio.run(rekeyed.get("alice", "hub", generate)) == content
+    assert generate.calls == 2
+
+    rekeyed.invalidate("alice", "hub")
+    assert os.listdir(spill_dir) == []
+
+def test_spill_dir_requires_a_key(monkeypatch, tmp_path):
+    monkeypatch.setenv("KUBECONFIG_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("KUBECONFIG_CACHE_KEY", raising=False)
+    with pytest.raises(ValueError):
+        load_kubeconfig_cache()
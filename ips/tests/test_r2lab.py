@@ -0,0 +1,82 @@
+import asyncio
+import subprocess
+
+from r2lab import DeviceStateCache, parse_pdu_state, parse_pdu_states, pdu_status_command
+
+def test_parse_pdu_state():
+    assert parse_pdu_state("jaguar is ON\n") == "ON"
+    assert parse_pdu_state("n300: off") == "OFF"
+    assert parse_pdu_state("unreachable") == "UNKNOWN"
+    # Only whole words count
+    assert parse_pdu_state("online") == "UNKNOWN"
+
+def test_pdu_status_command_output_is_split_per_device(tmp_path):
+    rhubarbe = tmp_path / "rhubarbe"
+    rhubarbe.write_text('#!/bin/sh\n'
+                        'case "$3" in jaguar) echo "jaguar is ON";; '
+                        'panther) echo "unreachable" >&2;; *) echo "$3 is off";; esac\n')
+    rhubarbe.chmod(0o755)
+
+    devices = ["jaguar", "panther", "n300"]
+    output = subprocess.run(["sh", "-c", pdu_status_command(devices)], capture_output=True, text=True,
+                            env={"PATH": f"{tmp_path}:/usr/bin:/bin"}).stdout
+    assert parse_pdu_states(output, devices + ["qhat01"]) == {
+        "jaguar": "ON", "panther": "UNKNOWN", "n300": "OFF", "qhat01": "UNKNOWN"}
+
+def test_fetch_started_before_invalidate_is_not_cached():
+    async def scenario():
+        fetches = []
+
+        async def fetch():
+            fetches.append(None)
+            version = len(fetches)
+            await asyncio.sleep(0.05)
+            return {"jaguar": version}
+
+        cache = DeviceStateCache(fetch, ttl=10)
+        stale = asyncio.create_task(cache.get())
+        await asyncio.sleep(0.01)
+        cache.invalidate()
+
+        # Waiters of the stale fetch get its states, later requests a new fetch
+        assert (await stale)[0] == {"jaguar": 1}
+        assert (await cache.get())[0] == {"jaguar": 2}
+        assert (await cache.get())[0] == {"jaguar": 2}
+        return len(fetches)
+
+    assert asyncio.run(scenario()) == 2
+
+def test_concurrent_requests_share_a_fetch():
+    async def scenario():
+        fetches = []
+
+        async def fetch():
+            fetches.append(None)
+            await asyncio.sleep(0.05)
+            return {"jaguar": "ON"}
+
+        cache = DeviceStateCache(fetch, ttl=10)
+        results = await asyncio.gather(*(cache.get() for _ in range(5)))
+        assert all(states == {"jaguar": "ON"} for states, _ in results)
+        return len(fetches)
+
+    assert asyncio.run(scenario()) == 1
+
+def test_states_are_fetched_again_once_stale_or_invalidated():
+    async def scenario():
+        fetches = []
+
+        async def fetch():
+            fetches.append(None)
+            return {"jaguar": len(fetches)}
+
+        cache = DeviceStateCache(fetch, ttl=10)
+        assert (await cache.get())[0] == {"jaguar": 1}
+        assert (await cache.get())[0] == {"jaguar": 1}
+        cache.invalidate()
+        assert (await cache.get())[0] == {"jaguar": 2}
+
+        cache.ttl = 0
+        assert (await cache.get())[0] == {"jaguar": 3}
+
+    asyncio.run(scenario())
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import pytest
+
+import allocations
+from async_allocations import AsyncAllocations
+from backends import SQLiteBackend
+from reaper import ExpiryReaper
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "network_data.db")
+    allocations.create_schema(path)
+    allocations.add_ips([f"10.0.0.{i}" for i in range(1, 5)], db_path=path)
+    allocations.add_subnets([f"10.1.{i}.0/27" for i in range(4)], db_path=path)
+    yield path
+    allocations.close_connections()
+
+@pytest.fixture
+def store(db_path):
+    store = AsyncAllocations(SQLiteBackend(db_path))
+    yield store
+    store.close()
+
+def test_run_once_removes_expired_allocations(db_path, store):
+    allocations.get_allocation("alice", "xp_1", duration=60, db_path=db_path)
+    allocations.get_allocation("alice", "xp_2", duration=0, db_path=db_path)
+    time.sleep(1.1)
+
+    reaper = ExpiryReaper(store)
+    assert asyncio.run(reaper.run_once()) == 1
+    assert reaper.stats["runs"] == 1
+    assert reaper.stats["removed_total"] == 1
+    assert reaper.stats["last_removed"] == 1
+
+def test_delay_follows_the_next_expiration(db_path, store):
+    reaper = ExpiryReaper(store, min_interval=1, max_interval=60)
+    assert asyncio.run(reaper._delay()) == 60
+
+    allocations.get_allocation("alice", "xp_1", duration=10, db_path=db_path)
+    assert 590 <= asyncio.run(ExpiryReaper(store, max_interval=3600)._delay()) <= 600
+
+    allocations.get_allocation("alice", "xp_2", duration=0, db_path=db_path)
+    assert asyncio.run(reaper._delay()) == 1
+
+def test_reaper_task_runs_until_stopped(store):
+    async def main():
+        reaper = ExpiryReaper(store, min_interval=0.05, max_interval=0.05)
+        reaper.start()
+        await asyncio.sleep(0.2)
+        await reaper.stop()
+        return reaper.stats
+
+    stats = asyncio.run(main())
+    assert stats["runs"] >= 2
+    assert stats["last_error"] is None
@@ -0,0 +1,53 @@
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from s3client import S3ClientManager
+
+@pytest.fixture
+def manager(s3_credentials):
+    manager = S3ClientManager(s3_credentials)
+    yield manager
+    manager.close()
+
+def test_client_is_shared_until_the_credentials_change(manager, s3_credentials):
+    client, bucket = manager.get()
+    client.put_object(Bucket=bucket, Key="a.zip", Body=b"content")
+    assert manager.get() == (client, bucket)
+    assert manager.stats["loads"] == 1
+
+    with open(s3_credentials) as f:
+        credentials = json.load(f)
+    credentials["bucket"] = "other"
+    with open(s3_credentials, "w") as f:
+        json.dump(credentials, f)
+    os.utime(s3_credentials, ns=(0, 0))
+
+    new_client, new_bucket = manager.get()
+    assert new_client is not client and new_bucket == "other"
+    assert manager.stats["loads"] == 2
+    # The previous client still works for the calls using it
+    assert client.get_object(Bucket=bucket, Key="a.zip")["Body"].read() == b"content"
+
+def test_client_is_thread_safe_and_pooled(manager):
+    client, bucket = manager.get()
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: manager.get()[0].upload_fileobj(io.BytesIO(b"%d" % i), bucket, f"{i}.zip"),
+                          range(32)))
+    assert len(client.list_objects_v2(Bucket=bucket)["Contents"]) == 32
+    assert manager.stats["loads"] == 1
+    assert client.meta.config.max_pool_connections == 50
+
+def test_missing_credentials(tmp_path):
+    manager = S3ClientManager(str(tmp_path / "missing.json"))
+    with pytest.raises(OSError):
+        manager.get()
+
+def test_close_reloads_on_next_use(manager):
+    client, _ = manager.get()
+    manager.close()
+    assert manager.get()[0] is not client
+    assert manager.stats["loads"] == 2
@@ -0,0 +1,132 @@
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+import pytest
+
+from sshpool import SSHPool
+
+class Server(paramiko.ServerInterface):
+    """
+    SSH server answering `out:<command>` to every command, after `delay`
+    seconds, but `exit:<status>` which fails with that status.
+    """
+    def __init__(self, state):
+        self.state = state
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_channel_request(self, kind, chanid):
+        if self.state["refuse"]:
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        def run():
+            time.sleep(self.state["delay"])
+            if command.startswith(b"exit:"):
+                channel.sendall_stderr(b"failed")
+                channel.send_exit_status(int(command[5:]))
+            else:
+                channel.sendall(b"out:" + command)
+                channel.send_exit_status(0)
+            channel.close()
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+@pytest.fixture
+def server(tmp_path):
+    host_key = paramiko.RSAKey.generate(2048)
+    client_key = tmp_path / "id_rsa"
+    paramiko.RSAKey.generate(2048).write_private_key_file(str(client_key))
+    state = {"delay": 0.05, "refuse": False, "transports": [], "key_path": str(client_key)}
+
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    state["port"] = listener.getsockname()[1]
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(host_key)
+            transport.start_server(server=Server(state))
+            state["transports"].append(transport)
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield state
+    listener.close()
+    for transport in state["transports"]:
+        transport.close()
+
+@pytest.fixture
+def pool():
+    pool = SSHPool(max_sessions=8)
+    yield pool
+    pool.close()
+
+def run(pool, server, command):
+    return pool.run("127.0.0.1", server["port"], "backend", server["key_path"], command, timeout=10)
+
+def test_commands_share_one_connection(pool, server):
+    with ThreadPoolExecutor(16) as executor:
+        results = list(executor.map(lambda i: run(pool, server, f"cmd{i}"), range(40)))
+
+    assert results == [(f"out:cmd{i}", "", 0) for i in range(40)]
+    assert pool.stats["connects"] == 1
+    assert pool.stats["commands"] == 40
+    assert len(server["transports"]) == 1
+
+def test_exit_status(pool, server):
+    assert run(pool, server, "exit:3") == ("", "failed", 3)
+
+def test_dropped_transport_is_reopened_once(pool, server):
+    assert run(pool, server, "first") == ("out:first", "", 0)
+    server["transports"][0].close()
+    time.sleep(0.2)
+
+    with ThreadPoolExecutor(16) as executor:
+        results = list(executor.map(lambda i: run(pool, server, f"cmd{i}"), range(32)))
+
+    assert results == [(f"out:cmd{i}", "", 0) for i in range(32)]
+    assert pool.stats["reconnects"] == 1
+    assert len(server["transports"]) == 2
+
+def test_refused_session_keeps_the_connection(pool, server):
+    server["delay"] = 0.5
+    with ThreadPoolExecutor(1) as executor:
+        running = executor.submit(run, pool, server, "long")
+        time.sleep(0.2)
+
+        server["refuse"] = True
+        with pytest.raises(paramiko.ChannelException):
+            run(pool, server, "refused")
+        server["refuse"] = False
+
+        # The command running on the connection was not interrupted
+        assert running.result() == ("out:long", "", 0)
+    assert pool.stats["connects"] == 1
+    assert pool.stats["reconnects"] == 0
+
+def test_idle_connections_are_evicted(pool, server):
+    run(pool, server, "cmd")
+    assert len(pool.status()) == 1
+
+    pool.idle_timeout = 0
+    pool.evict_idle()
+    assert pool.status() == []
+    assert pool.stats["evictions"] == 1
+
+    assert run(pool, server, "again") == ("out:again", "", 0)
+    assert pool.stats["connects"] == 2